@@ -0,0 +1,58 @@
+"""hourly city stats rollup
+
+Revision ID: 1f3effb42033
+Revises: 4e1b25385d52
+Create Date: 2026-10-18 11:58:20.610473
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1f3effb42033'
+down_revision: Union[str, None] = '4e1b25385d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'weather_stats_hourly',
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('city_key', sa.String(), nullable=False),
+        sa.Column('city_id', sa.Integer(), nullable=True),
+        sa.Column('city', sa.String(), nullable=True),
+        sa.Column('requests', sa.BigInteger(), nullable=False),
+        sa.Column('cache_hits', sa.BigInteger(), nullable=False),
+        sa.Column('temperature_min', sa.Float(), nullable=True),
+        sa.Column('temperature_max', sa.Float(), nullable=True),
+        sa.Column('temperature_sum', sa.Float(), nullable=True),
+        sa.Column('humidity_min', sa.Integer(), nullable=True),
+        sa.Column('humidity_max', sa.Integer(), nullable=True),
+        sa.Column('humidity_sum', sa.BigInteger(), nullable=True),
+        sa.Column('wind_speed_min', sa.Float(), nullable=True),
+        sa.Column('wind_speed_max', sa.Float(), nullable=True),
+        sa.Column('wind_speed_sum', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('hour', 'city_key'),
+    )
+    op.create_index(
+        'ix_weather_stats_hourly_city_key_hour', 'weather_stats_hourly', ['city_key', 'hour'], unique=False
+    )
+    # Starts at 0: the rollup job folds the existing history in batches on its
+    # first runs instead of this migration scanning the whole table.
+    op.create_table(
+        'rollup_watermarks',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('last_id', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rollup_watermarks')
+    op.drop_index('ix_weather_stats_hourly_city_key_hour', table_name='weather_stats_hourly')
+    op.drop_table('weather_stats_hourly')
@@ -0,0 +1,57 @@
+"""weather_queries city_id
+
+Revision ID: 4e1b25385d52
+Revises: 52b1a407fc82
+Create Date: 2026-10-18 10:41:07.218344
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.cities import get_city_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e1b25385d52'
+down_revision: Union[str, None] = '52b1a407fc82'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    op.add_column('weather_queries', sa.Column('city_id', sa.Integer(), nullable=True))
+    op.create_index('ix_weather_queries_city_id', 'weather_queries', ['city_id'], unique=False)
+
+    # Resolve the names already stored in city_normalized with the same index
+    # the application uses; names it does not know keep a NULL city_id.
+    names = bind.execute(sa.text(
+        "SELECT DISTINCT city_normalized FROM weather_queries WHERE city_normalized IS NOT NULL"
+    )).scalars().all()
+    index = get_city_index()
+    resolved = [(name, city.id) for name in names if (city := index.resolve(name)) is not None]
+
+    for i in range(0, len(resolved), BACKFILL_CHUNK_SIZE):
+        chunk = resolved[i:i + BACKFILL_CHUNK_SIZE]
+        params = {}
+        values = []
+        for j, (name, city_id) in enumerate(chunk):
+            params[f"n{j}"] = name
+            params[f"i{j}"] = city_id
+            values.append(f"(:n{j}, :i{j})")
+        bind.execute(sa.text(
+            "UPDATE weather_queries SET city_id = v.city_id "
+            f"FROM (VALUES {', '.join(values)}) AS v(name, city_id) "
+            "WHERE weather_queries.city_normalized = v.name"
+        ), params)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_weather_queries_city_id', table_name='weather_queries')
+    op.drop_column('weather_queries', 'city_id')
@@ -0,0 +1,116 @@
+"""partition weather_queries by timestamp
+
+Revision ID: 52b1a407fc82
+Revises: fa403e4842da
+Create Date: 2026-10-18 09:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.partitions import DEFAULT_PARTITION, ensure_partitions
+
+
+# revision identifiers, used by Alembic.
+revision: str = '52b1a407fc82'
+down_revision: Union[str, None] = 'fa403e4842da'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUMNS = (
+    "id, city, city_normalized, unit, temperature, description, humidity, "
+    "wind_speed, served_from_cache, ip_address, timestamp"
+)
+
+
+def _trgm_available(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    )).scalar() is not None
+
+
+def _create_indexes(bind) -> None:
+    op.create_index('ix_weather_queries_city', 'weather_queries', ['city'], unique=False)
+    op.create_index('ix_weather_queries_id', 'weather_queries', ['id'], unique=False)
+    op.create_index('ix_weather_queries_timestamp_id', 'weather_queries', ['timestamp', 'id'], unique=False)
+    op.create_index('ix_weather_queries_city_normalized', 'weather_queries', ['city_normalized'], unique=False)
+    if _trgm_available(bind):
+        op.create_index(
+            'ix_weather_queries_city_normalized_trgm', 'weather_queries', ['city_normalized'],
+            unique=False, postgresql_using='gin', postgresql_ops={'city_normalized': 'gin_trgm_ops'}
+        )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    op.execute("ALTER TABLE weather_queries RENAME TO weather_queries_legacy")
+    op.execute("ALTER TABLE weather_queries_legacy RENAME CONSTRAINT weather_queries_pkey TO weather_queries_legacy_pkey")
+
+    # The id sequence is reused so ids keep growing from where they were.
+    op.execute("""
+        CREATE TABLE weather_queries (
+            id integer NOT NULL DEFAULT nextval('weather_queries_id_seq'),
+            city varchar,
+            city_normalized varchar,
+            unit varchar,
+            temperature double precision,
+            description varchar,
+            humidity integer,
+            wind_speed double precision,
+            served_from_cache boolean,
+            ip_address varchar,
+            timestamp timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    op.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF weather_queries DEFAULT")
+
+    oldest = bind.execute(sa.text("SELECT min(timestamp) FROM weather_queries_legacy")).scalar()
+    ensure_partitions(bind, start=oldest)
+
+    # Rows without a timestamp cannot be routed by it; they end up in the default partition.
+    op.execute(
+        f"INSERT INTO weather_queries ({COLUMNS}) "
+        "SELECT id, city, city_normalized, unit, temperature, description, humidity, "
+        "wind_speed, served_from_cache, ip_address, coalesce(timestamp, 'epoch'::timestamp) "
+        "FROM weather_queries_legacy"
+    )
+
+    op.execute("ALTER SEQUENCE weather_queries_id_seq OWNED BY weather_queries.id")
+    op.execute("DROP TABLE weather_queries_legacy")
+    _create_indexes(bind)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+
+    op.execute("ALTER TABLE weather_queries RENAME TO weather_queries_partitioned")
+    op.execute(
+        "ALTER TABLE weather_queries_partitioned RENAME CONSTRAINT weather_queries_pkey "
+        "TO weather_queries_partitioned_pkey"
+    )
+    op.execute("""
+        CREATE TABLE weather_queries (
+            id integer NOT NULL DEFAULT nextval('weather_queries_id_seq'),
+            city varchar,
+            city_normalized varchar,
+            unit varchar,
+            temperature double precision,
+            description varchar,
+            humidity integer,
+            wind_speed double precision,
+            served_from_cache boolean,
+            ip_address varchar,
+            timestamp timestamp without time zone,
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute(f"INSERT INTO weather_queries ({COLUMNS}) SELECT {COLUMNS} FROM weather_queries_partitioned")
+    op.execute("ALTER SEQUENCE weather_queries_id_seq OWNED BY weather_queries.id")
+    # Dropping the parent drops every partition with it.
+    op.execute("DROP TABLE weather_queries_partitioned")
+    _create_indexes(bind)
@@ -0,0 +1,60 @@
+"""normalized city column
+
+Revision ID: fa403e4842da
+Revises: 68be611ee220
+Create Date: 2026-10-18 07:00:08.427921
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fa403e4842da'
+down_revision: Union[str, None] = '68be611ee220'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BACKFILL_BATCH_SIZE = 50000
+
+
+def _trgm_available(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar() is not None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    op.add_column('weather_queries', sa.Column('city_normalized', sa.String(), nullable=True))
+
+    # Backfill in batches so a large table is not rewritten by one huge UPDATE.
+    while True:
+        updated = bind.execute(sa.text(
+            "UPDATE weather_queries SET city_normalized = lower(btrim(city)) "
+            "WHERE id IN (SELECT id FROM weather_queries "
+            "WHERE city_normalized IS NULL AND city IS NOT NULL LIMIT :batch)"
+        ), {"batch": BACKFILL_BATCH_SIZE}).rowcount
+        if not updated:
+            break
+
+    op.create_index('ix_weather_queries_city_normalized', 'weather_queries', ['city_normalized'], unique=False)
+
+    if _trgm_available(bind):
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index(
+            'ix_weather_queries_city_normalized_trgm', 'weather_queries', ['city_normalized'],
+            unique=False, postgresql_using='gin', postgresql_ops={'city_normalized': 'gin_trgm_ops'}
+        )
+    else:
+        print("pg_trgm is not available: substring city search will not use an index")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_weather_queries_city_normalized_trgm")
+    op.drop_index('ix_weather_queries_city_normalized', table_name='weather_queries')
+    op.drop_column('weather_queries', 'city_normalized')
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+from sqlalchemy import insert
+from app.database import AsyncSessionLocal
+from app.models import WeatherQuery
+from app.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AUDIT_WRITE_BEHIND = os.getenv("AUDIT_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+AUDIT_QUEUE_MAXSIZE = int(os.getenv("AUDIT_QUEUE_MAXSIZE", 10000))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))
+AUDIT_ENQUEUE_TIMEOUT = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT", 0.5))
+AUDIT_RETRY_BASE_DELAY = float(os.getenv("AUDIT_RETRY_BASE_DELAY", 0.5))
+AUDIT_RETRY_MAX_DELAY = float(os.getenv("AUDIT_RETRY_MAX_DELAY", 30.0))
+AUDIT_SHUTDOWN_RETRIES = int(os.getenv("AUDIT_SHUTDOWN_RETRIES", 5))
+
+_STOP = object()
+
+
+class AuditWriter:
+    """Buffers WeatherQuery rows in memory and inserts them in batches.
+
+    enqueue() returns False when the writer is not running or the queue stayed
+    full for longer than enqueue_timeout; the caller then writes the row itself.
+    A failed batch is retried with backoff until it is written, so a database
+    outage turns into backpressure instead of lost rows.
+    """
+
+    def __init__(self, session_factory, maxsize: int = AUDIT_QUEUE_MAXSIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 enqueue_timeout: float = AUDIT_ENQUEUE_TIMEOUT,
+                 retry_base_delay: float = AUDIT_RETRY_BASE_DELAY,
+                 retry_max_delay: float = AUDIT_RETRY_MAX_DELAY,
+                 shutdown_retries: int = AUDIT_SHUTDOWN_RETRIES):
+        self.session_factory = session_factory
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.shutdown_retries = shutdown_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._stop_event: Optional[asyncio.Event] = None
+        self._blocked_putters = 0
+        self.stats = {
+            "enqueued": 0,
+            "rejected": 0,
+            "flushed": 0,
+            "failed": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._closed
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def snapshot(self) -> dict:
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "queue_maxsize": self.maxsize,
+            "avg_flush_seconds": self.stats["total_flush_seconds"] / flushes if flushes else 0.0,
+        }
+
+    async def start(self):
+        if self.running:
+            return
+        self._closed = False
+        self._stop_event = asyncio.Event()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"audit_writer_started batch_size={self.batch_size} interval={self.flush_interval}s")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # From here on a failing flush gives up after shutdown_retries, so a
+        # database outage cannot keep shutdown waiting forever.
+        self._closed = True
+        self._stop_event.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except asyncio.QueueFull:
+            # The writer is busy with a full queue; it checks _closed after each batch.
+            pass
+        task, self._task = self._task, None
+        await task
+        # Rows queued behind the sentinel, or by callers that were blocked on a
+        # full queue when stop() began, are written here before returning.
+        while not self._queue.empty() or self._blocked_putters:
+            await self._drain()
+            if self._blocked_putters:
+                await asyncio.sleep(0)
+        logger.info(f"audit_writer_stopped {self._format_stats()}")
+
+    async def enqueue(self, record: dict) -> bool:
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._blocked_putters += 1
+            try:
+                await asyncio.wait_for(self._queue.put(record), timeout=self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                logger.warning(f"audit_queue_full depth={self.queue_depth}")
+                return False
+            finally:
+                self._blocked_putters -= 1
+        self.stats["enqueued"] += 1
+        return True
+
+    async def _run(self):
+        stopping = False
+        while not stopping and not self._closed:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _drain(self):
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch, max_attempts=self.shutdown_retries)
+
+    async def _flush(self, batch: list, max_attempts: Optional[int] = None) -> bool:
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with self.session_factory() as db:
+                    await db.execute(insert(WeatherQuery), batch)
+                    await db.commit()
+                break
+            except Exception as e:
+                attempt += 1
+                self.stats["flush_errors"] += 1
+                if self._closed:
+                    max_attempts = self.shutdown_retries
+                if max_attempts is not None and attempt >= max_attempts:
+                    self.stats["failed"] += len(batch)
+                    logger.error(f"audit_flush_failed rows={len(batch)} attempts={attempt} error={str(e)}")
+                    return False
+                delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1))
+                logger.warning(f"audit_flush_retry rows={len(batch)} attempt={attempt} delay={delay:.2f}s error={str(e)}")
+                if self._closed or self._stop_event is None:
+                    await asyncio.sleep(delay)
+                else:
+                    # Woken by stop() so the remaining attempts are counted against shutdown_retries.
+                    try:
+                        await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+
+        latency = time.perf_counter() - start
+        self.stats["flushes"] += 1
+        self.stats["flushed"] += len(batch)
+        self.stats["last_flush_seconds"] = latency
+        self.stats["total_flush_seconds"] += latency
+        self.stats["max_flush_seconds"] = max(self.stats["max_flush_seconds"], latency)
+        logger.info(f"audit_flush rows={len(batch)} latency={latency:.3f}s depth={self.queue_depth}")
+        return True
+
+    def _format_stats(self) -> str:
+        return " ".join(f"{k}={v}" for k, v in self.snapshot().items())
+
+
+audit_writer = AuditWriter(AsyncSessionLocal)
+
+
+audit_rows = registry.counter("audit_rows_total", "Audit rows by outcome", ("result",))
+audit_flushes = registry.counter("audit_flushes_total", "Audit batch inserts by outcome", ("result",))
+audit_queue_depth = registry.gauge("audit_queue_depth", "Audit rows waiting to be written")
+
+
+def _collect_audit_metrics():
+    for result in ("enqueued", "rejected", "flushed", "failed"):
+        audit_rows.set_total(audit_writer.stats[result], result=result)
+    audit_flushes.set_total(audit_writer.stats["flushes"], result="ok")
+    audit_flushes.set_total(audit_writer.stats["flush_errors"], result="error")
+    audit_queue_depth.set(audit_writer.queue_depth)
+
+
+registry.add_collector(_collect_audit_metrics)
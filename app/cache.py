@@ -1,34 +1,317 @@
+import asyncio
 import redis
+import redis.asyncio as aioredis
 import os
-import json
-from datetime import timedelta
-from typing import Optional
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from app.schemas import WeatherData
+from app.codecs import encode_entry, decode_entry
+from app.metrics import registry, cache_requests, redis_command_duration
 
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
+REDIS_URL = os.getenv("REDIS_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
 
+CACHE_L1_MAXSIZE = int(os.getenv("CACHE_L1_MAXSIZE", 1024))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", 30))
+# Entries are served as fresh for CACHE_SOFT_TTL and kept, stale, until CACHE_HARD_TTL.
+CACHE_SOFT_TTL = float(os.getenv("CACHE_SOFT_TTL", 300))
+CACHE_HARD_TTL = float(os.getenv("CACHE_HARD_TTL", 900))
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", 1.0))
+# A copy of every entry kept this long (sec) under fallback:{key}, served when
+# upstream is unavailable and the entry itself has expired. 0 disables it.
+CACHE_FALLBACK_TTL = float(os.getenv("CACHE_FALLBACK_TTL", 86400))
+
+# Synchronous client for scripts and maintenance; the request path uses the
+# shared asyncio pool from get_async_redis().
 redis_client = redis.from_url(REDIS_URL, decode_responses=False)
 
+_async_client: Optional[aioredis.Redis] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_closing = set()
+
+cache_stats = {
+    "l1": {"hits": 0, "misses": 0, "evictions": 0},
+    "l2": {"hits": 0, "misses": 0, "evictions": 0},
+    "refresh": {"stale_served": 0, "early": 0, "completed": 0, "failed": 0},
+}
+
+
+class CacheEntry(NamedTuple):
+    value: WeatherData
+    fresh_until: float
+    # How long the upstream fetch that produced the value took (seconds).
+    delta: float = 0.0
+    # Written by the prefetch scheduler rather than by a user request.
+    prefetched: bool = False
+
+    def is_stale(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) >= self.fresh_until
+
+    def should_refresh_early(self, beta: float = CACHE_XFETCH_BETA, now: Optional[float] = None) -> bool:
+        # Probabilistic early expiration (XFetch): the closer the entry is to going
+        # stale and the slower it was to compute, the likelier an early refresh.
+        if beta <= 0 or self.delta <= 0:
+            return False
+        now = time.time() if now is None else now
+        return now - self.delta * beta * math.log(1.0 - random.random()) >= self.fresh_until
+
+
+class LocalCache:
+    """In-process LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            cache_stats["l1"]["evictions"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            cache_stats["l1"]["evictions"] += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+local_cache = LocalCache(CACHE_L1_MAXSIZE, CACHE_L1_TTL)
+
+
+def get_async_redis() -> aioredis.Redis:
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        if _async_client is not None:
+            _discard_async_redis(_async_client)
+        pool = aioredis.ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+        _async_client = aioredis.Redis(connection_pool=pool)
+        _async_client_loop = loop
+    return _async_client
+
+
+def _discard_async_redis(client: aioredis.Redis):
+    async def close():
+        try:
+            await client.aclose(close_connection_pool=True)
+        except Exception:
+            pass
+
+    task = asyncio.get_running_loop().create_task(close())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+async def close_async_redis():
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.aclose(close_connection_pool=True)
+    _async_client = None
+    _async_client_loop = None
+
+
+def _decode_entry(data: bytes) -> CacheEntry:
+    return CacheEntry(*decode_entry(data))
 
-def get_cached_weather(key: str) -> Optional[WeatherData]:
-    data_bytes = redis_client.get(key)
+
+async def get_cached_entry(key: str, use_local: bool = True) -> Optional[CacheEntry]:
+    if use_local:
+        local = local_cache.get(key)
+        if local is not None:
+            cache_stats["l1"]["hits"] += 1
+            return local
+        cache_stats["l1"]["misses"] += 1
+
+    client = get_async_redis()
+    with redis_command_duration.time(operation="get"):
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            data_bytes, ttl_ms = await pipe.execute()
     if data_bytes:
         try:
-            data_str = data_bytes.decode('utf-8')
-            d = json.loads(data_str)
-            return WeatherData(**d)
-        except (json.JSONDecodeError, UnicodeDecodeError, TypeError) as e:
+            entry = _decode_entry(data_bytes)
+        except (ValueError, UnicodeDecodeError, TypeError, KeyError) as e:
             print(f"Ошибка декодирования кеша Redis для ключа {key}: {e}. Удаляю ключ.")
-            redis_client.delete(key)
+            await client.delete(key)
+            cache_stats["l2"]["misses"] += 1
+            cache_stats["l2"]["evictions"] += 1
             return None
+        cache_stats["l2"]["hits"] += 1
+        # Never keep a local copy longer than Redis would.
+        if ttl_ms and ttl_ms > 0:
+            local_cache.set(key, entry, ttl_ms / 1000)
+        return entry
+    cache_stats["l2"]["misses"] += 1
     return None
 
 
-def set_cached_weather(key: str, value: WeatherData, expire_minutes: int = 5):
-    data_dict = value.model_dump()
+async def get_cached_weather(key: str) -> Optional[WeatherData]:
+    entry = await get_cached_entry(key)
+    return entry.value if entry is not None else None
+
+
+async def set_cached_weather(key: str, value: WeatherData, soft_ttl: float = CACHE_SOFT_TTL,
+                             hard_ttl: float = CACHE_HARD_TTL, delta: float = 0.0, prefetched: bool = False):
+    hard_ttl = max(hard_ttl, soft_ttl)
+    entry = CacheEntry(value, time.time() + soft_ttl, delta, prefetched)
+    data = encode_entry(value, entry.fresh_until, delta, prefetched)
+
+    with redis_command_duration.time(operation="set"):
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.set(key, data, px=max(1, int(hard_ttl * 1000)))
+            if CACHE_FALLBACK_TTL > 0:
+                pipe.set(fallback_key(key), data, px=int(CACHE_FALLBACK_TTL * 1000))
+            await pipe.execute()
+    local_cache.set(key, entry, hard_ttl)
+
+
+async def get_cached_entries(keys: List[str]) -> List[Optional[CacheEntry]]:
+    """Looks up many keys: local tier first, then one MGET for the rest."""
+    entries: List[Optional[CacheEntry]] = [None] * len(keys)
+    remote = []
+    for i, key in enumerate(keys):
+        local = local_cache.get(key)
+        if local is not None:
+            cache_stats["l1"]["hits"] += 1
+            entries[i] = local
+        else:
+            cache_stats["l1"]["misses"] += 1
+            remote.append(i)
+    if not remote:
+        return entries
+
+    client = get_async_redis()
+    remote_keys = [keys[i] for i in remote]
+    with redis_command_duration.time(operation="mget"):
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.mget(remote_keys)
+            for key in remote_keys:
+                pipe.pttl(key)
+            values, *ttls = await pipe.execute()
+
+    corrupt = []
+    for i, key, data_bytes, ttl_ms in zip(remote, remote_keys, values, ttls):
+        if not data_bytes:
+            cache_stats["l2"]["misses"] += 1
+            continue
+        try:
+            entry = _decode_entry(data_bytes)
+        except (ValueError, UnicodeDecodeError, TypeError, KeyError):
+            corrupt.append(key)
+            cache_stats["l2"]["misses"] += 1
+            cache_stats["l2"]["evictions"] += 1
+            continue
+        cache_stats["l2"]["hits"] += 1
+        if ttl_ms and ttl_ms > 0:
+            local_cache.set(key, entry, ttl_ms / 1000)
+        entries[i] = entry
+    if corrupt:
+        await client.delete(*corrupt)
+    return entries
+
+
+async def set_cached_entries(values: Dict[str, Tuple[WeatherData, float]], soft_ttl: float = CACHE_SOFT_TTL,
+                             hard_ttl: float = CACHE_HARD_TTL):
+    """Writes {key: (value, delta)} in one pipelined round trip."""
+    if not values:
+        return
+    hard_ttl = max(hard_ttl, soft_ttl)
+    fresh_until = time.time() + soft_ttl
+    with redis_command_duration.time(operation="mset"):
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            for key, (value, delta) in values.items():
+                data = encode_entry(value, fresh_until, delta)
+                pipe.set(key, data, px=max(1, int(hard_ttl * 1000)))
+                if CACHE_FALLBACK_TTL > 0:
+                    pipe.set(fallback_key(key), data, px=int(CACHE_FALLBACK_TTL * 1000))
+            await pipe.execute()
+    for key, (value, delta) in values.items():
+        local_cache.set(key, CacheEntry(value, fresh_until, delta), hard_ttl)
+
+
+def fallback_key(key: str) -> str:
+    return f"fallback:{key}"
+
+
+async def get_fallback_entries(keys: List[str]) -> List[Optional[CacheEntry]]:
+    """Last known values for keys whose cache entries may already have expired."""
+    if not keys or CACHE_FALLBACK_TTL <= 0:
+        return [None] * len(keys)
+    with redis_command_duration.time(operation="fallback_get"):
+        values = await get_async_redis().mget([fallback_key(key) for key in keys])
+    entries = []
+    for data_bytes in values:
+        try:
+            entries.append(_decode_entry(data_bytes) if data_bytes else None)
+        except (ValueError, UnicodeDecodeError, TypeError, KeyError):
+            entries.append(None)
+    return entries
+
+
+def _collect_cache_metrics():
+    for tier in ("l1", "l2"):
+        cache_requests.set_total(cache_stats[tier]["hits"], tier=tier, result="hit")
+        cache_requests.set_total(cache_stats[tier]["misses"], tier=tier, result="miss")
+
+
+registry.add_collector(_collect_cache_metrics)
+
+
+async def get_cache_stats() -> dict:
+    stats = {tier: dict(counters) for tier, counters in cache_stats.items()}
+    stats["l1"]["size"] = len(local_cache)
+    # Server-wide counter: covers every key in the Redis instance, not just weather entries.
+    try:
+        stats["l2"]["server_evicted_keys"] = int((await get_async_redis().info("stats")).get("evicted_keys", 0))
+    except redis.RedisError:
+        pass
+    return stats
+
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+async def acquire_lock(key: str, ttl_ms: int) -> Optional[str]:
+    token = uuid.uuid4().hex
+    if await get_async_redis().set(key, token, nx=True, px=ttl_ms):
+        return token
+    return None
 
-    json_data = json.dumps(data_dict)
 
-    redis_client.setex(key, timedelta(minutes=expire_minutes), json_data)
\ No newline at end of file
+async def release_lock(key: str, token: str):
+    await get_async_redis().eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
@@ -0,0 +1,108 @@
+import bisect
+import gzip
+import json
+import logging
+import os
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# OpenWeatherMap city.list.json(.gz) format: [{"id", "name", "country", ...}].
+# Entries may carry an extra "aliases" list. The bundled file only covers a
+# few dozen cities; point CITY_LIST_PATH at the full OpenWeatherMap list.
+CITY_LIST_PATH = os.getenv("CITY_LIST_PATH", os.path.join(os.path.dirname(__file__), "data", "cities.json"))
+
+
+class City(NamedTuple):
+    id: int
+    name: str
+    country: str
+
+
+def normalize_name(name: str) -> str:
+    # Case, accents and repeated whitespace do not distinguish cities.
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.casefold().split())
+
+
+def parse_query(query: str) -> Tuple[str, Optional[str]]:
+    """Splits "London,GB" into ("london", "GB"); the country is optional."""
+    name, sep, country = query.rpartition(",")
+    if sep and name.strip() and len(country.strip()) == 2:
+        return normalize_name(name), country.strip().upper()
+    return normalize_name(query), None
+
+
+class CityIndex:
+    """Name, alias and ID lookups over a city list, plus prefix search."""
+
+    def __init__(self, entries: Iterable[dict]):
+        self._by_id: Dict[int, City] = {}
+        self._by_name: Dict[str, List[City]] = {}
+        for entry in entries:
+            city = City(int(entry["id"]), entry["name"], entry.get("country") or "")
+            if city.id in self._by_id:
+                continue
+            self._by_id[city.id] = city
+            for name in (entry["name"], *entry.get("aliases", ())):
+                cities = self._by_name.setdefault(normalize_name(name), [])
+                if city not in cities:
+                    cities.append(city)
+        # Sorted once so prefix search is a bisect plus a short scan.
+        self._names = sorted(self._by_name)
+
+    @classmethod
+    def load(cls, path: str = CITY_LIST_PATH) -> "CityIndex":
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            index = cls(json.load(f))
+        logger.info(f"city_index_loaded path={path} cities={len(index)} names={len(index._names)}")
+        return index
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def get(self, city_id: int) -> Optional[City]:
+        return self._by_id.get(city_id)
+
+    def resolve(self, query: str) -> Optional[City]:
+        query = query.strip()
+        if query.isdigit():
+            return self._by_id.get(int(query))
+        name, country = parse_query(query)
+        candidates = self._by_name.get(name, [])
+        if country:
+            candidates = [c for c in candidates if c.country == country]
+        # Without a country the first entry in the list wins, so order the
+        # list with the best-known city of each name first.
+        return candidates[0] if candidates else None
+
+    def search(self, prefix: str, limit: int = 10) -> List[City]:
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        results: List[City] = []
+        seen = set()
+        i = bisect.bisect_left(self._names, prefix)
+        while i < len(self._names) and self._names[i].startswith(prefix) and len(results) < limit:
+            for city in self._by_name[self._names[i]]:
+                if city.id not in seen and len(results) < limit:
+                    seen.add(city.id)
+                    results.append(city)
+            i += 1
+        return results
+
+
+@lru_cache(maxsize=1)
+def get_city_index() -> CityIndex:
+    try:
+        return CityIndex.load()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"city_index_load_error path={CITY_LIST_PATH} error={str(e)}")
+        return CityIndex([])
@@ -0,0 +1,105 @@
+import json
+import math
+import os
+import struct
+from typing import Dict, NamedTuple
+from app.schemas import WeatherData
+
+# Codec used for new cache writes. Every worker reads both formats, so switch
+# only after all of them run a version that knows the new one.
+CACHE_CODEC = os.getenv("CACHE_CODEC", "struct")
+
+
+class DecodedEntry(NamedTuple):
+    value: WeatherData
+    fresh_until: float
+    delta: float
+    prefetched: bool
+
+
+_validate_weather = WeatherData.__pydantic_validator__.validate_python
+
+
+def _weather(temperature, description, humidity, wind_speed) -> WeatherData:
+    # Cache payloads are written by this service, but model_construct() measures
+    # about twice as slow as the compiled pydantic-core validator for a model
+    # this small (see benchmarks/bench_codec.py), so the validator is used directly.
+    return _validate_weather({
+        "temperature": temperature,
+        "description": description,
+        "humidity": humidity,
+        "wind_speed": wind_speed,
+    })
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, value: WeatherData, fresh_until: float, delta: float, prefetched: bool) -> bytes:
+        return json.dumps({
+            "value": value.model_dump(), "fresh_until": fresh_until, "delta": delta, "prefetched": prefetched
+        }).encode("utf-8")
+
+    def decode(self, data: bytes) -> DecodedEntry:
+        d = json.loads(data.decode("utf-8"))
+        if "value" not in d:
+            # Entry written before soft TTLs existed: fresh until Redis expires it.
+            return DecodedEntry(_weather(**d), math.inf, 0.0, False)
+        v = d["value"]
+        return DecodedEntry(
+            _weather(v["temperature"], v["description"], v["humidity"], v["wind_speed"]),
+            float(d["fresh_until"]), float(d.get("delta", 0.0)), bool(d.get("prefetched")),
+        )
+
+
+class StructCodec:
+    """Fixed little-endian layout followed by the UTF-8 description.
+
+    version:B flags:B fresh_until:d delta:f temperature:d wind_speed:d humidity:i
+    """
+
+    name = "struct"
+    version = 1
+    _header = struct.Struct("<BBdfddi")
+    _PREFETCHED = 0x01
+
+    def encode(self, value: WeatherData, fresh_until: float, delta: float, prefetched: bool) -> bytes:
+        flags = self._PREFETCHED if prefetched else 0
+        return self._header.pack(
+            self.version, flags, fresh_until, delta, value.temperature, value.wind_speed, value.humidity
+        ) + value.description.encode("utf-8")
+
+    def decode(self, data: bytes) -> DecodedEntry:
+        try:
+            version, flags, fresh_until, delta, temperature, wind_speed, humidity = \
+                self._header.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(f"Truncated cache entry: {e}") from e
+        if version != self.version:
+            raise ValueError(f"Unknown cache entry version: {version}")
+        description = data[self._header.size:].decode("utf-8")
+        return DecodedEntry(
+            _weather(temperature, description, humidity, wind_speed),
+            fresh_until, delta, bool(flags & self._PREFETCHED),
+        )
+
+
+CODECS: Dict[str, object] = {codec.name: codec for codec in (JsonCodec(), StructCodec())}
+
+if CACHE_CODEC not in CODECS:
+    raise ValueError(f"CACHE_CODEC must be one of {sorted(CODECS)}, got {CACHE_CODEC!r}")
+
+_json = CODECS["json"]
+_struct = CODECS["struct"]
+
+
+def encode_entry(value: WeatherData, fresh_until: float, delta: float = 0.0, prefetched: bool = False,
+                 codec: str = CACHE_CODEC) -> bytes:
+    return CODECS[codec].encode(value, fresh_until, delta, prefetched)
+
+
+def decode_entry(data: bytes) -> DecodedEntry:
+    # JSON entries always start with "{"; binary ones with their version byte.
+    if data[:1] == b"{":
+        return _json.decode(data)
+    return _struct.decode(data)
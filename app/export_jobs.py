@@ -0,0 +1,396 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from sqlalchemy import func, select
+from app.cache import get_async_redis
+from app.database import AsyncSessionLocal
+from app.exporters import get_encoder
+from app.metrics import registry
+from app.models import WeatherQuery, normalize_city
+from app.utils import iter_history_rows
+from app.weather import count_query_history
+
+logger = logging.getLogger(__name__)
+
+# With several replicas this must be storage they all mount (NFS, a shared
+# volume): a job runs on one replica, its download may land on any other.
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "weather_exports"))
+# Recorded on each job, so a download that reaches a replica without the file
+# can say where it was written.
+EXPORT_NODE = os.getenv("EXPORT_NODE", socket.gethostname())
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+EXPORT_QUEUE_SIZE = int(os.getenv("EXPORT_QUEUE_SIZE", 20))
+# How long finished files and job records are kept (sec).
+EXPORT_ARTIFACT_TTL = float(os.getenv("EXPORT_ARTIFACT_TTL", 86400))
+EXPORT_SWEEP_INTERVAL = float(os.getenv("EXPORT_SWEEP_INTERVAL", 3600))
+# A date_to further in the past than this closes the window: rows are written
+# with the current time, so its contents no longer change and the file can be
+# reused until it expires. Open windows are pinned to the max(id) at submit time.
+EXPORT_SETTLE_SECONDS = float(os.getenv("EXPORT_SETTLE_SECONDS", 300))
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", 1.0))
+EXPORT_DOWNLOAD_CHUNK_SIZE = int(os.getenv("EXPORT_DOWNLOAD_CHUNK_SIZE", 256 * 1024))
+# A queued or running job not saved for this long belongs to a worker that
+# died without reaching stop(); it is reported as failed (sec).
+EXPORT_JOB_STALE_SECONDS = float(os.getenv("EXPORT_JOB_STALE_SECONDS", 120))
+
+JOB_KEY_PREFIX = "export_job:"
+ARTIFACT_KEY_PREFIX = "export_artifact:"
+
+
+class ExportQueueFull(Exception):
+    pass
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+def normalize_filters(city: str = None, date_from: datetime = None, date_to: datetime = None,
+                      city_match: str = "substring", format: str = "csv") -> dict:
+    """Filters in the form that is hashed, so equivalent requests share a file."""
+    date_from, date_to = _utc_naive(date_from), _utc_naive(date_to)
+    city = normalize_city(city) if city else None
+    return {
+        "city": city,
+        "city_match": city_match if city else None,
+        "date_from": date_from.isoformat() if date_from else None,
+        "date_to": date_to.isoformat() if date_to else None,
+        "format": format,
+    }
+
+
+def artifact_key(filters: dict, watermark: str) -> str:
+    digest = hashlib.sha256(json.dumps(filters, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+    return f"{digest}-{watermark}"
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single-range Range header into inclusive (start, end).
+
+    Returns None when the header should be ignored (other units, several
+    ranges, bad syntax) and raises ValueError when it cannot be satisfied.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    if not first:
+        if not last.isdigit():
+            return None
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("unsatisfiable range")
+        return max(size - length, 0), size - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("unsatisfiable range")
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+async def read_file_range(path: str, start: int, end: int,
+                          chunk_size: int = EXPORT_DOWNLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def job_view(job: dict) -> dict:
+    done = job["status"] == "done"
+    if done:
+        progress = 1.0
+    elif job.get("rows_estimate"):
+        # The planner estimate can be off; never report a running job as finished.
+        progress = min(job["rows_written"] / job["rows_estimate"], 0.99)
+    else:
+        progress = 0.0
+    return {
+        **job,
+        "progress": round(progress, 4),
+        "download_url": f"/export/jobs/{job['id']}/download" if done else None,
+    }
+
+
+class ExportJobRunner:
+    """Runs submitted exports in a fixed number of worker tasks.
+
+    Job records live in Redis so any API worker can report on them; files are
+    written to the export directory under a name derived from the filters and
+    the data watermark, and an identical later request gets the existing file.
+    Jobs in this process are re-saved every stale_after / 4 seconds, so a
+    record that stops being refreshed marks a job nobody is running.
+    """
+
+    def __init__(self, directory: str = EXPORT_DIR, workers: int = EXPORT_WORKERS,
+                 queue_size: int = EXPORT_QUEUE_SIZE, ttl: float = EXPORT_ARTIFACT_TTL,
+                 sweep_interval: float = EXPORT_SWEEP_INTERVAL,
+                 progress_interval: float = EXPORT_PROGRESS_INTERVAL,
+                 stale_after: float = EXPORT_JOB_STALE_SECONDS, node: str = EXPORT_NODE):
+        self.directory = directory
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.progress_interval = progress_interval
+        self.stale_after = stale_after
+        self.node = node
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Jobs queued or running in this process.
+        self._active: Dict[str, dict] = {}
+        self.stats = {"submitted": 0, "reused": 0, "completed": 0, "failed": 0, "stale": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+        logger.info(f"export_jobs_started workers={self.workers} dir={self.directory} node={self.node}")
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Otherwise these would show as queued or running until their records expire.
+        for job in list(self._active.values()):
+            job.update(status="failed", error="interrupted by shutdown", finished_at=_now())
+            try:
+                await self._save(job)
+            except Exception as e:
+                logger.error(f"export_job_save_error id={job['id']} error={str(e)}")
+        self._active.clear()
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        """Returns the job record, marking it failed if its worker is gone."""
+        data = await get_async_redis().get(JOB_KEY_PREFIX + job_id)
+        if not data:
+            return None
+        job = json.loads(data)
+        if self.is_stale(job):
+            self.stats["stale"] += 1
+            logger.warning(f"export_job_stale id={job['id']} node={job['node']} status={job['status']}")
+            job.update(status="failed", error=f"export worker on {job['node']} stopped responding",
+                       finished_at=_now())
+            await self._save(job)
+        return job
+
+    def is_stale(self, job: dict, now: float = None) -> bool:
+        if job["status"] not in ("queued", "running") or job.get("heartbeat_at") is None:
+            return False
+        return (now or time.time()) - job["heartbeat_at"] > self.stale_after
+
+    def file_path(self, job: dict) -> str:
+        return os.path.join(self.directory, job["file"])
+
+    async def _save(self, job: dict):
+        job["heartbeat_at"] = time.time()
+        await get_async_redis().set(JOB_KEY_PREFIX + job["id"], json.dumps(job), ex=int(self.ttl))
+
+    async def submit(self, city: str = None, date_from: datetime = None, date_to: datetime = None,
+                     city_match: str = "substring", format: str = "csv") -> dict:
+        """Returns the job for these filters, reusing a finished or pending one.
+
+        Raises ExportFormatUnavailable for a format whose package is missing
+        and ExportQueueFull when no more jobs can be queued.
+        """
+        encoder = get_encoder(format)
+        filters = normalize_filters(city, date_from, date_to, city_match, format)
+        closed = filters["date_to"] is not None and \
+            datetime.fromisoformat(filters["date_to"]) < datetime.utcnow() - timedelta(seconds=EXPORT_SETTLE_SECONDS)
+        max_id = None
+        if not closed:
+            async with AsyncSessionLocal() as db:
+                max_id = await db.scalar(select(func.max(WeatherQuery.id))) or 0
+        key = artifact_key(filters, "closed" if closed else str(max_id))
+
+        client = get_async_redis()
+        existing_id = await client.get(ARTIFACT_KEY_PREFIX + key)
+        if existing_id:
+            job = await self.get_job(existing_id.decode())
+            if job and (job["status"] in ("queued", "running") or
+                        job["status"] == "done" and os.path.exists(self.file_path(job))):
+                self.stats["reused"] += 1
+                return job
+
+        job = {
+            "id": uuid.uuid4().hex, "key": key, "status": "queued", "format": format, "filters": filters,
+            "max_id": max_id, "media_type": encoder.media_type, "extension": encoder.extension,
+            # Relative to the export directory, which replicas may mount at different paths.
+            "file": f"{key}.{encoder.extension}", "node": self.node,
+            "rows_written": 0, "rows_estimate": None, "bytes_written": 0, "error": None,
+            "created_at": _now(), "started_at": None, "finished_at": None, "heartbeat_at": None,
+        }
+        path = self.file_path(job)
+        if os.path.exists(path):
+            # Written by a job whose record has already expired.
+            job.update(status="done", bytes_written=os.path.getsize(path), started_at=job["created_at"],
+                       finished_at=job["created_at"])
+            self.stats["reused"] += 1
+        elif not self.running or self._queue.full():
+            raise ExportQueueFull("export queue is full")
+        else:
+            self._active[job["id"]] = job
+            self._queue.put_nowait(job["id"])
+            self.stats["submitted"] += 1
+
+        await self._save(job)
+        # Two identical submissions racing past the lookup both run; each
+        # renames a complete file into place, so the result is the same.
+        await client.set(ARTIFACT_KEY_PREFIX + key, job["id"], ex=int(self.ttl))
+        return job
+
+    async def _work(self):
+        while True:
+            job = self._active[await self._queue.get()]
+            try:
+                await self._run(job)
+                self.stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"export_job_failed id={job['id']} error={str(e)}")
+                job.update(status="failed", error=str(e) or type(e).__name__, finished_at=_now())
+                try:
+                    await self._save(job)
+                except Exception as save_error:
+                    logger.error(f"export_job_save_error id={job['id']} error={str(save_error)}")
+            self._active.pop(job["id"], None)
+
+    async def _run(self, job: dict):
+        start = time.perf_counter()
+        job.update(status="running", started_at=_now())
+        await self._save(job)
+
+        filters = job["filters"]
+        city = filters["city"]
+        city_match = filters["city_match"] or "substring"
+        date_from = datetime.fromisoformat(filters["date_from"]) if filters["date_from"] else None
+        date_to = datetime.fromisoformat(filters["date_to"]) if filters["date_to"] else None
+        encoder = get_encoder(job["format"])
+        path = self.file_path(job)
+        part_path = f"{path}.{job['id']}.part"
+        last_save = time.monotonic()
+
+        async def write(out, data: bytes):
+            if data:
+                await asyncio.to_thread(out.write, data)
+                job["bytes_written"] += len(data)
+
+        try:
+            async with AsyncSessionLocal() as db:
+                job["rows_estimate"] = await count_query_history(
+                    db, city, date_from, date_to, estimated=True, city_match=city_match
+                )
+                with open(part_path, "wb") as out:
+                    await write(out, encoder.begin())
+                    async for rows in iter_history_rows(db, city, date_from, date_to, encoder.batch_size,
+                                                        city_match, job["max_id"]):
+                        await write(out, encoder.write(rows))
+                        job["rows_written"] += len(rows)
+                        if time.monotonic() - last_save >= self.progress_interval:
+                            last_save = time.monotonic()
+                            await self._save(job)
+                    await write(out, encoder.finish())
+            os.replace(part_path, path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+        job.update(status="done", finished_at=_now())
+        await self._save(job)
+        logger.info(
+            f"export_job_done id={job['id']} format={job['format']} rows={job['rows_written']} "
+            f"bytes={job['bytes_written']} duration={time.perf_counter() - start:.2f}s"
+        )
+
+    def sweep(self, now: float = None) -> int:
+        """Deletes files older than the TTL, including leftovers of crashed jobs."""
+        cutoff = (now or time.time()) - self.ttl
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.stale_after / 4)
+            for job in list(self._active.values()):
+                try:
+                    await self._save(job)
+                except Exception as e:
+                    logger.error(f"export_job_save_error id={job['id']} error={str(e)}")
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep)
+                if removed:
+                    logger.info(f"export_sweep removed={removed}")
+            except Exception as e:
+                logger.error(f"export_sweep_error error={str(e)}")
+            await asyncio.sleep(self.sweep_interval)
+
+
+export_jobs = ExportJobRunner()
+
+export_jobs_total = registry.counter("export_jobs_total", "Export jobs by outcome", ("result",))
+export_job_queue_depth = registry.gauge("export_job_queue_depth", "Export jobs waiting for a worker")
+
+
+def _collect_export_metrics():
+    for result, value in export_jobs.stats.items():
+        export_jobs_total.set_total(value, result=result)
+    export_job_queue_depth.set(export_jobs.queue_depth)
+
+
+registry.add_collector(_collect_export_metrics)
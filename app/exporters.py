@@ -0,0 +1,276 @@
+import csv
+import io
+import json
+import os
+import re
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.utils import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_HEADER, iter_history_rows
+
+# Columnar formats compress and load best with large batches: each batch becomes
+# one Parquet row group or Arrow record batch.
+EXPORT_COLUMNAR_BATCH_SIZE = int(os.getenv("EXPORT_COLUMNAR_BATCH_SIZE", 50000))
+EXPORT_ZSTD_LEVEL = int(os.getenv("EXPORT_ZSTD_LEVEL", 3))
+
+FIELD_NAMES = [column.key for column in EXPORT_COLUMNS]
+
+
+class ExportFormatUnavailable(Exception):
+    def __init__(self, format: str, package: str):
+        super().__init__(f"format '{format}' requires the {package} package")
+        self.format = format
+        self.package = package
+
+
+def _gzip_compressor():
+    return zlib.compressobj(wbits=31)
+
+
+def _zstd_compressor():
+    import zstandard
+    return zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL).compressobj()
+
+
+COMPRESSIONS = {
+    "gz": ("application/gzip", _gzip_compressor),
+    "zst": ("application/zstd", _zstd_compressor),
+}
+
+
+class Encoder:
+    """Turns batches of EXPORT_COLUMNS rows into chunks of the output file."""
+
+    format = ""
+    media_type = "application/octet-stream"
+    extension = ""
+    batch_size = EXPORT_BATCH_SIZE
+
+    def begin(self) -> bytes:
+        return b""
+
+    def write(self, rows: List[tuple]) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class TextEncoder(Encoder):
+    def __init__(self, compression: str = None):
+        self.compressor = None
+        if compression:
+            media_type, factory = COMPRESSIONS[compression]
+            try:
+                self.compressor = factory()
+            except ImportError:
+                raise ExportFormatUnavailable(f"{self.extension}.{compression}", "zstandard")
+            self.media_type = media_type
+            self.extension = f"{self.extension}.{compression}"
+        self.format = self.extension
+
+    def _out(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) if self.compressor else data
+
+    def begin(self) -> bytes:
+        return self._out(self.header())
+
+    def write(self, rows: List[tuple]) -> bytes:
+        return self._out(self.render(rows))
+
+    def finish(self) -> bytes:
+        return self.compressor.flush() if self.compressor else b""
+
+    def header(self) -> bytes:
+        return b""
+
+    def render(self, rows: List[tuple]) -> bytes:
+        raise NotImplementedError
+
+
+class CsvEncoder(TextEncoder):
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, compression: str = None):
+        super().__init__(compression)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _take(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def header(self) -> bytes:
+        self._writer.writerow(EXPORT_HEADER)
+        return self._take()
+
+    def render(self, rows):
+        self._writer.writerows(
+            (r[0], r[1], r[2], r[3], r[4], r[5], r[6],
+             "Yes" if r[7] else "No", r[8], r[9].isoformat())
+            for r in rows
+        )
+        return self._take()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+_dumps = json.JSONEncoder(separators=(",", ":"), default=_json_default).encode
+
+
+class NdjsonEncoder(TextEncoder):
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def render(self, rows):
+        return "".join(_dumps(dict(zip(FIELD_NAMES, r))) + "\n" for r in rows).encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file that hands out what was written since the last take().
+
+    tell() keeps counting across takes, since the Parquet writer records
+    absolute offsets in the footer.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ColumnarEncoder(Encoder):
+    batch_size = EXPORT_COLUMNAR_BATCH_SIZE
+
+    def __init__(self):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ExportFormatUnavailable(self.format, "pyarrow")
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("city", pyarrow.string()),
+            ("unit", pyarrow.string()),
+            ("temperature", pyarrow.float64()),
+            ("description", pyarrow.string()),
+            ("humidity", pyarrow.int32()),
+            ("wind_speed", pyarrow.float64()),
+            ("served_from_cache", pyarrow.bool_()),
+            ("ip_address", pyarrow.string()),
+            ("timestamp", pyarrow.timestamp("us")),
+        ])
+        self.sink = _ChunkSink()
+        self.writer = None
+
+    def open_writer(self):
+        raise NotImplementedError
+
+    def begin(self):
+        self.writer = self.open_writer()
+        return self.sink.take()
+
+    def write(self, rows):
+        # Rows arrive as tuples; each column is built into an Arrow array in one call.
+        columns = list(zip(*rows))
+        batch = self.pa.record_batch(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+        self.writer.write_batch(batch)
+        return self.sink.take()
+
+    def finish(self):
+        self.writer.close()
+        return self.sink.take()
+
+
+class ArrowEncoder(ColumnarEncoder):
+    format = "arrow"
+    media_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+
+    def open_writer(self):
+        options = self.pa.ipc.IpcWriteOptions(compression="zstd")
+        return self.pa.ipc.new_stream(self.sink, self.schema, options=options)
+
+
+class ParquetEncoder(ColumnarEncoder):
+    format = "parquet"
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def open_writer(self):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.sink, self.schema, compression="zstd")
+
+
+FORMATS: Dict[str, Callable[[], Encoder]] = {
+    "csv": CsvEncoder,
+    "csv.gz": lambda: CsvEncoder("gz"),
+    "csv.zst": lambda: CsvEncoder("zst"),
+    "ndjson": NdjsonEncoder,
+    "ndjson.gz": lambda: NdjsonEncoder("gz"),
+    "ndjson.zst": lambda: NdjsonEncoder("zst"),
+    "parquet": ParquetEncoder,
+    "arrow": ArrowEncoder,
+}
+
+FORMAT_PATTERN = "^(" + "|".join(re.escape(name) for name in FORMATS) + ")$"
+
+
+def get_encoder(format: str) -> Encoder:
+    """Raises ExportFormatUnavailable when the format's optional package is missing."""
+    return FORMATS[format]()
+
+
+async def stream_history(
+        db: AsyncSession,
+        encoder: Encoder,
+        city: str = None,
+        date_from: datetime = None,
+        date_to: datetime = None,
+        city_match: str = "substring"
+) -> AsyncIterator[bytes]:
+    chunk = encoder.begin()
+    if chunk:
+        yield chunk
+    async for rows in iter_history_rows(db, city, date_from, date_to, encoder.batch_size, city_match):
+        chunk = encoder.write(rows)
+        if chunk:
+            yield chunk
+    chunk = encoder.finish()
+    if chunk:
+        yield chunk
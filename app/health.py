@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+from sqlalchemy import text
+from app.cache import get_async_redis
+from app.database import async_engine
+from app.http_client import get_http_client
+from app.metrics import registry
+from app.resilience import openweather
+from app.weather import OPENWEATHER_URL
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 10))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+# The upstream probe is an unauthenticated request (OpenWeatherMap answers 401
+# without counting it against the key), sent less often than the others.
+HEALTH_UPSTREAM_INTERVAL = float(os.getenv("HEALTH_UPSTREAM_INTERVAL", 60))
+# Readiness fails when the last completed probe round is older than this.
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", 3 * HEALTH_CHECK_INTERVAL))
+
+# Without these the service cannot answer; the upstream only degrades it,
+# since cached and last known values are still served.
+CRITICAL = ("postgres", "redis")
+
+
+async def probe_postgres():
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def probe_redis():
+    await get_async_redis().ping()
+
+
+async def probe_upstream():
+    # Sent past the circuit breaker: an open breaker is what this probe should
+    # see through, and its state is reported next to the result.
+    resp = await get_http_client().get(OPENWEATHER_URL, timeout=HEALTH_CHECK_TIMEOUT)
+    if resp.status_code >= 500:
+        raise ConnectionError(f"status {resp.status_code}")
+
+
+class HealthMonitor:
+    """Probes dependencies in the background and keeps the latest results.
+
+    The health endpoints only read this state, so frequent orchestrator
+    probes cost nothing and never reach the dependencies themselves.
+    """
+
+    def __init__(self, interval: float = HEALTH_CHECK_INTERVAL, timeout: float = HEALTH_CHECK_TIMEOUT,
+                 upstream_interval: float = HEALTH_UPSTREAM_INTERVAL, stale_after: float = HEALTH_STALE_AFTER):
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.probes: Dict[str, Callable[[], Awaitable[None]]] = {
+            "postgres": probe_postgres,
+            "redis": probe_redis,
+            "upstream": probe_upstream,
+        }
+        self.intervals = {"upstream": upstream_interval}
+        # Read when the results are shown, not when the probe ran.
+        self.details: Dict[str, Callable[[], dict]] = {
+            "upstream": lambda: {"breaker": openweather.breaker.state},
+        }
+        self.checks: Dict[str, dict] = {}
+        self.last_round: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            # One round before serving, so the endpoints never see an empty state.
+            await self.check_now()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check_now()
+            except Exception as e:
+                logger.error(f"health_monitor_error error={str(e)}")
+
+    async def _probe(self, name: str, probe: Callable[[], Awaitable[None]]):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), self.timeout)
+            status, error = "up", None
+        except asyncio.TimeoutError:
+            status, error = "down", f"timed out after {self.timeout}s"
+        except Exception as e:
+            status, error = "down", str(e) or type(e).__name__
+        previous = self.checks.get(name)
+        if previous is not None and previous["status"] != status:
+            logger.warning(f"health_changed dependency={name} status={status} error={error}")
+        self.checks[name] = {
+            "status": status,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            "checked_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "error": error,
+            "_monotonic": time.monotonic(),
+        }
+
+    async def check_now(self, force: bool = False):
+        now = time.monotonic()
+        due = {
+            name: probe for name, probe in self.probes.items()
+            if force or name not in self.checks
+            or now - self.checks[name]["_monotonic"] >= self.intervals.get(name, 0)
+        }
+        await asyncio.gather(*(self._probe(name, probe) for name, probe in due.items()))
+        self.last_round = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def is_stale(self) -> bool:
+        return self.last_round is None or time.monotonic() - self.last_round > self.stale_after
+
+    def dependencies(self) -> Dict[str, dict]:
+        return {
+            name: {**{k: v for k, v in check.items() if not k.startswith("_")}, **self.details.get(name, dict)()}
+            for name, check in self.checks.items()
+        }
+
+    def live(self) -> dict:
+        # Only this process's own health: a stuck monitor loop means a stuck
+        # event loop. Dependency outages never fail liveness.
+        alive = not self.running or not self.is_stale()
+        return {"status": "alive" if alive else "stuck", "ok": alive}
+
+    def ready(self) -> dict:
+        ready = not self.is_stale() and all(self.checks.get(name, {}).get("status") == "up" for name in CRITICAL)
+        status = "ready" if ready else "not_ready"
+        if ready and any(check["status"] != "up" for check in self.checks.values()):
+            status = "degraded"
+        return {"status": status, "ok": ready, "dependencies": self.dependencies()}
+
+
+health_monitor = HealthMonitor()
+
+dependency_up = registry.gauge("dependency_up", "1 if the last health probe succeeded", ("dependency",))
+dependency_probe_latency = registry.gauge(
+    "dependency_probe_latency_seconds", "Duration of the last health probe", ("dependency",)
+)
+
+
+def _collect_health_metrics():
+    for name, check in health_monitor.checks.items():
+        dependency_up.set(int(check["status"] == "up"), dependency=name)
+        dependency_probe_latency.set(check["latency_ms"] / 1000, dependency=name)
+
+
+registry.add_collector(_collect_health_metrics)
@@ -0,0 +1,185 @@
+import hashlib
+import math
+import os
+import time
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.cache import CACHE_HARD_TTL, CACHE_SOFT_TTL
+
+HTTP_COMPRESSION_MIN_SIZE = int(os.getenv("HTTP_COMPRESSION_MIN_SIZE", 1024))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", 6))
+# Brotli's higher qualities are far slower for little gain on JSON this size.
+HTTP_BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def weak_etag(*parts) -> str:
+    digest = hashlib.sha1("\x1f".join(map(str, parts)).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/ prefixes are ignored on both sides.
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def weather_cache_control(fresh_until: Optional[float], now: float = None) -> str:
+    """Cache-Control matching the Redis entry behind a /weather response.
+
+    max-age runs out when the entry goes stale; stale-while-revalidate covers
+    the rest of its hard TTL, during which this service also serves it stale.
+    """
+    if fresh_until is None:
+        # Last known value served during an upstream outage.
+        return "no-cache"
+    now = time.time() if now is None else now
+    if not math.isfinite(fresh_until):
+        # Entries written before soft TTLs existed carry no deadline of their
+        # own; assume they were just written.
+        fresh_until = now + CACHE_SOFT_TTL
+    max_age = max(0, int(fresh_until - now))
+    expires_in = max(0, int(fresh_until + CACHE_HARD_TTL - CACHE_SOFT_TTL - now))
+    return f"public, max-age={max_age}, stale-while-revalidate={max(0, expires_in - max_age)}"
+
+
+def _brotli_available() -> bool:
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(HTTP_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        import brotli
+        self._compressor = brotli.Compressor(quality=HTTP_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+ENCODERS = {"br": _BrotliEncoder, "gzip": _GzipEncoder}
+
+
+def choose_encoding(accept_encoding: str, brotli: bool = None) -> Optional[str]:
+    """Picks br or gzip from an Accept-Encoding header by q-value, br on ties."""
+    brotli = _brotli_available() if brotli is None else brotli
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        weight = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+    candidates = [name for name in ("br", "gzip") if brotli or name != "br"]
+    scored = [(weights.get(name, weights.get("*", 0.0)), name) for name in candidates]
+    best = max(scored, key=lambda item: item[0], default=(0.0, None))
+    return best[1] if best[0] > 0 else None
+
+
+class CompressionMiddleware:
+    """Compresses text and JSON responses of at least minimum_size bytes.
+
+    Like Starlette's GZipMiddleware, with brotli and q-value negotiation.
+    Streaming responses are compressed as they go. Responses that already
+    have a Content-Encoding, or that offer byte ranges, are passed through.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = HTTP_COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        await _CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: Optional[str], minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Optional[Send] = None
+        self.start_message: Optional[Message] = None
+        self.started = False
+        self.encoder = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        if self.start_message["status"] in (204, 206, 304):
+            return False
+        if "content-encoding" in headers or "content-range" in headers or "accept-ranges" in headers:
+            return False
+        return headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk shows whether to compress.
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.started:
+            if self.encoder is not None:
+                body = self.encoder.compress(body)
+                if not more_body:
+                    body += self.encoder.finish()
+                message = {**message, "body": body}
+            await self.send(message)
+            return
+
+        self.started = True
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if self._compressible(headers) and (more_body or len(body) >= self.minimum_size):
+            headers.add_vary_header("Accept-Encoding")
+            if self.encoding is not None:
+                self.encoder = ENCODERS[self.encoding]()
+                headers["Content-Encoding"] = self.encoding
+                body = self.encoder.compress(body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body += self.encoder.finish()
+                    headers["Content-Length"] = str(len(body))
+                message = {**message, "body": body}
+        await self.send(self.start_message)
+        await self.send(message)
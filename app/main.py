@@ -1,19 +1,37 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Query
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import logging
+import math
 import time
 import os
-from app.database import SessionLocal, engine
-from app.models import Base
-from app.weather import get_weather_for_city
-from app.rate_limiter import is_rate_limited
-from app.utils import export_history_to_csv
-from app.schemas import WeatherResponse, QueryHistoryResponse
+from app.database import get_async_db, async_engine
+from app.models import Base, normalize_city
+from app.weather import (
+    get_weather_for_city, get_weather_for_cities, wait_for_refreshes, prefetch_weather, WEATHER_BATCH_MAX_CITIES
+)
+from app.rate_limiter import check_rate_limit
+from app.exporters import ExportFormatUnavailable, FORMATS, FORMAT_PATTERN, get_encoder, stream_history
+from app.export_jobs import export_jobs, ExportQueueFull, job_view, parse_range, read_file_range
+from app.http_client import init_http_client, close_http_client
+from app.cache import close_async_redis
+from app.audit import audit_writer, AUDIT_WRITE_BEHIND
+from app.partitions import partition_maintainer, PARTITION_MAINTENANCE
+from app.prefetch import prefetcher, PREFETCH_ENABLED
+from app.cities import get_city_index
+from app.resilience import UpstreamUnavailableError, openweather
+from app.health import health_monitor
+from app.http_cache import CompressionMiddleware, weak_etag, etag_matches, weather_cache_control
+from app.rollups import rollup_worker, get_city_stats, stats_to_dict, ROLLUP_ENABLED
+from app.metrics import registry, http_request_duration, rate_limit_rejections
+from app.schemas import (
+    WeatherResponse, QueryHistoryResponse, WeatherBatchRequest, WeatherBatchResponse, CityResponse,
+    CityStatsResponse, ExportJobRequest, ExportJobResponse
+)
 from datetime import datetime
-from sqlalchemy import text
 logging.basicConfig(
     level=logging.INFO,
     format='{"time": "%(asctime)s", "level": "%(levelname)s", "message": "%(message)s"}'
@@ -24,8 +42,33 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up application")
+    await init_http_client()
+    await registry.start()
+    await health_monitor.start()
+    # Loading the full OpenWeatherMap list takes a moment; do it before serving.
+    await asyncio.to_thread(get_city_index)
+    if AUDIT_WRITE_BEHIND:
+        await audit_writer.start()
+    if PARTITION_MAINTENANCE:
+        await partition_maintainer.start()
+    if PREFETCH_ENABLED:
+        await prefetcher.start(prefetch_weather)
+    if ROLLUP_ENABLED:
+        await rollup_worker.start()
+    await export_jobs.start()
     yield
     logger.info("Shutting down application")
+    await health_monitor.stop()
+    await export_jobs.stop()
+    await rollup_worker.stop()
+    await prefetcher.stop()
+    await partition_maintainer.stop()
+    await wait_for_refreshes()
+    await audit_writer.stop()
+    await close_http_client()
+    await close_async_redis()
+    await async_engine.dispose()
+    await registry.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -36,15 +79,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Count-Estimated",
+                    "Retry-After", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset",
+                    "Accept-Ranges", "Content-Range", "Content-Disposition", "ETag"],
 )
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+app.add_middleware(CompressionMiddleware)
 
 
 @app.middleware("http")
@@ -53,6 +92,12 @@ async def log_requests(request: Request, call_next):
     logger.info(f"request start path={request.url.path} method={request.method}")
     response = await call_next(request)
     process_time = time.time() - start_time
+    # The route template, not the raw path, so /history?city=... stays one series.
+    route = request.scope.get("route")
+    http_request_duration.observe(
+        process_time, method=request.method, route=route.path if route else "unmatched",
+        status=response.status_code
+    )
     logger.info(
         f"request end path={request.url.path} method={request.method} status={response.status_code} duration={process_time:.3f}s")
     return response
@@ -63,21 +108,74 @@ async def weather_endpoint(
         city: str,
         unit: str = Query("metric", regex="^(metric|imperial)$"),
         request: Request = None,
-        db: Session = Depends(get_db)
+        response: Response = None,
+        db: AsyncSession = Depends(get_async_db)
 ):
     client_ip = request.client.host
 
-    if is_rate_limited(client_ip):
-        logger.warning(f"rate_limit_exceeded ip={client_ip}")
-        raise HTTPException(status_code=429, detail="Too many requests. Try again later.")
+    limit = await check_rate_limit(client_ip, "/weather")
+    if not limit.allowed:
+        logger.warning(f"rate_limit_exceeded ip={client_ip} route=/weather retry_after={limit.reset_after:.1f}s")
+        rate_limit_rejections.inc(route="/weather")
+        raise HTTPException(
+            status_code=429, detail="Too many requests. Try again later.", headers=limit.headers()
+        )
 
     try:
         result = await get_weather_for_city(db, city, unit, client_ip)
-        return WeatherResponse(**result)
+    except UpstreamUnavailableError as e:
+        # Nothing cached to fall back on and upstream is not being called.
+        logger.warning(f"weather_unavailable city={city} error={str(e)}")
+        raise HTTPException(
+            status_code=503, detail="Weather service temporarily unavailable",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
     except Exception as e:
         logger.error(f"weather_fetch_error city={city} error={str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch weather data")
 
+    # The validator covers the cached weather values, not the per-request
+    # timestamp, so it holds for as long as the cache entry does.
+    headers = {
+        "ETag": weak_etag(result["city"], unit, result["temperature"], result["description"], result["stale"]),
+        "Cache-Control": weather_cache_control(result.pop("fresh_until")),
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return WeatherResponse(**result)
+
+
+@app.post("/weather/batch", response_model=WeatherBatchResponse)
+async def weather_batch_endpoint(
+        body: WeatherBatchRequest,
+        request: Request,
+        db: AsyncSession = Depends(get_async_db)
+):
+    client_ip = request.client.host
+
+    if len(body.cities) > WEATHER_BATCH_MAX_CITIES:
+        raise HTTPException(status_code=422, detail=f"At most {WEATHER_BATCH_MAX_CITIES} cities per request")
+
+    limit = await check_rate_limit(client_ip, "/weather/batch")
+    if not limit.allowed:
+        logger.warning(f"rate_limit_exceeded ip={client_ip} route=/weather/batch retry_after={limit.reset_after:.1f}s")
+        rate_limit_rejections.inc(route="/weather/batch")
+        raise HTTPException(
+            status_code=429, detail="Too many requests. Try again later.", headers=limit.headers()
+        )
+
+    results = await get_weather_for_cities(db, body.cities, body.unit, client_ip)
+    return WeatherBatchResponse(results=results)
+
+
+@app.get("/cities/search", response_model=list[CityResponse])
+async def search_cities(
+        q: str = Query(..., min_length=1),
+        limit: int = Query(10, ge=1, le=50)
+):
+    return [city._asdict() for city in get_city_index().search(q, limit)]
+
 
 @app.get("/history", response_model=list[QueryHistoryResponse])
 async def get_history(
@@ -86,10 +184,67 @@ async def get_history(
         date_to: datetime = None,
         page: int = 1,
         page_size: int = 10,
-        db: Session = Depends(get_db)
+        city_match: str = Query("substring", regex="^(exact|substring)$"),
+        pagination: str = Query("offset", regex="^(offset|keyset)$"),
+        cursor: str = None,
+        count: str = Query("none", regex="^(none|exact|estimated)$"),
+        request: Request = None,
+        response: Response = None,
+        db: AsyncSession = Depends(get_async_db)
+):
+    from app.weather import get_query_history, get_query_history_page, count_query_history
+
+    if pagination == "keyset" or cursor:
+        try:
+            items, next_cursor = await get_query_history_page(
+                db, city, date_from, date_to, cursor, page_size, city_match=city_match
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+    else:
+        items = await get_query_history(db, city, date_from, date_to, page, page_size, city_match=city_match)
+
+    if count != "none":
+        total = await count_query_history(
+            db, city, date_from, date_to, estimated=count == "estimated", city_match=city_match
+        )
+        response.headers["X-Total-Count"] = str(total)
+        if count == "estimated":
+            response.headers["X-Total-Count-Estimated"] = "true"
+
+    # History rows never change once written, so a page is identified by its
+    # boundaries: any row added inside or before it shifts the first or last one.
+    boundaries = [(item.timestamp.isoformat(), item.id) for item in (items[:1] + items[-1:])]
+    etag = weak_etag(len(items), boundaries, response.headers.get("X-Next-Cursor"),
+                     response.headers.get("X-Total-Count"))
+    # Offset pages change as rows arrive, so clients revalidate every time.
+    response.headers.update({"ETag": etag, "Cache-Control": "private, no-cache"})
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        # Keeps the cursor and count headers, which the ETag covers too.
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        return Response(status_code=304, headers=headers)
+    return items
+
+
+@app.get("/stats", response_model=list[CityStatsResponse])
+async def city_stats(
+        city: str = None,
+        date_from: datetime = None,
+        date_to: datetime = None,
+        unit: str = Query("metric", pattern="^(metric|imperial)$"),
+        limit: int = Query(168, ge=1, le=5000),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    from app.weather import get_query_history
-    return get_query_history(db, city, date_from, date_to, page, page_size)
+    from app.weather import resolve_city
+
+    city_key = None
+    if city:
+        _, city_id = resolve_city(city)
+        city_key = str(city_id) if city_id is not None else normalize_city(city)
+    rows = await get_city_stats(db, city_key, date_from, date_to, limit)
+    return [stats_to_dict(row, unit) for row in rows]
 
 
 @app.get("/export")
@@ -97,28 +252,142 @@ async def export_history(
         city: str = None,
         date_from: datetime = None,
         date_to: datetime = None,
-        db: Session = Depends(get_db)
+        city_match: str = Query("substring", regex="^(exact|substring)$"),
+        format: str = Query(None, regex=FORMAT_PATTERN),
+        gzip: bool = False,
+        db: AsyncSession = Depends(get_async_db)
 ):
-    file_path = export_history_to_csv(db, city, date_from, date_to)
-    return FileResponse(file_path, media_type='text/csv', filename='weather_history.csv')
+    # gzip=true predates the format parameter and still means gzipped CSV.
+    if format is None:
+        format = "csv.gz" if gzip else "csv"
+    try:
+        encoder = get_encoder(format)
+    except ExportFormatUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        stream_history(db, encoder, city, date_from, date_to, city_match),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="weather_history.{encoder.extension}"'}
+    )
 
 
-@app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+@app.post("/export/jobs", response_model=ExportJobResponse, status_code=202)
+async def create_export_job(body: ExportJobRequest, response: Response):
+    if body.format not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"Unknown format, expected one of: {', '.join(FORMATS)}")
     try:
-        result = db.execute(text("SELECT 1"))
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        return JSONResponse(status_code=500, content={"status": "unhealthy", "db": "down", "error": str(e)})
+        job = await export_jobs.submit(body.city, body.date_from, body.date_to, body.city_match, body.format)
+    except ExportFormatUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    if job["status"] == "done":
+        response.status_code = 200
+    return job_view(job)
+
+
+@app.get("/export/jobs/{job_id}", response_model=ExportJobResponse)
+async def get_export_job(job_id: str):
+    job = await export_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job_view(job)
+
 
-    import httpx
+@app.get("/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request):
+    job = await export_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export job is {job['status']}")
+    path = export_jobs.file_path(job)
     try:
-        async with httpx.AsyncClient(timeout=2.0) as client:
-            resp = await client.get("https://api.openweathermap.org/data/2.5/weather?q=London&appid=dummy")
-            api_ok = resp.status_code != 401
-    except Exception:
-        api_ok = False
+        stat = os.stat(path)
+    except FileNotFoundError:
+        if job["node"] != export_jobs.node:
+            # EXPORT_DIR is not shared between replicas.
+            raise HTTPException(status_code=503, detail=f"Export file is stored on {job['node']}, "
+                                                        f"which does not share EXPORT_DIR with this replica")
+        raise HTTPException(status_code=410, detail="Export file has expired, submit the job again")
+
+    size = stat.st_size
+    etag = f'"{job["key"]}-{int(stat.st_mtime)}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="weather_history.{job["extension"]}"',
+    }
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    # If-Range with another validator means the client holds a different file: send it whole.
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        read_file_range(path, start, end),
+        status_code=status_code,
+        media_type=job["media_type"],
+        headers=headers,
+    )
+
+
+@app.get("/audit/stats")
+async def audit_stats():
+    return audit_writer.snapshot()
+
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    return openweather.snapshot()
+
+
+@app.get("/prefetch/stats")
+async def prefetch_stats():
+    return await prefetcher.snapshot()
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def _health_state():
+    # Outside the lifespan (scripts, tests) nothing probes in the background.
+    if not health_monitor.running and health_monitor.is_stale():
+        await health_monitor.check_now()
+
+
+@app.get("/health/live")
+async def health_live():
+    state = health_monitor.live()
+    return JSONResponse(status_code=200 if state["ok"] else 503, content=state)
+
+
+@app.get("/health/ready")
+async def health_ready():
+    await _health_state()
+    state = health_monitor.ready()
+    return JSONResponse(status_code=200 if state["ok"] else 503, content=state)
+
+
+@app.get("/health")
+async def health_check():
+    await _health_state()
+    checks = health_monitor.dependencies()
+    postgres = checks.get("postgres", {})
+    if postgres.get("status") != "up":
+        return JSONResponse(status_code=500, content={
+            "status": "unhealthy", "db": "down", "error": postgres.get("error"), "checks": checks
+        })
 
+    api_ok = checks.get("upstream", {}).get("status") == "up"
     status = "healthy" if api_ok else "degraded"
-    return {"status": status, "db": "up", "api_reachable": api_ok}
\ No newline at end of file
+    return {"status": status, "db": "up", "api_reachable": api_ok, "checks": checks}
@@ -0,0 +1,302 @@
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# With several workers, each one writes its metrics to METRICS_DIR/metrics_<pid>.json
+# and /metrics merges the files. Without it only the answering worker is reported.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels):
+        # For collectors that mirror a count the application already keeps.
+        self._values[self._key(labels)] = float(value)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then sum and count.
+            state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._derived: List[Callable[[dict], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Registers a callback that updates metrics from other stats right before export."""
+        self._collectors.append(collector)
+
+    def add_derived(self, derive: Callable[[dict], None]):
+        """Registers a callback that adds metrics computed from the merged values."""
+        self._derived.append(derive)
+
+    def snapshot(self) -> dict:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"metrics_collector_error error={str(e)}")
+        return {
+            name: {
+                "type": m.type,
+                "help": m.documentation,
+                "labels": list(m.labelnames),
+                "buckets": list(getattr(m, "buckets", ())),
+                "values": [[list(k), v] for k, v in m._values.items()],
+            }
+            for name, m in self._metrics.items()
+        }
+
+    # Multi-worker support
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+
+    def flush(self):
+        if not METRICS_DIR:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = self._path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _snapshots(self) -> List[Tuple[int, dict]]:
+        if not METRICS_DIR:
+            return [(os.getpid(), self.snapshot())]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics_*.json")):
+            try:
+                pid = int(os.path.basename(path)[len("metrics_"):-len(".json")])
+                with open(path) as f:
+                    snapshots.append((pid, json.load(f)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"metrics_file_error path={path} error={str(e)}")
+        return snapshots
+
+    def merged(self) -> dict:
+        """Sums counters and histograms over all workers; gauges only over live ones."""
+        merged: dict = {}
+        for pid, snapshot in self._snapshots():
+            alive = _pid_alive(pid)
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {**metric, "values": {}})
+                if metric["type"] == "gauge" and not alive:
+                    continue
+                for key, value in metric["values"]:
+                    key = tuple(key)
+                    current = target["values"].get(key)
+                    if current is None:
+                        target["values"][key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        target["values"][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target["values"][key] = current + value
+        return merged
+
+    def render(self) -> str:
+        merged = self.merged()
+        for derive in self._derived:
+            derive(merged)
+        lines = []
+        for name, metric in sorted(merged.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labels = metric["labels"]
+            for key, value in sorted(metric["values"].items()):
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + [float("inf")], value[:-2]):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{name}_bucket{_format_labels(labels, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels, key)} {_format_value(value[-1])}")
+        return "\n".join(lines) + "\n"
+
+    async def start(self):
+        if METRICS_DIR and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"metrics_flush_error error={str(e)}")
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request duration by route", ("method", "route", "status")
+)
+upstream_request_duration = registry.histogram(
+    "upstream_request_duration_seconds", "OpenWeatherMap request duration", ("endpoint",)
+)
+upstream_errors = registry.counter(
+    "upstream_errors_total", "Failed OpenWeatherMap requests", ("endpoint", "reason")
+)
+redis_command_duration = registry.histogram(
+    "redis_command_duration_seconds", "Redis round trip duration", ("operation",)
+)
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "PostgreSQL statement duration", ("statement",)
+)
+rate_limit_rejections = registry.counter(
+    "rate_limit_rejections_total", "Requests rejected by the rate limiter", ("route",)
+)
+fallback_responses = registry.counter(
+    "fallback_responses_total", "Cities answered with a last known value because upstream failed", ("route",)
+)
+cache_requests = registry.counter(
+    "cache_requests_total", "Cache lookups by tier and result", ("tier", "result")
+)
+
+
+def _derive_cache_hit_ratio(merged: dict):
+    lookups = merged.get("cache_requests_total")
+    if not lookups:
+        return
+    totals: Dict[str, Dict[str, float]] = {}
+    for (tier, result), value in lookups["values"].items():
+        totals.setdefault(tier, {}).setdefault(result, 0.0)
+        totals[tier][result] += value
+    merged["cache_hit_ratio"] = {
+        "type": "gauge",
+        "help": "Share of cache lookups answered by the tier",
+        "labels": ["tier"],
+        "buckets": [],
+        "values": {
+            (tier,): counts.get("hit", 0.0) / (counts.get("hit", 0.0) + counts.get("miss", 0.0))
+            for tier, counts in totals.items() if counts.get("hit", 0.0) + counts.get("miss", 0.0)
+        },
+    }
+
+
+registry.add_derived(_derive_cache_hit_ratio)
@@ -1,14 +1,29 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
 Base = declarative_base()
 
+
+def normalize_city(city: str) -> str:
+    # Must stay in line with lower(btrim(city)) used by the backfill migration.
+    return city.strip().lower() if city is not None else None
+
+
+def _default_city_normalized(context):
+    return normalize_city(context.get_current_parameters().get("city"))
+
+
 class WeatherQuery(Base):
     __tablename__ = "weather_queries"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # The table is range-partitioned on timestamp (see app/partitions.py), and
+    # PostgreSQL requires the partition key in the primary key.
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     city = Column(String, index=True)
+    city_normalized = Column(String, default=_default_city_normalized)
+    # OpenWeatherMap city ID from app/cities.py; NULL when the name did not resolve.
+    city_id = Column(Integer, index=True)
     unit = Column(String)
     temperature = Column(Float)
     description = Column(String)
@@ -16,4 +31,57 @@ class WeatherQuery(Base):
     wind_speed = Column(Float)
     served_from_cache = Column(Boolean, default=False)
     ip_address = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves ORDER BY timestamp DESC, id DESC and keyset seeks on (timestamp, id).
+        Index("ix_weather_queries_timestamp_id", "timestamp", "id"),
+        Index("ix_weather_queries_city_normalized", "city_normalized"),
+        # Trigram index for substring (LIKE '%...%') city search; needs pg_trgm.
+        Index(
+            "ix_weather_queries_city_normalized_trgm",
+            "city_normalized",
+            postgresql_using="gin",
+            postgresql_ops={"city_normalized": "gin_trgm_ops"},
+        ),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+class WeatherStatsHourly(Base):
+    """Per-city, per-hour aggregates of weather_queries, maintained by app/rollups.py.
+
+    Values are in metric units whatever unit the requests used. Averages are
+    the *_sum columns divided by requests.
+    """
+    __tablename__ = "weather_stats_hourly"
+
+    hour = Column(DateTime, primary_key=True)
+    # The OpenWeatherMap ID as text when the city resolved, else city_normalized.
+    city_key = Column(String, primary_key=True)
+    city_id = Column(Integer)
+    city = Column(String)
+    requests = Column(BigInteger, nullable=False, default=0)
+    cache_hits = Column(BigInteger, nullable=False, default=0)
+    temperature_min = Column(Float)
+    temperature_max = Column(Float)
+    temperature_sum = Column(Float)
+    humidity_min = Column(Integer)
+    humidity_max = Column(Integer)
+    humidity_sum = Column(BigInteger)
+    wind_speed_min = Column(Float)
+    wind_speed_max = Column(Float)
+    wind_speed_sum = Column(Float)
+
+    __table_args__ = (
+        Index("ix_weather_stats_hourly_city_key_hour", "city_key", "hour"),
+    )
+
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String, primary_key=True)
+    # Highest weather_queries.id already folded into the rollup.
+    last_id = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
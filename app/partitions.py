@@ -0,0 +1,229 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MAINTENANCE = os.getenv("PARTITION_MAINTENANCE", "true").lower() in ("1", "true", "yes")
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month")
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", 3))
+PARTITION_RETENTION = int(os.getenv("PARTITION_RETENTION", 0))
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR")
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 3600))
+
+PARENT_TABLE = "weather_queries"
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+# Arbitrary key for pg_try_advisory_xact_lock so only one worker runs maintenance.
+_MAINTENANCE_LOCK_ID = 727001
+
+_NAME_RE = re.compile(rf"^{PARENT_TABLE}_p(\d{{4}})_(\d{{2}})(?:_(\d{{2}}))?$")
+
+
+def interval_start(ts: datetime, interval: str = PARTITION_INTERVAL) -> datetime:
+    if interval == "day":
+        return datetime(ts.year, ts.month, ts.day)
+    return datetime(ts.year, ts.month, 1)
+
+
+def shift_interval(start: datetime, n: int, interval: str = PARTITION_INTERVAL) -> datetime:
+    if interval == "day":
+        return datetime.fromordinal(start.toordinal() + n)
+    month = start.year * 12 + start.month - 1 + n
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start: datetime, interval: str = PARTITION_INTERVAL) -> str:
+    if interval == "day":
+        return f"{PARENT_TABLE}_p{start:%Y_%m_%d}"
+    return f"{PARENT_TABLE}_p{start:%Y_%m}"
+
+
+def parse_partition_name(name: str) -> Optional[Tuple[datetime, str]]:
+    match = _NAME_RE.match(name)
+    if not match:
+        return None
+    year, month, day = match.groups()
+    if day:
+        return datetime(int(year), int(month), int(day)), "day"
+    return datetime(int(year), int(month), 1), "month"
+
+
+def list_partitions(conn: Connection) -> List[str]:
+    return list(conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :parent ORDER BY c.relname"
+    ), {"parent": PARENT_TABLE}).scalars())
+
+
+def create_partition(conn: Connection, start: datetime, interval: str = PARTITION_INTERVAL) -> str:
+    name = partition_name(start, interval)
+    end = shift_interval(start, 1, interval)
+    bounds = {"start": start, "end": end}
+    # Rows that already landed in the default partition for this range are moved
+    # into the new table first; ATTACH would fail while they are still there.
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    conn.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    logger.info(f"partition_created name={name} start={start.isoformat()} end={end.isoformat()}")
+    return name
+
+
+def ensure_partitions(conn: Connection, start: datetime = None, now: datetime = None,
+                      ahead: int = PARTITIONS_AHEAD, interval: str = PARTITION_INTERVAL) -> List[str]:
+    now = now or datetime.utcnow()
+    current = interval_start(start or now, interval)
+    last = shift_interval(interval_start(now, interval), ahead, interval)
+    existing = set(list_partitions(conn))
+
+    created = []
+    while current <= last:
+        if partition_name(current, interval) not in existing:
+            created.append(create_partition(conn, current, interval))
+        current = shift_interval(current, 1, interval)
+    return created
+
+
+def archive_partition(conn: Connection, name: str, archive_dir: str) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        with gzip.open(path, "wb") as f:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    finally:
+        cursor.close()
+    return path
+
+
+def apply_retention(conn: Connection, now: datetime = None, keep: int = PARTITION_RETENTION) -> List[str]:
+    """Detaches partitions older than the retention window and returns their names.
+
+    Only the detach runs here, since it takes an ACCESS EXCLUSIVE lock on the
+    parent: commit it right away and archive or drop the tables afterwards
+    with archive_and_drop(). DETACH ... CONCURRENTLY is not an option while
+    the parent has a default partition.
+    """
+    if keep <= 0:
+        return []
+    now = now or datetime.utcnow()
+
+    detached = []
+    for name in list_partitions(conn):
+        parsed = parse_partition_name(name)
+        if parsed is None:
+            continue
+        start, interval = parsed
+        cutoff = shift_interval(interval_start(now, interval), -(keep - 1), interval)
+        if shift_interval(start, 1, interval) > cutoff:
+            continue
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        logger.info(f"partition_detached name={name}")
+        detached.append(name)
+    return detached
+
+
+def list_detached_partitions(conn: Connection) -> List[str]:
+    """Former partitions waiting to be archived and dropped, including ones a
+    crash left behind between the detach and the drop."""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relkind = 'r' AND NOT c.relispartition "
+        "AND c.relnamespace = current_schema()::regnamespace AND c.relname LIKE :pattern "
+        "ORDER BY c.relname"
+    ), {"pattern": f"{PARENT_TABLE}_p%"}).scalars()
+    return [name for name in names if parse_partition_name(name) is not None]
+
+
+def archive_and_drop(conn: Connection, name: str, archive_dir: Optional[str] = PARTITION_ARCHIVE_DIR):
+    # Locks only the detached table, so inserts and reads on the parent go on.
+    if archive_dir:
+        path = archive_partition(conn, name, archive_dir)
+        logger.info(f"partition_archived name={name} path={path}")
+    conn.execute(text(f"DROP TABLE {name}"))
+    logger.info(f"partition_dropped name={name}")
+
+
+def _lock_maintenance(conn: Connection) -> bool:
+    return conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": _MAINTENANCE_LOCK_ID}).scalar()
+
+
+def run_maintenance() -> dict:
+    # Separate short transactions, so the parent is never locked while a
+    # partition is being copied to the archive.
+    with engine.begin() as conn:
+        if not _lock_maintenance(conn):
+            return {"created": [], "dropped": [], "skipped": True}
+        created = ensure_partitions(conn)
+    with engine.begin() as conn:
+        if not _lock_maintenance(conn):
+            return {"created": created, "dropped": [], "skipped": True}
+        # Give up rather than queue every query behind the detach while a
+        # long-running one holds the parent; the next run tries again.
+        conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+        apply_retention(conn)
+        detached = list_detached_partitions(conn)
+    dropped = []
+    for name in detached:
+        with engine.begin() as conn:
+            if not _lock_maintenance(conn):
+                break
+            archive_and_drop(conn, name)
+        dropped.append(name)
+    return {"created": created, "dropped": dropped, "skipped": False}
+
+
+class PartitionMaintainer:
+    """Creates partitions ahead of time and applies retention on a schedule."""
+
+    def __init__(self, interval: float = PARTITION_MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                result = await asyncio.to_thread(run_maintenance)
+                if result["created"] or result["dropped"]:
+                    logger.info(
+                        f"partition_maintenance created={len(result['created'])} dropped={len(result['dropped'])}"
+                    )
+            except Exception as e:
+                logger.error(f"partition_maintenance_error error={str(e)}")
+            await asyncio.sleep(self.interval)
+
+
+partition_maintainer = PartitionMaintainer()
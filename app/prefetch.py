@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from typing import Awaitable, Callable, List, Optional
+from app.cache import CacheEntry, CACHE_HARD_TTL, get_async_redis, get_cached_entry, acquire_lock
+from app.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", 50))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", 60))
+PREFETCH_BUDGET = int(os.getenv("PREFETCH_BUDGET", 100))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", 5))
+PREFETCH_DECAY = float(os.getenv("PREFETCH_DECAY", 0.5))
+PREFETCH_MAX_TRACKED = int(os.getenv("PREFETCH_MAX_TRACKED", 1000))
+
+POPULARITY_KEY = "prefetch:popularity"
+AVOIDED_MISSES_KEY = "prefetch:avoided_misses"
+
+
+def parse_cache_key(cache_key: str) -> str:
+    # weather:{city}; the city itself may contain a colon.
+    return cache_key.split(":", 1)[1]
+
+
+class Prefetcher:
+    """Keeps the most requested cache keys warm.
+
+    Request counts are collected in-process and merged into a Redis sorted set
+    once per cycle, where they decay so the ranking follows current traffic.
+    Each cycle one worker (whoever takes the cycle lock) refreshes the top
+    keys that would go stale before the next cycle, within the upstream budget.
+    """
+
+    def __init__(self, top_n: int = PREFETCH_TOP_N, interval: float = PREFETCH_INTERVAL,
+                 budget: int = PREFETCH_BUDGET, concurrency: int = PREFETCH_CONCURRENCY,
+                 decay: float = PREFETCH_DECAY, max_tracked: int = PREFETCH_MAX_TRACKED):
+        self.top_n = top_n
+        self.interval = interval
+        self.budget = budget
+        self.concurrency = concurrency
+        self.decay = decay
+        self.max_tracked = max_tracked
+        self._counts: Counter = Counter()
+        self._counted_hits = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "cycles": 0,
+            "prefetched": 0,
+            "failed": 0,
+            "over_budget": 0,
+            "avoided_misses": 0,
+        }
+
+    def record(self, cache_key: str):
+        self._counts[cache_key] += 1
+
+    async def note_hit(self, cache_key: str, entry: CacheEntry):
+        """Counts a cache hit that only happened because the entry was prefetched."""
+        if not entry.prefetched or self._counted_hits.get(cache_key) == entry.fresh_until:
+            return
+        self._counted_hits[cache_key] = entry.fresh_until
+        # One count per prefetched entry across all workers: without the prefetch
+        # only the first request for it would have missed.
+        client = get_async_redis()
+        marker = f"prefetch:hit:{cache_key}:{entry.fresh_until}"
+        if await client.set(marker, 1, nx=True, ex=max(1, int(CACHE_HARD_TTL))):
+            await client.incr(AVOIDED_MISSES_KEY)
+            self.stats["avoided_misses"] += 1
+
+    async def snapshot(self) -> dict:
+        stats = {**self.stats, "running": self._task is not None and not self._task.done()}
+        client = get_async_redis()
+        stats["avoided_misses_total"] = int(await client.get(AVOIDED_MISSES_KEY) or 0)
+        stats["tracked_keys"] = await client.zcard(POPULARITY_KEY)
+        return stats
+
+    async def start(self, refresh: Callable[[str, str], Awaitable[None]]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(refresh))
+            logger.info(f"prefetch_started top_n={self.top_n} interval={self.interval}s budget={self.budget}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self, refresh):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_cycle(refresh)
+            except Exception as e:
+                logger.error(f"prefetch_cycle_error error={str(e)}")
+
+    async def flush_counts(self):
+        if not self._counts:
+            return
+        counts, self._counts = self._counts, Counter()
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            for key, n in counts.items():
+                pipe.zincrby(POPULARITY_KEY, n, key)
+            await pipe.execute()
+
+    async def candidates(self, now: Optional[float] = None) -> List[str]:
+        now = time.time() if now is None else now
+        keys = [k.decode() if isinstance(k, bytes) else k
+                for k in await get_async_redis().zrevrange(POPULARITY_KEY, 0, self.top_n - 1)]
+        due = []
+        for key in keys:
+            entry = await get_cached_entry(key, use_local=False)
+            # Anything that would go stale before the next cycle is refreshed now.
+            if entry is None or entry.fresh_until - now <= self.interval:
+                due.append(key)
+        return due
+
+    async def run_cycle(self, refresh) -> int:
+        await self.flush_counts()
+        # The lock is left to expire so exactly one worker runs per interval.
+        if await acquire_lock("lock:prefetch", max(1, int(self.interval * 1000 * 0.9))) is None:
+            return 0
+        self.stats["cycles"] += 1
+
+        due = await self.candidates()
+        if len(due) > self.budget:
+            self.stats["over_budget"] += len(due) - self.budget
+            due = due[:self.budget]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def prefetch(key: str):
+            async with semaphore:
+                try:
+                    await refresh(parse_cache_key(key), key)
+                    self.stats["prefetched"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.warning(f"prefetch_failed key={key} error={str(e)}")
+
+        await asyncio.gather(*(prefetch(key) for key in due))
+        await self._decay()
+        if due:
+            logger.info(f"prefetch_cycle refreshed={len(due)} budget={self.budget}")
+        return len(due)
+
+    async def _decay(self):
+        client = get_async_redis()
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.zunionstore(POPULARITY_KEY, {POPULARITY_KEY: self.decay})
+            pipe.zremrangebyrank(POPULARITY_KEY, 0, -self.max_tracked - 1)
+            await pipe.execute()
+        self._counted_hits.clear()
+
+
+prefetcher = Prefetcher()
+
+
+prefetch_cycles = registry.counter("prefetch_cycles_total", "Prefetch cycles run by this worker")
+prefetch_keys = registry.counter("prefetch_keys_total", "Keys considered for prefetch by outcome", ("result",))
+prefetch_avoided_misses = registry.counter(
+    "prefetch_avoided_misses_total", "Requests served from an entry the prefetcher wrote"
+)
+
+
+def _collect_prefetch_metrics():
+    prefetch_cycles.set_total(prefetcher.stats["cycles"])
+    for result in ("prefetched", "failed", "over_budget"):
+        prefetch_keys.set_total(prefetcher.stats[result], result=result)
+    prefetch_avoided_misses.set_total(prefetcher.stats["avoided_misses"])
+
+
+registry.add_collector(_collect_prefetch_metrics)
@@ -1,20 +1,188 @@
-import redis
+import logging
+import math
 import os
-from datetime import datetime, timedelta
+import time
+import uuid
+from typing import Dict, NamedTuple, Optional, Tuple
+import redis
+from app.cache import redis_client, get_async_redis
+from app.metrics import redis_command_duration
+
+logger = logging.getLogger(__name__)
+
+# "sliding_window" (exact count over the last RATE_LIMIT_WINDOW seconds) or
+# "token_bucket" (RATE_LIMIT_MAX_REQUESTS burst, refilled evenly over the window).
+RATE_LIMIT_ALGORITHM = os.getenv("RATE_LIMIT_ALGORITHM", "sliding_window")
+RATE_LIMIT_MAX_REQUESTS = int(os.getenv("RATE_LIMIT_MAX_REQUESTS", 30))
+RATE_LIMIT_WINDOW = float(os.getenv("RATE_LIMIT_WINDOW", 60))
+# Per-route overrides, e.g. "/weather/batch=10/60,/export=5/60". A route listed
+# here gets its own counter; all other routes share the default one.
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", "")
+# Tokens a worker reserves from Redis at once and then hands out locally.
+# 0 or 1 disables the local cache: every request goes to Redis.
+RATE_LIMIT_LOCAL_BATCH = int(os.getenv("RATE_LIMIT_LOCAL_BATCH", 0))
+RATE_LIMIT_LOCAL_TTL = float(os.getenv("RATE_LIMIT_LOCAL_TTL", 1.0))
+
+if RATE_LIMIT_ALGORITHM not in ("sliding_window", "token_bucket"):
+    raise ValueError(f"RATE_LIMIT_ALGORITHM must be sliding_window or token_bucket, got {RATE_LIMIT_ALGORITHM!r}")
+
+# Both scripts take (limit, window_ms, requested, member) and return
+# {granted, remaining, reset_ms}. Time comes from the Redis server, so worker
+# clocks do not have to agree.
+_SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call("TIME")
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - window)
+local used = redis.call("ZCARD", KEYS[1])
+local granted = math.max(0, math.min(requested, limit - used))
+for i = 1, granted do
+    redis.call("ZADD", KEYS[1], now, ARGV[4] .. ":" .. i)
+end
+if granted > 0 then
+    redis.call("PEXPIRE", KEYS[1], window)
+end
+local reset = 0
+local oldest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {granted, limit - used - granted, reset}
+"""
+
+_TOKEN_BUCKET_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call("TIME")
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or limit
+local ts = tonumber(state[2]) or now
+tokens = math.min(limit, tokens + (now - ts) * limit / window)
+local granted = math.max(0, math.min(requested, math.floor(tokens)))
+tokens = tokens - granted
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", now)
+redis.call("PEXPIRE", KEYS[1], window)
+local reset = 0
+if tokens < 1 then
+    reset = math.ceil((1 - tokens) * window / limit)
+end
+return {granted, math.floor(tokens), reset}
+"""
+
+_SCRIPTS = {"sliding_window": _SLIDING_WINDOW_SCRIPT, "token_bucket": _TOKEN_BUCKET_SCRIPT}
+_KEY_PREFIXES = {"sliding_window": "rate_limit", "token_bucket": "rate_limit_tb"}
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until another request would be allowed (0 while allowed).
+    reset_after: float
+
+    def headers(self) -> Dict[str, str]:
+        reset = str(math.ceil(self.reset_after))
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(max(0, self.remaining)),
+            "RateLimit-Reset": reset,
+        }
+        if not self.allowed:
+            headers["Retry-After"] = reset
+        return headers
+
+
+def parse_route_limits(value: str) -> Dict[str, Tuple[int, float]]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, spec = item.rpartition("=")
+        max_req, _, window = spec.partition("/")
+        limits[route.strip()] = (int(max_req), float(window or RATE_LIMIT_WINDOW))
+    return limits
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-redis_client = redis.from_url(REDIS_URL)
 
+ROUTE_LIMITS = parse_route_limits(RATE_LIMIT_ROUTES)
 
-def is_rate_limited(ip: str, max_req: int = 30, window: int = 60) -> bool:
-    key = f"rate_limit:{ip}"
-    current = redis_client.get(key)
+# key -> (tokens left, remaining reported by Redis, expires at). A lease that
+# was granted no tokens caches the rejection until the client may retry.
+_local_leases: Dict[str, Tuple[int, int, float]] = {}
+_LOCAL_LEASES_PRUNE_AT = 10000
 
-    if current is None:
-        redis_client.setex(key, window, 1)
-        return False
-    elif int(current) < max_req:
-        redis_client.incr(key)
-        return False
+
+def _store_lease(key: str, tokens: int, remaining: int, ttl: float):
+    now = time.monotonic()
+    if len(_local_leases) >= _LOCAL_LEASES_PRUNE_AT:
+        for stale in [k for k, lease in _local_leases.items() if lease[2] <= now]:
+            del _local_leases[stale]
+    _local_leases[key] = (tokens, remaining, now + ttl)
+
+
+def _take_local(key: str, limit: int) -> Optional[RateLimitResult]:
+    lease = _local_leases.get(key)
+    if lease is None:
+        return None
+    tokens, remaining, expires_at = lease
+    now = time.monotonic()
+    if now >= expires_at:
+        del _local_leases[key]
+        return None
+    if tokens == 0:
+        return RateLimitResult(False, limit, 0, expires_at - now)
+    if tokens == 1:
+        del _local_leases[key]
     else:
-        return True
\ No newline at end of file
+        _local_leases[key] = (tokens - 1, remaining, expires_at)
+    return RateLimitResult(True, limit, remaining + tokens - 1, 0.0)
+
+
+async def _run_script(key: str, limit: int, window: float, requested: int) -> Tuple[int, int, float]:
+    client = get_async_redis()
+    with redis_command_duration.time(operation="rate_limit"):
+        granted, remaining, reset_ms = await client.eval(
+            _SCRIPTS[RATE_LIMIT_ALGORITHM], 1, key, limit, int(window * 1000), requested, uuid.uuid4().hex
+        )
+    return int(granted), int(remaining), int(reset_ms) / 1000
+
+
+async def check_rate_limit(ip: str, route: Optional[str] = None, limit: Optional[int] = None,
+                           window: Optional[float] = None) -> RateLimitResult:
+    route_limit = ROUTE_LIMITS.get(route) if route else None
+    default_limit, default_window = route_limit or (RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW)
+    limit = default_limit if limit is None else limit
+    window = default_window if window is None else window
+    key = f"{_KEY_PREFIXES[RATE_LIMIT_ALGORITHM]}:{ip}"
+    if route_limit:
+        key = f"{key}:{route}"
+
+    batch = min(RATE_LIMIT_LOCAL_BATCH, limit)
+    if batch > 1:
+        local = _take_local(key, limit)
+        if local is not None:
+            return local
+
+    try:
+        granted, remaining, reset_after = await _run_script(key, limit, window, max(batch, 1))
+    except redis.RedisError as e:
+        # Without Redis there is no shared count; let the request through.
+        logger.warning(f"rate_limit_error ip={ip} error={str(e)}")
+        return RateLimitResult(True, limit, limit, 0.0)
+
+    if batch > 1:
+        # Reserved tokens count against the client right away, so a worker may
+        # reject a little early but the limit is never exceeded.
+        if granted == 0:
+            _store_lease(key, 0, 0, min(RATE_LIMIT_LOCAL_TTL, reset_after))
+        elif granted > 1:
+            _store_lease(key, granted - 1, remaining, RATE_LIMIT_LOCAL_TTL)
+
+    if granted == 0:
+        return RateLimitResult(False, limit, 0, reset_after)
+    return RateLimitResult(True, limit, remaining + granted - 1, 0.0)
+
+
+async def is_rate_limited(ip: str, max_req: int = RATE_LIMIT_MAX_REQUESTS, window: float = RATE_LIMIT_WINDOW) -> bool:
+    return not (await check_rate_limit(ip, limit=max_req, window=window)).allowed
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+from app.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Calls to OpenWeatherMap in flight per worker; callers wait up to
+# UPSTREAM_QUEUE_TIMEOUT for a slot, then fail fast.
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", 20))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", 1.0))
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", 3.0))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 2))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", 0.1))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", 1.0))
+# Send a second, parallel attempt if the first has not answered after this many
+# seconds; the first answer wins. 0 disables hedging.
+UPSTREAM_HEDGE_DELAY = float(os.getenv("UPSTREAM_HEDGE_DELAY", 0))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+T = TypeVar("T")
+
+
+class UpstreamError(Exception):
+    """Non-200 answer from the upstream API."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code == 429 or self.status_code >= 500
+
+
+class UpstreamUnavailableError(Exception):
+    """The call was not attempted; retry_after says when it may succeed."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class UpstreamBusyError(UpstreamUnavailableError):
+    pass
+
+
+def is_failure(error: BaseException) -> bool:
+    # Answers like 404 mean the upstream is working; they neither trip the
+    # breaker nor get retried.
+    if isinstance(error, UpstreamError):
+        return error.retryable
+    return not isinstance(error, UpstreamUnavailableError)
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures.
+
+    While open, calls are refused for reset_timeout seconds; then a single
+    probe is let through (half-open) and its outcome closes or reopens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                raise CircuitOpenError("Upstream circuit is open", self.retry_after())
+            self.state = self.HALF_OPEN
+            logger.info("circuit_half_open")
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                raise CircuitOpenError("Upstream circuit is half-open", self.reset_timeout)
+            self._probing = True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("circuit_closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"circuit_opened failures={self.failures}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_ignored(self):
+        # A call that neither proved nor disproved upstream health.
+        self._probing = False
+
+
+class Upstream:
+    """Circuit breaker, concurrency limit, timeouts, retries and hedging for one dependency."""
+
+    def __init__(self, name: str, breaker: Optional[CircuitBreaker] = None,
+                 concurrency: int = UPSTREAM_CONCURRENCY, queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT,
+                 attempt_timeout: float = UPSTREAM_ATTEMPT_TIMEOUT, retries: int = UPSTREAM_RETRIES,
+                 retry_base_delay: float = UPSTREAM_RETRY_BASE_DELAY,
+                 retry_max_delay: float = UPSTREAM_RETRY_MAX_DELAY, hedge_delay: float = UPSTREAM_HEDGE_DELAY):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker()
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_delay = hedge_delay
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"retries": 0, "hedged": 0, "rejected_open": 0, "rejected_busy": 0, "timeouts": 0}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # One per event loop, like the shared HTTP client.
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            try:
+                if self.hedge_delay > 0:
+                    return await self._hedged(fn)
+                return await self._attempt(fn)
+            except UpstreamUnavailableError:
+                raise
+            except Exception as e:
+                if not is_failure(e) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                # Full jitter keeps retries from many workers from lining up.
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                logger.info(f"upstream_retry name={self.name} attempt={attempt} delay={delay:.3f}s error={str(e)}")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        semaphore = self.semaphore
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected_busy"] += 1
+            raise UpstreamBusyError(f"Too many concurrent calls to {self.name}", self.queue_timeout)
+        try:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats["rejected_open"] += 1
+                raise
+            try:
+                result = await asyncio.wait_for(fn(), self.attempt_timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                self.breaker.record_failure()
+                raise
+            except asyncio.CancelledError:
+                self.breaker.record_ignored()
+                raise
+            except Exception as e:
+                if is_failure(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+        finally:
+            semaphore.release()
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]]) -> T:
+        tasks = [asyncio.ensure_future(self._attempt(fn))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                self.stats["hedged"] += 1
+                tasks.append(asyncio.ensure_future(self._attempt(fn)))
+            error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 3) if self.breaker.state == CircuitBreaker.OPEN else 0.0,
+        }
+
+
+openweather = Upstream("openweathermap")
+
+upstream_circuit_open = registry.gauge(
+    "upstream_circuit_open", "1 while the upstream circuit breaker is open or half-open", ("upstream",)
+)
+upstream_calls = registry.counter(
+    "upstream_resilience_events_total", "Retries, hedges and refused upstream calls", ("upstream", "event")
+)
+
+
+def _collect_upstream_metrics():
+    upstream_circuit_open.set(int(openweather.breaker.state != CircuitBreaker.CLOSED), upstream=openweather.name)
+    for event, value in openweather.stats.items():
+        upstream_calls.set_total(value, upstream=openweather.name, event=event)
+
+
+registry.add_collector(_collect_upstream_metrics)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import engine
+from app.models import WeatherStatsHourly
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", 60))
+# Rows younger than this are left for the next run, so inserts still in flight
+# (audit batches) are not skipped when the watermark moves past their ids.
+ROLLUP_SETTLE_SECONDS = float(os.getenv("ROLLUP_SETTLE_SECONDS", 60))
+# Upper bound on ids folded per transaction; keeps the first run over a large
+# history from holding one huge transaction.
+ROLLUP_BATCH_ROWS = int(os.getenv("ROLLUP_BATCH_ROWS", 100000))
+
+HOURLY_WATERMARK = "weather_stats_hourly"
+
+# Arbitrary key for pg_try_advisory_xact_lock so only one worker rolls up.
+_ROLLUP_LOCK_ID = 727002
+
+# Imperial rows are converted back to metric so one city-hour mixes units safely.
+_FOLD_SQL = """
+INSERT INTO weather_stats_hourly AS s (
+    hour, city_key, city_id, city, requests, cache_hits,
+    temperature_min, temperature_max, temperature_sum,
+    humidity_min, humidity_max, humidity_sum,
+    wind_speed_min, wind_speed_max, wind_speed_sum
+)
+SELECT
+    date_trunc('hour', timestamp) AS hour,
+    coalesce(city_id::text, city_normalized, lower(btrim(city))) AS city_key,
+    max(city_id), min(city), count(*), count(*) FILTER (WHERE served_from_cache),
+    min(t), max(t), sum(t),
+    min(humidity), max(humidity), sum(humidity),
+    min(w), max(w), sum(w)
+FROM (
+    SELECT *,
+        CASE WHEN unit = 'imperial' THEN (temperature - 32) * 5 / 9 ELSE temperature END AS t,
+        CASE WHEN unit = 'imperial' THEN wind_speed / 2.23694 ELSE wind_speed END AS w
+    FROM weather_queries
+    WHERE id > :low AND id <= :high
+) q
+GROUP BY 1, 2
+ON CONFLICT (hour, city_key) DO UPDATE SET
+    city_id = coalesce(s.city_id, EXCLUDED.city_id),
+    requests = s.requests + EXCLUDED.requests,
+    cache_hits = s.cache_hits + EXCLUDED.cache_hits,
+    temperature_min = least(s.temperature_min, EXCLUDED.temperature_min),
+    temperature_max = greatest(s.temperature_max, EXCLUDED.temperature_max),
+    temperature_sum = coalesce(s.temperature_sum, 0) + coalesce(EXCLUDED.temperature_sum, 0),
+    humidity_min = least(s.humidity_min, EXCLUDED.humidity_min),
+    humidity_max = greatest(s.humidity_max, EXCLUDED.humidity_max),
+    humidity_sum = coalesce(s.humidity_sum, 0) + coalesce(EXCLUDED.humidity_sum, 0),
+    wind_speed_min = least(s.wind_speed_min, EXCLUDED.wind_speed_min),
+    wind_speed_max = greatest(s.wind_speed_max, EXCLUDED.wind_speed_max),
+    wind_speed_sum = coalesce(s.wind_speed_sum, 0) + coalesce(EXCLUDED.wind_speed_sum, 0)
+"""
+
+
+def settled_high_id(conn: Connection, low: int, settle_before: datetime) -> Optional[int]:
+    """Highest id such that every row after the watermark up to it is settled."""
+    unsettled = conn.execute(text(
+        "SELECT min(id) FROM weather_queries WHERE id > :low AND timestamp > :settle_before"
+    ), {"low": low, "settle_before": settle_before}).scalar()
+    if unsettled is not None:
+        return unsettled - 1 if unsettled - 1 > low else None
+    return conn.execute(text("SELECT max(id) FROM weather_queries WHERE id > :low"), {"low": low}).scalar()
+
+
+def fold_rows(conn: Connection, now: datetime = None, settle_seconds: float = ROLLUP_SETTLE_SECONDS,
+              batch_rows: int = ROLLUP_BATCH_ROWS) -> int:
+    """Folds the next batch of rows after the watermark into weather_stats_hourly.
+
+    Returns how many ids the watermark advanced by (0 when there was nothing to do).
+    """
+    now = now or datetime.utcnow()
+    conn.execute(text(
+        "INSERT INTO rollup_watermarks (name, last_id, updated_at) VALUES (:name, 0, :now) "
+        "ON CONFLICT (name) DO NOTHING"
+    ), {"name": HOURLY_WATERMARK, "now": now})
+    low = conn.execute(text(
+        "SELECT last_id FROM rollup_watermarks WHERE name = :name FOR UPDATE"
+    ), {"name": HOURLY_WATERMARK}).scalar()
+
+    high = settled_high_id(conn, low, now - timedelta(seconds=settle_seconds))
+    if high is None:
+        return 0
+    high = min(high, low + batch_rows)
+    conn.execute(text(_FOLD_SQL), {"low": low, "high": high})
+    conn.execute(text(
+        "UPDATE rollup_watermarks SET last_id = :high, updated_at = :now WHERE name = :name"
+    ), {"name": HOURLY_WATERMARK, "high": high, "now": now})
+    return high - low
+
+
+def run_rollup(now: datetime = None, settle_seconds: float = ROLLUP_SETTLE_SECONDS,
+               batch_rows: int = ROLLUP_BATCH_ROWS) -> dict:
+    advanced = 0
+    batches = 0
+    while True:
+        with engine.begin() as conn:
+            if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": _ROLLUP_LOCK_ID}).scalar():
+                return {"advanced": advanced, "batches": batches, "skipped": True}
+            step = fold_rows(conn, now, settle_seconds, batch_rows)
+        if not step:
+            return {"advanced": advanced, "batches": batches, "skipped": False}
+        advanced += step
+        batches += 1
+
+
+class RollupWorker:
+    """Folds new weather_queries rows into the hourly rollup on a schedule."""
+
+    def __init__(self, interval: float = ROLLUP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                result = await asyncio.to_thread(run_rollup)
+                if result["batches"]:
+                    logger.info(f"rollup_folded ids={result['advanced']} batches={result['batches']}")
+            except Exception as e:
+                logger.error(f"rollup_error error={str(e)}")
+            await asyncio.sleep(self.interval)
+
+
+rollup_worker = RollupWorker()
+
+
+async def get_city_stats(db: AsyncSession, city_key: Optional[str] = None, date_from: datetime = None,
+                         date_to: datetime = None, limit: int = 168) -> List[WeatherStatsHourly]:
+    query = select(WeatherStatsHourly)
+    if city_key is not None:
+        query = query.where(WeatherStatsHourly.city_key == city_key)
+    if date_from:
+        query = query.where(WeatherStatsHourly.hour >= date_from)
+    if date_to:
+        query = query.where(WeatherStatsHourly.hour <= date_to)
+    query = query.order_by(WeatherStatsHourly.hour.desc(), WeatherStatsHourly.city_key).limit(limit)
+    return (await db.scalars(query)).all()
+
+
+def _to_unit(temperature: Optional[float], wind_speed: Optional[float], unit: str):
+    if unit != "imperial":
+        return temperature, wind_speed
+    return (
+        None if temperature is None else temperature * 9 / 5 + 32,
+        None if wind_speed is None else wind_speed * 2.23694,
+    )
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+
+def stats_to_dict(row: WeatherStatsHourly, unit: str = "metric") -> dict:
+    n = row.requests or 0
+    t_min, w_min = _to_unit(row.temperature_min, row.wind_speed_min, unit)
+    t_max, w_max = _to_unit(row.temperature_max, row.wind_speed_max, unit)
+    t_avg, w_avg = _to_unit(
+        row.temperature_sum / n if n and row.temperature_sum is not None else None,
+        row.wind_speed_sum / n if n and row.wind_speed_sum is not None else None,
+        unit,
+    )
+    return {
+        "hour": row.hour,
+        "city": row.city,
+        "city_id": row.city_id,
+        "unit": unit,
+        "requests": n,
+        "cache_hits": row.cache_hits,
+        "cache_hit_ratio": round(row.cache_hits / n, 4) if n else 0.0,
+        "temperature_min": _round(t_min),
+        "temperature_max": _round(t_max),
+        "temperature_avg": _round(t_avg),
+        "humidity_min": row.humidity_min,
+        "humidity_max": row.humidity_max,
+        "humidity_avg": _round(row.humidity_sum / n) if n and row.humidity_sum is not None else None,
+        "wind_speed_min": _round(w_min),
+        "wind_speed_max": _round(w_max),
+        "wind_speed_avg": _round(w_avg),
+    }
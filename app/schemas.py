@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class WeatherData(BaseModel):
     temperature: float
@@ -15,6 +15,48 @@ class WeatherResponse(BaseModel):
     unit: str
     timestamp: datetime
     served_from_cache: bool
+    # Older than the cache's soft TTL: a background refresh is pending or upstream is down.
+    stale: bool = False
+
+class WeatherBatchRequest(BaseModel):
+    cities: List[str] = Field(min_length=1)
+    unit: str = Field("metric", pattern="^(metric|imperial)$")
+
+class WeatherBatchItem(BaseModel):
+    city: str
+    unit: str
+    temperature: Optional[float] = None
+    description: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    served_from_cache: bool = False
+    stale: bool = False
+    error: Optional[str] = None
+
+class WeatherBatchResponse(BaseModel):
+    results: List[WeatherBatchItem]
+
+class CityResponse(BaseModel):
+    id: int
+    name: str
+    country: str
+
+class CityStatsResponse(BaseModel):
+    hour: datetime
+    city: Optional[str] = None
+    city_id: Optional[int] = None
+    unit: str
+    requests: int
+    cache_hits: int
+    cache_hit_ratio: float
+    temperature_min: Optional[float] = None
+    temperature_max: Optional[float] = None
+    temperature_avg: Optional[float] = None
+    humidity_min: Optional[int] = None
+    humidity_max: Optional[int] = None
+    humidity_avg: Optional[float] = None
+    wind_speed_min: Optional[float] = None
+    wind_speed_max: Optional[float] = None
+    wind_speed_avg: Optional[float] = None
 
 class QueryHistoryResponse(BaseModel):
     id: int
@@ -27,6 +69,32 @@ class QueryHistoryResponse(BaseModel):
     served_from_cache: bool
     timestamp: datetime
     ip_address: str
+    city_id: Optional[int] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ExportJobRequest(BaseModel):
+    city: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    city_match: str = Field("substring", pattern="^(exact|substring)$")
+    format: str = "csv"
+
+class ExportJobResponse(BaseModel):
+    id: str
+    status: str
+    format: str
+    filters: dict
+    rows_written: int
+    # Planner estimate of the rows to export; progress is rows_written against it.
+    rows_estimate: Optional[int] = None
+    progress: float
+    bytes_written: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    download_url: Optional[str] = None
+    # Replica that ran the job; the file lives in its EXPORT_DIR.
+    node: Optional[str] = None
\ No newline at end of file
@@ -1,49 +1,74 @@
-import csv
-import tempfile
 import os
-from sqlalchemy.orm import Session
-from app.models import WeatherQuery
+from typing import AsyncIterator
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import WeatherQuery, normalize_city
 from datetime import datetime
 
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
 
-def export_history_to_csv(
-        db: Session,
+EXPORT_COLUMNS = (
+    WeatherQuery.id,
+    WeatherQuery.city,
+    WeatherQuery.unit,
+    WeatherQuery.temperature,
+    WeatherQuery.description,
+    WeatherQuery.humidity,
+    WeatherQuery.wind_speed,
+    WeatherQuery.served_from_cache,
+    WeatherQuery.ip_address,
+    WeatherQuery.timestamp,
+)
+
+EXPORT_HEADER = [
+    "ID", "City", "Unit", "Temperature", "Description",
+    "Humidity (%)", "Wind Speed", "Served from Cache",
+    "IP Address", "Timestamp"
+]
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def apply_history_filters(
+        query: Select,
         city: str = None,
         date_from: datetime = None,
-        date_to: datetime = None
-) -> str:
-    query = db.query(WeatherQuery)
-
+        date_to: datetime = None,
+        city_match: str = "substring"
+) -> Select:
     if city:
-        query = query.filter(WeatherQuery.city.ilike(f"%{city}%"))
+        city = normalize_city(city)
+        if city_match == "exact":
+            query = query.where(WeatherQuery.city_normalized == city)
+        else:
+            query = query.where(WeatherQuery.city_normalized.like(f"%{escape_like(city)}%", escape="\\"))
     if date_from:
-        query = query.filter(WeatherQuery.timestamp >= date_from)
+        query = query.where(WeatherQuery.timestamp >= date_from)
     if date_to:
-        query = query.filter(WeatherQuery.timestamp <= date_to)
-
-    results = query.all()
-
-    temp_dir = tempfile.gettempdir()
-    file_path = os.path.join(temp_dir, "weather_history.csv")
-
-    with open(file_path, mode='w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "ID", "City", "Unit", "Temperature", "Description",
-            "Humidity (%)", "Wind Speed", "Served from Cache",
-            "IP Address", "Timestamp"
-        ])
-        for r in results:
-            writer.writerow([
-                r.id,
-                r.city,
-                r.unit,
-                r.temperature,
-                r.description,
-                r.humidity,
-                r.wind_speed,
-                "Yes" if r.served_from_cache else "No",
-                r.ip_address,
-                r.timestamp.isoformat()
-            ])
-    return file_path
\ No newline at end of file
+        query = query.where(WeatherQuery.timestamp <= date_to)
+    return query
+
+
+async def iter_history_rows(
+        db: AsyncSession,
+        city: str = None,
+        date_from: datetime = None,
+        date_to: datetime = None,
+        batch_size: int = EXPORT_BATCH_SIZE,
+        city_match: str = "substring",
+        max_id: int = None
+) -> AsyncIterator[list]:
+    # Plain column tuples read through a server-side cursor, one batch at a time.
+    query = apply_history_filters(select(*EXPORT_COLUMNS), city, date_from, date_to, city_match)
+    if max_id is not None:
+        query = query.where(WeatherQuery.id <= max_id)
+    query = query.order_by(WeatherQuery.id).execution_options(yield_per=batch_size)
+
+    result = await db.stream(query)
+    try:
+        async for rows in result.partitions():
+            yield rows
+    finally:
+        await result.close()
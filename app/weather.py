@@ -1,95 +1,495 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, text, tuple_, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import WeatherQuery
-from app.cache import get_cached_weather, set_cached_weather
+from app.cache import (
+    get_cached_weather, get_cached_entry, set_cached_weather, acquire_lock, release_lock, cache_stats,
+    get_cached_entries, set_cached_entries, get_fallback_entries, CACHE_SOFT_TTL
+)
 from app.schemas import WeatherData
-import httpx
+from app.http_client import get_http_client
+from app.singleflight import SingleFlight
+from app.audit import audit_writer
+from app.prefetch import prefetcher
+from app.utils import apply_history_filters
+from app.cities import get_city_index, normalize_name
+from app.metrics import upstream_request_duration, upstream_errors, fallback_responses
+from app.resilience import openweather, UpstreamError
+import asyncio
+import base64
+import functools
+import json
 import os
+import time
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
-OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+# Point at a stand-in such as benchmarks/fake_owm.py for offline load tests.
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org/data/2.5").rstrip("/")
+OPENWEATHER_URL = f"{OPENWEATHER_BASE_URL}/weather"
+OPENWEATHER_GROUP_URL = f"{OPENWEATHER_BASE_URL}/group"
+# The group endpoint accepts at most 20 city IDs per call.
+OPENWEATHER_GROUP_SIZE = 20
+# Upstream data is fetched and cached in one unit system; others are converted on the way out.
+CANONICAL_UNIT = "metric"
 
+WEATHER_DISTRIBUTED_LOCK = os.getenv("WEATHER_DISTRIBUTED_LOCK", "false").lower() in ("1", "true", "yes")
+WEATHER_LOCK_TTL_MS = int(os.getenv("WEATHER_LOCK_TTL_MS", 10000))
+WEATHER_LOCK_WAIT = float(os.getenv("WEATHER_LOCK_WAIT", 5.0))
+WEATHER_LOCK_POLL_INTERVAL = float(os.getenv("WEATHER_LOCK_POLL_INTERVAL", 0.05))
+WEATHER_BATCH_MAX_CITIES = int(os.getenv("WEATHER_BATCH_MAX_CITIES", 200))
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", 10))
 
-async def fetch_weather_from_api(city: str, unit: str) -> WeatherData:
+_fetch_flight = SingleFlight()
+_refresh_flight = SingleFlight()
+_refresh_tasks = set()
+
+
+async def fetch_weather_from_api(city: str, unit: str = CANONICAL_UNIT) -> WeatherData:
+    # Resolved cities are queried by their OpenWeatherMap ID.
     params = {
-        "q": city,
+        "id" if city.isdigit() else "q": city,
         "appid": OPENWEATHER_API_KEY,
         "units": unit
     }
-    async with httpx.AsyncClient() as client:
-        start = datetime.utcnow().timestamp()
-        resp = await client.get(OPENWEATHER_URL, params=params)
-        latency = datetime.utcnow().timestamp() - start
-        logger.info(f"external_api_latency api=openweathermap latency={latency:.3f}s city={city}")
+    resp, latency = await _get_upstream("weather", OPENWEATHER_URL, params)
+    logger.info(f"external_api_latency api=openweathermap latency={latency:.3f}s city={city}")
+    return _parse_weather(resp.json())
+
+
+async def _get_upstream(endpoint: str, url: str, params: dict):
+    client = get_http_client()
+
+    async def attempt():
+        start = time.perf_counter()
+        try:
+            resp = await client.get(url, params=params)
+        except Exception as e:
+            upstream_errors.inc(endpoint=endpoint, reason=type(e).__name__)
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            upstream_request_duration.observe(latency, endpoint=endpoint)
 
         if resp.status_code != 200:
-            raise Exception(f"API error: {resp.text}")
+            upstream_errors.inc(endpoint=endpoint, reason=str(resp.status_code))
+            raise UpstreamError(resp.status_code, f"API error: {resp.text}")
+        return resp, latency
+
+    return await openweather.call(attempt)
+
+
+def _parse_weather(data: dict) -> WeatherData:
+    return WeatherData(
+        temperature=data["main"]["temp"],
+        description=data["weather"][0]["description"],
+        humidity=data["main"]["humidity"],
+        wind_speed=data["wind"]["speed"]
+    )
+
+
+async def fetch_weather_group(city_ids: List[str], unit: str = CANONICAL_UNIT) -> Dict[str, WeatherData]:
+    """Fetches up to OPENWEATHER_GROUP_SIZE cities by ID in one upstream call."""
+    params = {
+        "id": ",".join(city_ids),
+        "appid": OPENWEATHER_API_KEY,
+        "units": unit
+    }
+    resp, latency = await _get_upstream("group", OPENWEATHER_GROUP_URL, params)
+    logger.info(f"external_api_latency api=openweathermap_group latency={latency:.3f}s ids={len(city_ids)}")
+    return {str(item["id"]): _parse_weather(item) for item in resp.json().get("list", [])}
+
+
+def convert_units(data: WeatherData, unit: str) -> WeatherData:
+    """Converts a canonical (metric) record to the requested unit system."""
+    if unit == CANONICAL_UNIT:
+        return data
+    return data.model_copy(update={
+        "temperature": round(data.temperature * 9 / 5 + 32, 2),
+        "wind_speed": round(data.wind_speed * 2.23694, 2),
+    })
+
+
+async def _fetch_and_cache(city: str, cache_key: str, prefetched: bool = False) -> WeatherData:
+    start = time.perf_counter()
+    weather_data = await fetch_weather_from_api(city, CANONICAL_UNIT)
+    await set_cached_weather(cache_key, weather_data, delta=time.perf_counter() - start, prefetched=prefetched)
+    return weather_data
+
+
+async def _fetch_with_redis_lock(city: str, cache_key: str) -> WeatherData:
+    lock_key = f"lock:{cache_key}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WEATHER_LOCK_WAIT
+
+    while True:
+        token = await acquire_lock(lock_key, WEATHER_LOCK_TTL_MS)
+        if token is not None:
+            try:
+                entry = await get_cached_entry(cache_key, use_local=False)
+                if entry is not None and not entry.is_stale():
+                    return entry.value
+                return await _fetch_and_cache(city, cache_key)
+            finally:
+                await release_lock(lock_key, token)
+
+        # Another worker holds the lock: wait for it to fill the cache. If it
+        # gives up without a value, the next waiter to win the lock fetches, so a
+        # failing upstream still sees one call at a time.
+        await asyncio.sleep(WEATHER_LOCK_POLL_INTERVAL)
+        cached = await get_cached_weather(cache_key)
+        if cached:
+            logger.info(f"lock_wait_hit key={cache_key}")
+            return cached
+        if loop.time() >= deadline:
+            logger.warning(f"lock_wait_timeout key={cache_key}")
+            raise TimeoutError(f"Timed out waiting for upstream fetch of {cache_key}")
+
+
+async def fetch_weather_coalesced(city: str, cache_key: str) -> WeatherData:
+    fetch = _fetch_with_redis_lock if WEATHER_DISTRIBUTED_LOCK else _fetch_and_cache
+    return await _fetch_flight.do(cache_key, functools.partial(fetch, city, cache_key))
+
+
+async def _refresh_cached_weather(city: str, cache_key: str) -> None:
+    # Another worker may have refreshed the key already; only Redis knows.
+    entry = await get_cached_entry(cache_key, use_local=False)
+    if entry is not None and not entry.is_stale():
+        return
+    if not WEATHER_DISTRIBUTED_LOCK:
+        await _fetch_and_cache(city, cache_key)
+        return
+
+    lock_key = f"lock:{cache_key}"
+    token = await acquire_lock(lock_key, WEATHER_LOCK_TTL_MS)
+    if token is None:
+        # Someone else is fetching this key; their result lands in the cache.
+        return
+    try:
+        await _fetch_and_cache(city, cache_key)
+    finally:
+        await release_lock(lock_key, token)
+
+
+def schedule_refresh(city: str, cache_key: str) -> bool:
+    """Refreshes a cache entry in the background, at most once per key at a time."""
+    if _refresh_flight.in_flight(cache_key):
+        return False
+    task = asyncio.ensure_future(
+        _refresh_flight.do(cache_key, functools.partial(_refresh_cached_weather, city, cache_key))
+    )
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_done)
+    return True
+
+
+def _refresh_done(task: asyncio.Future):
+    _refresh_tasks.discard(task)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        cache_stats["refresh"]["failed"] += 1
+        logger.warning(f"cache_refresh_failed error={str(task.exception())}")
+    else:
+        cache_stats["refresh"]["completed"] += 1
+
 
-        data = resp.json()
-        return WeatherData(
-            temperature=data["main"]["temp"],
-            description=data["weather"][0]["description"],
-            humidity=data["main"]["humidity"],
-            wind_speed=data["wind"]["speed"]
-        )
+async def prefetch_weather(city: str, cache_key: str) -> None:
+    await _fetch_flight.do(cache_key, functools.partial(_fetch_and_cache, city, cache_key, prefetched=True))
 
 
-async def get_weather_for_city(db: Session, city: str, unit: str, ip: str):
-    cache_key = f"weather:{city.lower()}:{unit}"
-    cached = get_cached_weather(cache_key)
+async def wait_for_refreshes():
+    if _refresh_tasks:
+        await asyncio.gather(*list(_refresh_tasks), return_exceptions=True)
+
+
+def resolve_city(city: str) -> Tuple[str, Optional[int]]:
+    """Returns the upstream query for a requested name and its city ID, if known."""
+    city = city.strip()
+    if city.isdigit():
+        return city, int(city)
+    resolved = get_city_index().resolve(city)
+    if resolved is not None:
+        return str(resolved.id), resolved.id
+    return city, None
+
+
+def can_fall_back(error: Exception) -> bool:
+    # A city upstream does not know is an answer, not an outage.
+    return not isinstance(error, LookupError) and not (isinstance(error, UpstreamError) and not error.retryable)
+
+
+def weather_cache_key(query: str) -> str:
+    # One entry per city in CANONICAL_UNIT, shared by metric and imperial requests.
+    return f"weather:{normalize_name(query)}"
+
+
+async def get_weather_for_city(db: AsyncSession, city: str, unit: str, ip: str):
+    query, city_id = resolve_city(city)
+    cache_key = weather_cache_key(query)
+    entry = await get_cached_entry(cache_key)
     served_from_cache = False
+    stale = False
+    # When the value goes stale, for HTTP caching; None for a fallback value.
+    fresh_until = None
+    prefetcher.record(cache_key)
 
-    if cached:
-        weather_data = cached
+    if entry:
+        weather_data = entry.value
         served_from_cache = True
-        logger.info(f"cache_hit city={city} unit={unit}")
+        fresh_until = entry.fresh_until
+        if entry.is_stale():
+            stale = True
+            cache_stats["refresh"]["stale_served"] += 1
+            schedule_refresh(query, cache_key)
+            logger.info(f"cache_stale city={city} unit={unit}")
+        elif entry.should_refresh_early():
+            if schedule_refresh(query, cache_key):
+                cache_stats["refresh"]["early"] += 1
+            logger.info(f"cache_early_refresh city={city} unit={unit}")
+        else:
+            logger.info(f"cache_hit city={city} unit={unit}")
+        if entry.prefetched:
+            await prefetcher.note_hit(cache_key, entry)
     else:
-        weather_data = await fetch_weather_from_api(city, unit)
-        set_cached_weather(cache_key, weather_data)
-        logger.info(f"cache_miss city={city} unit={unit}")
+        try:
+            weather_data = await fetch_weather_coalesced(query, cache_key)
+        except Exception as e:
+            fallback = (await get_fallback_entries([cache_key]))[0] if can_fall_back(e) else None
+            if fallback is None:
+                raise
+            weather_data = fallback.value
+            served_from_cache = stale = True
+            fallback_responses.inc(route="/weather")
+            logger.warning(f"upstream_fallback city={city} unit={unit} error={str(e)}")
+        else:
+            fresh_until = time.time() + CACHE_SOFT_TTL
+            logger.info(f"cache_miss city={city} unit={unit}")
+    weather_data = convert_units(weather_data, unit)
 
-    query = WeatherQuery(
+    record = dict(
         city=city,
+        city_id=city_id,
         unit=unit,
         temperature=weather_data.temperature,
         description=weather_data.description,
         humidity=weather_data.humidity,
         wind_speed=weather_data.wind_speed,
         served_from_cache=served_from_cache,
-        ip_address=ip
+        ip_address=ip,
+        timestamp=datetime.utcnow()
     )
-    db.add(query)
-    db.commit()
-    db.refresh(query)
+    if not await audit_writer.enqueue(record):
+        db.add(WeatherQuery(**record))
+        await db.commit()
 
     return {
         "city": city,
         "temperature": weather_data.temperature,
         "description": weather_data.description,
         "unit": unit,
-        "timestamp": query.timestamp,
-        "served_from_cache": served_from_cache
+        "timestamp": record["timestamp"],
+        "served_from_cache": served_from_cache,
+        "stale": stale,
+        "fresh_until": fresh_until
     }
 
 
-def get_query_history(db: Session, city: str = None, date_from: datetime = None,
-                      date_to: datetime = None, page: int = 1, page_size: int = 10):
-    query = db.query(WeatherQuery)
+async def _fetch_misses(misses: Dict[str, str]) -> dict:
+    """Fetches {cache_key: query} from upstream; returns {cache_key: (WeatherData, delta) or Exception}."""
+    semaphore = asyncio.Semaphore(WEATHER_BATCH_CONCURRENCY)
+    results = {}
+    # Resolved cities (numeric queries) go through the group endpoint.
+    by_id = {city: key for key, city in misses.items() if city.isdigit()}
+    ids = list(by_id)
+
+    async def fetch_one(key: str, city: str):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                data = await _fetch_flight.do(key, functools.partial(fetch_weather_from_api, city, CANONICAL_UNIT))
+                results[key] = (data, time.perf_counter() - start)
+            except Exception as e:
+                results[key] = e
+
+    async def fetch_group(chunk: List[str]):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                found = await fetch_weather_group(chunk, CANONICAL_UNIT)
+            except Exception as e:
+                for city_id in chunk:
+                    results[by_id[city_id]] = e
+                return
+            delta = time.perf_counter() - start
+            for city_id in chunk:
+                if city_id in found:
+                    results[by_id[city_id]] = (found[city_id], delta)
+                else:
+                    results[by_id[city_id]] = LookupError(f"City not found: {city_id}")
+
+    await asyncio.gather(
+        *(fetch_one(key, city) for key, city in misses.items() if not city.isdigit()),
+        *(fetch_group(ids[i:i + OPENWEATHER_GROUP_SIZE]) for i in range(0, len(ids), OPENWEATHER_GROUP_SIZE)),
+    )
+    return results
+
+
+async def get_weather_for_cities(db: AsyncSession, cities: List[str], unit: str, ip: str) -> List[dict]:
+    resolved = [resolve_city(city) for city in cities]
+    keys = [weather_cache_key(query) for query, _ in resolved]
+    unique_keys = list(dict.fromkeys(keys))
+    entries = dict(zip(unique_keys, await get_cached_entries(unique_keys)))
+    for key in unique_keys:
+        prefetcher.record(key)
+
+    misses = {}
+    for (query, _), key in zip(resolved, keys):
+        if entries[key] is None:
+            misses.setdefault(key, query)
+    fetched = await _fetch_misses(misses)
+    await set_cached_entries({k: v for k, v in fetched.items() if not isinstance(v, Exception)})
+    failed = [k for k, v in fetched.items() if isinstance(v, Exception) and can_fall_back(v)]
+    fallbacks = {k: e for k, e in zip(failed, await get_fallback_entries(failed)) if e is not None}
+    logger.info(f"batch_weather cities={len(cities)} misses={len(misses)} unit={unit}")
+
+    timestamp = datetime.utcnow()
+    results = []
+    records = []
+    for city, (query, city_id), key in zip(cities, resolved, keys):
+        entry = entries[key]
+        stale = False
+        if entry is not None:
+            weather_data = entry.value
+            served_from_cache = True
+            if entry.is_stale():
+                stale = True
+                cache_stats["refresh"]["stale_served"] += 1
+                schedule_refresh(query, key)
+        elif key in fallbacks:
+            weather_data = fallbacks[key].value
+            served_from_cache = stale = True
+            fallback_responses.inc(route="/weather/batch")
+            logger.warning(f"upstream_fallback city={city} unit={unit} error={str(fetched[key])}")
+        elif isinstance(fetched[key], Exception):
+            error = fetched[key]
+            logger.error(f"weather_fetch_error city={city} error={str(error)}")
+            detail = "City not found" if isinstance(error, LookupError) else "Failed to fetch weather data"
+            results.append({"city": city, "unit": unit, "error": detail})
+            continue
+        else:
+            weather_data = fetched[key][0]
+            served_from_cache = False
+        weather_data = convert_units(weather_data, unit)
+
+        records.append(dict(
+            city=city,
+            city_id=city_id,
+            unit=unit,
+            temperature=weather_data.temperature,
+            description=weather_data.description,
+            humidity=weather_data.humidity,
+            wind_speed=weather_data.wind_speed,
+            served_from_cache=served_from_cache,
+            ip_address=ip,
+            timestamp=timestamp
+        ))
+        results.append({
+            "city": city,
+            "temperature": weather_data.temperature,
+            "description": weather_data.description,
+            "unit": unit,
+            "timestamp": timestamp,
+            "served_from_cache": served_from_cache,
+            "stale": stale,
+        })
+
+    rejected = [record for record in records if not await audit_writer.enqueue(record)]
+    if rejected:
+        await db.execute(insert(WeatherQuery), rejected)
+        await db.commit()
+
+    return results
+
+
+async def get_query_history(db: AsyncSession, city: str = None, date_from: datetime = None,
+                            date_to: datetime = None, page: int = 1, page_size: int = 10,
+                            city_match: str = "substring"):
+    query = apply_history_filters(select(WeatherQuery), city, date_from, date_to, city_match)
+    result = await db.scalars(
+        query.order_by(WeatherQuery.timestamp.desc(), WeatherQuery.id.desc())
+        .offset((page - 1) * page_size)
+        .limit(page_size)
+    )
+
+    return result.all()
+
+
+def encode_history_cursor(timestamp: datetime, query_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), query_id]).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, query_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(query_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
+
+
+async def get_query_history_page(db: AsyncSession, city: str = None, date_from: datetime = None,
+                                 date_to: datetime = None, cursor: str = None, page_size: int = 10,
+                                 city_match: str = "substring"):
+    query = apply_history_filters(select(WeatherQuery), city, date_from, date_to, city_match)
+    if cursor:
+        timestamp, query_id = decode_history_cursor(cursor)
+        query = query.where(tuple_(WeatherQuery.timestamp, WeatherQuery.id) < tuple_(timestamp, query_id))
+
+    result = await db.scalars(
+        query.order_by(WeatherQuery.timestamp.desc(), WeatherQuery.id.desc())
+        .limit(page_size + 1)
+    )
+    items = result.all()
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_history_cursor(items[-1].timestamp, items[-1].id)
+    return items, next_cursor
+
+
+async def count_query_history(db: AsyncSession, city: str = None, date_from: datetime = None,
+                              date_to: datetime = None, estimated: bool = False,
+                              city_match: str = "substring") -> int:
+    query = apply_history_filters(select(WeatherQuery.id), city, date_from, date_to, city_match)
 
-    if city:
-        query = query.filter(WeatherQuery.city.ilike(f"%{city}%"))
-    if date_from:
-        query = query.filter(WeatherQuery.timestamp >= date_from)
-    if date_to:
-        query = query.filter(WeatherQuery.timestamp <= date_to)
+    if not estimated:
+        return await db.scalar(select(func.count()).select_from(query.subquery()))
 
-    total = query.count()
-    items = query.order_by(WeatherQuery.timestamp.desc()) \
-        .offset((page - 1) * page_size) \
-        .limit(page_size) \
-        .all()
+    if not (city or date_from or date_to):
+        # The partitioned parent has no statistics of its own, so sum them over
+        # its partitions. reltuples is -1 until a table has been vacuumed or analyzed.
+        rows = await db.scalar(text(
+            "SELECT sum(c.reltuples)::bigint FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'weather_queries'::regclass AND c.reltuples >= 0"
+        ))
+        if rows is not None:
+            return rows
 
-    return items
\ No newline at end of file
+    # Planner row estimate for the filtered query; no rows are read.
+    compiled = query.compile(dialect=db.bind.dialect)
+    conn = await db.connection()
+    params = compiled.params
+    if compiled.positiontup is not None:
+        params = tuple(params[name] for name in compiled.positiontup)
+    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
\ No newline at end of file
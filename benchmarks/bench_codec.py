@@ -0,0 +1,57 @@
+"""Micro-benchmark for cache entry encoding and decoding.
+
+Compares the original format (json.dumps of model_dump, WeatherData(**d) on
+read) with the JSON envelope and the binary struct codec from app/codecs.py.
+
+    python -m benchmarks.bench_codec [--number 200000]
+"""
+import argparse
+import json
+import time
+from app.codecs import encode_entry, decode_entry
+from app.schemas import WeatherData
+
+WEATHER = WeatherData(temperature=12.34, description="broken clouds", humidity=71, wind_speed=3.6)
+
+
+def legacy_encode():
+    return json.dumps(WEATHER.model_dump()).encode("utf-8")
+
+
+def legacy_decode(data: bytes):
+    return WeatherData(**json.loads(data.decode("utf-8")))
+
+
+def measure(fn, arg, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn(arg) if arg is not None else fn()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    cases = {
+        "legacy": (legacy_encode, legacy_decode),
+        "json": (lambda: encode_entry(WEATHER, 1.0, 0.1, codec="json"), decode_entry),
+        "struct": (lambda: encode_entry(WEATHER, 1.0, 0.1, codec="struct"), decode_entry),
+    }
+
+    fields = WEATHER.model_dump()
+    print(f"model_construct   {measure(lambda: WeatherData.model_construct(**fields), None, args.number):.2f} us")
+    print(f"WeatherData(**d)  {measure(lambda: WeatherData(**fields), None, args.number):.2f} us")
+    print()
+
+    print(f"{'codec':<8} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for name, (encode, decode) in cases.items():
+        payload = encode()
+        encode_us = measure(encode, None, args.number)
+        decode_us = measure(decode, payload, args.number)
+        print(f"{name:<8} {len(payload):>6} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
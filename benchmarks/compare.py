@@ -0,0 +1,66 @@
+"""Compares two load results written by benchmarks.load.
+
+    python -m benchmarks.compare results/base.json results/head.json --threshold 10
+
+Exits with status 1 when RPS dropped or a latency percentile grew by more
+than --threshold percent, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+# (label, path in the result, True if higher is better)
+METRICS = [
+    ("rps", ("rps",), True),
+    ("p50 ms", ("latency_ms", "p50"), False),
+    ("p95 ms", ("latency_ms", "p95"), False),
+    ("p99 ms", ("latency_ms", "p99"), False),
+    ("errors", ("errors",), False),
+]
+
+
+def lookup(result: dict, path):
+    for part in path:
+        result = result[part]
+    return result
+
+
+def compare(base: dict, head: dict, threshold: float):
+    rows = []
+    regressions = []
+    for label, path, higher_is_better in METRICS:
+        before, after = lookup(base, path), lookup(head, path)
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if higher_is_better else change
+        regressed = label != "errors" and worse > threshold or label == "errors" and after > before
+        rows.append((label, before, after, change, regressed))
+        if regressed:
+            regressions.append(label)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression, percent")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    if base["scenario"] != head["scenario"]:
+        sys.exit(f"scenario mismatch: {base['scenario']} vs {head['scenario']}")
+
+    rows, regressions = compare(base, head, args.threshold)
+    print(f"scenario {head['scenario']}: {base.get('commit')} -> {head.get('commit')}")
+    print(f"{'metric':<8} {'base':>10} {'head':>10} {'change':>8}")
+    for label, before, after, change, regressed in rows:
+        print(f"{label:<8} {before:>10} {after:>10} {change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Local stand-in for the OpenWeatherMap /weather and /group endpoints.
+
+Answers are derived from the requested city, so repeated runs see the same
+data. Latency and error rate are configurable to rehearse a slow or failing
+upstream.
+
+    python -m benchmarks.fake_owm --port 8081 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+    OPENWEATHER_BASE_URL=http://127.0.0.1:8081/data/2.5 uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
+
+DESCRIPTIONS = ["clear sky", "few clouds", "scattered clouds", "broken clouds", "light rain", "snow", "mist"]
+
+# Names starting with this prefix are answered with 404, like an unknown city.
+NOT_FOUND_PREFIX = "nowhere"
+
+
+class Settings:
+    latency_ms = 50.0
+    jitter_ms = 20.0
+    error_rate = 0.0
+    error_status = 502
+
+
+settings = Settings()
+stats = {"weather": 0, "group": 0, "errors": 0}
+app = FastAPI()
+
+
+def fake_weather(city: str, city_id: int) -> dict:
+    seed = zlib.crc32(city.lower().encode("utf-8"))
+    return {
+        "id": city_id,
+        "name": city,
+        "main": {"temp": round((seed % 600) / 10 - 25, 2), "humidity": seed % 100},
+        "weather": [{"description": DESCRIPTIONS[seed % len(DESCRIPTIONS)]}],
+        "wind": {"speed": round((seed >> 8) % 200 / 10, 1)},
+    }
+
+
+async def simulate(endpoint: str):
+    stats[endpoint] += 1
+    delay = max(0.0, random.gauss(settings.latency_ms, settings.jitter_ms)) / 1000
+    await asyncio.sleep(delay)
+    if random.random() < settings.error_rate:
+        stats["errors"] += 1
+        return JSONResponse(status_code=settings.error_status, content={"cod": settings.error_status,
+                                                                          "message": "simulated failure"})
+    return None
+
+
+@app.get("/data/2.5/weather")
+async def weather(q: str = None, id: int = None, units: str = "metric", appid: str = None):
+    error = await simulate("weather")
+    if error is not None:
+        return error
+    if q is not None and q.lower().startswith(NOT_FOUND_PREFIX):
+        return JSONResponse(status_code=404, content={"cod": "404", "message": "city not found"})
+    city = q if q is not None else str(id)
+    return fake_weather(city, id if id is not None else zlib.crc32(city.encode("utf-8")) % 10_000_000)
+
+
+@app.get("/data/2.5/group")
+async def group(id: str = Query(...), units: str = "metric", appid: str = None):
+    error = await simulate("group")
+    if error is not None:
+        return error
+    ids = [int(i) for i in id.split(",") if i]
+    return {"cnt": len(ids), "list": [fake_weather(str(i), i) for i in ids]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate)
+    parser.add_argument("--error-status", type=int, default=settings.error_status)
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.error_rate = args.error_rate
+    settings.error_status = args.error_status
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Load scenarios against a running instance of the API.
+
+    python -m benchmarks.load cache-hot --duration 30 --concurrency 50 --output results/hot.json
+
+Scenarios:
+  cache-hot      /weather for a handful of cities, warmed before measuring
+  cache-cold     /weather for a different city ID on every request
+  deep-history   /history walked page by page with keyset cursors (or --pagination offset)
+  large-export   full /export downloads; reports bytes per second as well
+
+Start the API against benchmarks/fake_owm.py and lift the rate limit first,
+otherwise most requests measure the 429 path:
+
+    RATE_LIMIT_MAX_REQUESTS=1000000000 OPENWEATHER_BASE_URL=http://127.0.0.1:8081/data/2.5 \\
+        uvicorn app.main:app --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+import httpx
+
+HOT_CITIES = ["London", "Minsk", "Oslo", "Paris", "Berlin"]
+# OpenWeatherMap IDs are below this; cold requests count down from it so they
+# never hit an entry a previous run left in the cache.
+COLD_ID_START = 20_000_000
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    # Nearest-rank percentile.
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.bytes = 0
+        self.errors = 0
+
+    async def timed(self, request: Callable[[], Awaitable[httpx.Response]]) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await request()
+        except httpx.HTTPError as e:
+            self.errors += 1
+            self.statuses[type(e).__name__] += 1
+            return None
+        self.latencies.append(time.perf_counter() - start)
+        self.statuses[str(response.status_code)] += 1
+        self.bytes += len(response.content)
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+
+class Scenario:
+    name = ""
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+
+    async def setup(self):
+        pass
+
+    async def step(self, recorder: Recorder, worker: int):
+        raise NotImplementedError
+
+
+class CacheHot(Scenario):
+    name = "cache-hot"
+
+    async def setup(self):
+        for city in HOT_CITIES:
+            await self.client.get("/weather", params={"city": city})
+        self._i = 0
+
+    async def step(self, recorder, worker):
+        self._i += 1
+        city = HOT_CITIES[self._i % len(HOT_CITIES)]
+        await recorder.timed(lambda: self.client.get("/weather", params={"city": city}))
+
+
+class CacheCold(Scenario):
+    name = "cache-cold"
+
+    async def setup(self):
+        self._next_id = COLD_ID_START + int(time.time()) % 1_000_000 * 10
+
+    async def step(self, recorder, worker):
+        self._next_id += 1
+        city_id = str(self._next_id)
+        await recorder.timed(lambda: self.client.get("/weather", params={"city": city_id}))
+
+
+class DeepHistory(Scenario):
+    name = "deep-history"
+
+    async def setup(self):
+        self._cursors = {}
+        self._pages = {}
+
+    async def step(self, recorder, worker):
+        params = {"page_size": self.args.page_size, "pagination": self.args.pagination}
+        page = self._pages.get(worker, 1)
+        if self.args.pagination == "keyset" and self._cursors.get(worker):
+            params["cursor"] = self._cursors[worker]
+        else:
+            params["page"] = page
+        response = await recorder.timed(lambda: self.client.get("/history", params=params))
+        if response is None or response.status_code != 200:
+            return
+        # Each worker walks forward until --max-pages, then starts over.
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if page >= self.args.max_pages or (self.args.pagination == "keyset" and not next_cursor):
+            self._pages[worker], self._cursors[worker] = 1, None
+        else:
+            self._pages[worker], self._cursors[worker] = page + 1, next_cursor
+
+
+class LargeExport(Scenario):
+    name = "large-export"
+
+    async def step(self, recorder, worker):
+        params = {"format": self.args.format}
+        await recorder.timed(lambda: self.client.get("/export", params=params, timeout=None))
+
+
+SCENARIOS = {cls.name: cls for cls in (CacheHot, CacheCold, DeepHistory, LargeExport)}
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        scenario = SCENARIOS[args.scenario](client, args)
+        await scenario.setup()
+        recorder = Recorder()
+        deadline = time.perf_counter() + args.duration
+        remaining = [args.requests] if args.requests else None
+
+        async def worker(n: int):
+            while time.perf_counter() < deadline:
+                if remaining is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                await scenario.step(recorder, n)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(recorder.latencies)
+    completed = len(latencies)
+    return {
+        "scenario": args.scenario,
+        "commit": git_commit(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "host": platform.node(),
+        "config": {
+            "base_url": args.base_url, "concurrency": args.concurrency, "duration": args.duration,
+            "requests": args.requests, "page_size": args.page_size, "pagination": args.pagination,
+            "format": args.format,
+        },
+        "requests": completed,
+        "errors": recorder.errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "bytes_per_second": round(recorder.bytes / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "mean": round(sum(latencies) / completed * 1000, 2) if completed else 0.0,
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "status": dict(recorder.statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: no limit)")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--max-pages", type=int, default=200)
+    parser.add_argument("--pagination", choices=("keyset", "offset"), default="keyset")
+    parser.add_argument("--format", default="csv", help="large-export: /export format (csv, csv.gz, parquet, ...)")
+    parser.add_argument("--output", help="write the JSON result here as well")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Fills weather_queries with synthetic history for the load scenarios.
+
+Rows are streamed into COPY, so millions of rows load in minutes. City names
+come from the city index (skewed toward the first ones, like real traffic) and
+timestamps are spread over the last --days days. Missing partitions are
+created first so the rows do not land in the default partition.
+
+    python -m benchmarks.seed --rows 5000000 --days 90
+"""
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app.cities import get_city_index
+from app.database import engine
+from app.partitions import ensure_partitions
+
+COLUMNS = ("city", "city_normalized", "city_id", "unit", "temperature", "description", "humidity",
+           "wind_speed", "served_from_cache", "ip_address", "timestamp")
+DESCRIPTIONS = ["clear sky", "few clouds", "broken clouds", "light rain", "snow"]
+
+
+class RowStream(io.RawIOBase):
+    """File-like object that renders generated rows as COPY text on demand."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b):
+            chunk = "".join(next(self._rows, "") for _ in range(1000))
+            if not chunk:
+                break
+            self._buffer += chunk.encode("utf-8")
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def generate_rows(count: int, start: datetime, end: datetime, seed: int):
+    rng = random.Random(seed)
+    # ASCII names only: COPY text is sent as UTF-8 and test databases may be SQL_ASCII.
+    names = [(c.name, c.name.lower(), str(c.id)) for c in get_city_index() if c.name.isascii()]
+    names = names or [("London", "london", r"\N")]
+    span = (end - start).total_seconds()
+    for _ in range(count):
+        name, normalized, city_id = names[min(int(rng.paretovariate(1.2)) - 1, len(names) - 1)]
+        ts = start + timedelta(seconds=rng.random() * span)
+        yield "\t".join((
+            name, normalized, city_id, rng.choice(("metric", "imperial")), f"{rng.uniform(-30, 40):.2f}",
+            rng.choice(DESCRIPTIONS), str(rng.randint(10, 100)), f"{rng.uniform(0, 20):.2f}",
+            "t" if rng.random() < 0.8 else "f", f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            ts.isoformat(sep=" "),
+        )) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="delete existing history first")
+    args = parser.parse_args()
+
+    end = datetime.utcnow()
+    start = end - timedelta(days=args.days)
+    began = time.perf_counter()
+    with engine.begin() as conn:
+        if args.truncate:
+            conn.execute(text("TRUNCATE weather_queries"))
+        created = ensure_partitions(conn, start=start, now=end)
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY weather_queries ({', '.join(COLUMNS)}) FROM STDIN",
+                io.BufferedReader(RowStream(generate_rows(args.rows, start, end, args.seed)), 1 << 20),
+            )
+        finally:
+            cursor.close()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE weather_queries"))
+    elapsed = time.perf_counter() - began
+    print(f"seeded rows={args.rows} partitions_created={len(created)} seconds={elapsed:.1f} "
+          f"rows_per_second={args.rows / elapsed:.0f}")
+
+
+if __name__ == "__main__":
+    main()
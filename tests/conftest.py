@@ -1,9 +1,11 @@
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
-from app.database import Base, get_db
+from app.database import Base, get_db, get_async_db, make_async_url
 from app.main import app
 import os
 import time
@@ -16,6 +18,9 @@ RETRY_DELAY = 1
 engine = None
 TestingSessionLocal = None
 
+async_engine = create_async_engine(make_async_url(TEST_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 for attempt in range(MAX_RETRIES):
     try:
         engine = create_engine(
@@ -51,19 +56,27 @@ def setup_test_db():
     Base.metadata.drop_all(bind=engine)
 
 
-@pytest.fixture
-def test_db():
-    connection = engine.connect()
-    transaction = connection.begin()
+@pytest_asyncio.fixture
+async def test_db():
+    async with async_engine.connect() as connection:
+        transaction = await connection.begin()
+        db = AsyncSession(
+            bind=connection,
+            autoflush=False,
+            expire_on_commit=False,
+            join_transaction_mode="create_savepoint"
+        )
 
-    db = TestingSessionLocal(bind=connection)
+        try:
+            yield db
+        finally:
+            await db.close()
+            await transaction.rollback()
 
-    try:
-        yield db
-    finally:
-        transaction.rollback()
-        db.close()
-        connection.close()
+
+@pytest.fixture
+def session_factory():
+    return TestingAsyncSessionLocal
 
 
 @pytest.fixture
@@ -80,7 +93,12 @@ def test_client():
             db.close()
             connection.close()
 
+    async def override_get_async_db():
+        async with TestingAsyncSessionLocal() as db:
+            yield db
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
 
     with TestClient(app) as client:
         yield client
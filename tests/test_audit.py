@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+import uuid
+from datetime import datetime
+from sqlalchemy import select, func, delete
+from app.audit import AuditWriter
+from app.models import WeatherQuery
+
+
+def make_record(city):
+    return dict(
+        city=city, unit="metric", temperature=1.0, description="fog",
+        humidity=95, wind_speed=0.5, served_from_cache=True,
+        ip_address="127.0.0.1", timestamp=datetime.utcnow()
+    )
+
+
+async def count_and_cleanup(session_factory, city):
+    async with session_factory() as db:
+        rows = await db.scalar(select(func.count()).where(WeatherQuery.city == city))
+        await db.execute(delete(WeatherQuery).where(WeatherQuery.city == city))
+        await db.commit()
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_writer_flushes_in_batches(session_factory):
+    city = f"AuditCity-{uuid.uuid4().hex[:6]}"
+    writer = AuditWriter(session_factory, maxsize=100, batch_size=2, flush_interval=0.05)
+    await writer.start()
+
+    for _ in range(5):
+        assert await writer.enqueue(make_record(city)) is True
+    await writer.stop()
+
+    assert writer.stats["flushed"] == 5
+    assert writer.stats["flushes"] == 3
+    assert writer.queue_depth == 0
+    assert await count_and_cleanup(session_factory, city) == 5
+
+
+@pytest.mark.asyncio
+async def test_writer_rejects_when_not_running(session_factory):
+    writer = AuditWriter(session_factory)
+    assert await writer.enqueue(make_record("Nowhere")) is False
+
+
+@pytest.mark.asyncio
+async def test_writer_applies_backpressure_when_full(session_factory):
+    city = f"AuditCity-{uuid.uuid4().hex[:6]}"
+    release = asyncio.Event()
+
+    class SlowWriter(AuditWriter):
+        async def _flush(self, batch, max_attempts=None):
+            await release.wait()
+            return await super()._flush(batch, max_attempts)
+
+    writer = SlowWriter(session_factory, maxsize=1, batch_size=1, flush_interval=0.01, enqueue_timeout=0.01)
+    await writer.start()
+
+    results = [await writer.enqueue(make_record(city)) for _ in range(5)]
+    release.set()
+    await writer.stop()
+
+    assert results.count(False) == writer.stats["rejected"]
+    assert writer.stats["rejected"] > 0
+    assert await count_and_cleanup(session_factory, city) == results.count(True)
+
+
+@pytest.mark.asyncio
+async def test_writer_retries_failed_flush(session_factory):
+    city = f"AuditCity-{uuid.uuid4().hex[:6]}"
+    failures = {"left": 2}
+
+    def flaky_factory():
+        if failures["left"]:
+            failures["left"] -= 1
+            raise ConnectionError("db blip")
+        return session_factory()
+
+    writer = AuditWriter(flaky_factory, batch_size=10, flush_interval=0.01, retry_base_delay=0.01)
+    await writer.start()
+    assert await writer.enqueue(make_record(city)) is True
+    await writer.stop()
+
+    assert writer.stats["flush_errors"] == 2
+    assert writer.stats["failed"] == 0
+    assert await count_and_cleanup(session_factory, city) == 1
+
+
+@pytest.mark.asyncio
+async def test_stop_gives_up_while_database_is_down(session_factory):
+    def broken_factory():
+        raise ConnectionError("database is down")
+
+    writer = AuditWriter(broken_factory, maxsize=3, batch_size=2, flush_interval=0.01,
+                         retry_base_delay=0.05, retry_max_delay=0.05, shutdown_retries=2)
+    await writer.start()
+    for _ in range(3):
+        assert await writer.enqueue(make_record("Nowhere")) is True
+    # Let the first batch get stuck retrying and the queue fill up behind it.
+    await asyncio.sleep(0.2)
+    for _ in range(3):
+        await writer.enqueue(make_record("Nowhere"))
+
+    await asyncio.wait_for(writer.stop(), timeout=5)
+
+    assert writer.stats["failed"] == writer.stats["enqueued"]
+    assert writer.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_stop_writes_rows_from_blocked_callers(session_factory):
+    city = f"AuditCity-{uuid.uuid4().hex[:6]}"
+    writer = AuditWriter(session_factory, maxsize=1, batch_size=10, flush_interval=0.2, enqueue_timeout=1.0)
+    await writer.start()
+
+    enqueues = [asyncio.ensure_future(writer.enqueue(make_record(city))) for _ in range(4)]
+    await asyncio.sleep(0)
+    await writer.stop()
+    results = await asyncio.gather(*enqueues)
+
+    assert writer.queue_depth == 0
+    assert await count_and_cleanup(session_factory, city) == results.count(True)
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_fills_normalized_city(session_factory):
+    city = f" AuditCity-{uuid.uuid4().hex[:6]} "
+    writer = AuditWriter(session_factory, batch_size=10, flush_interval=0.01)
+    await writer.start()
+    await writer.enqueue(make_record(city))
+    await writer.stop()
+
+    async with session_factory() as db:
+        normalized = await db.scalar(select(WeatherQuery.city_normalized).where(WeatherQuery.city == city))
+    assert normalized == city.strip().lower()
+    await count_and_cleanup(session_factory, city)
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+import pytest
+from unittest.mock import patch
+from app.cache import (
+    LocalCache, local_cache, redis_client, cache_stats, get_async_redis,
+    get_cached_weather, set_cached_weather, get_cached_entry, CacheEntry
+)
+from app.schemas import WeatherData
+
+WEATHER = WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    redis_client.flushall()
+    local_cache.clear()
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set("a", WEATHER)
+    cache.set("b", WEATHER)
+    cache.get("a")
+    cache.set("c", WEATHER)
+
+    assert cache.get("a") is WEATHER
+    assert cache.get("b") is None
+    assert cache.get("c") is WEATHER
+
+
+def test_local_cache_ttl_capped_and_expires():
+    cache = LocalCache(maxsize=10, ttl=0.05)
+    cache.set("a", WEATHER, ttl=60)
+    assert cache.get("a") is WEATHER
+
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_hot_key_served_from_local_tier():
+    await set_cached_weather("weather:minsk:metric", WEATHER)
+    l2_hits = cache_stats["l2"]["hits"]
+    l1_hits = cache_stats["l1"]["hits"]
+
+    assert await get_cached_weather("weather:minsk:metric") is WEATHER
+    assert cache_stats["l1"]["hits"] == l1_hits + 1
+    assert cache_stats["l2"]["hits"] == l2_hits
+
+
+@pytest.mark.asyncio
+async def test_redis_hit_populates_local_tier():
+    await set_cached_weather("weather:minsk:metric", WEATHER)
+    local_cache.clear()
+
+    first = await get_cached_weather("weather:minsk:metric")
+    assert first == WEATHER
+    assert await get_cached_weather("weather:minsk:metric") is first
+
+
+@pytest.mark.asyncio
+async def test_corrupt_redis_entry_counted_as_l2_eviction():
+    redis_client.set("weather:minsk:metric", b"\xff not json")
+    evictions = cache_stats["l2"]["evictions"]
+
+    assert await get_cached_weather("weather:minsk:metric") is None
+    assert cache_stats["l2"]["evictions"] == evictions + 1
+    assert not redis_client.exists("weather:minsk:metric")
+
+
+def test_async_redis_from_previous_loop_is_closed():
+    async def first():
+        client = get_async_redis()
+        await client.ping()
+        return client
+
+    async def second():
+        client = get_async_redis()
+        await asyncio.sleep(0.01)
+        return client
+
+    old = asyncio.run(first())
+    pool = old.connection_pool
+    new = asyncio.run(second())
+
+    assert new is not old
+    assert not any(conn.is_connected for conn in pool._available_connections)
+
+
+@pytest.mark.asyncio
+async def test_entry_served_stale_until_hard_ttl():
+    await set_cached_weather("weather:minsk:metric", WEATHER, soft_ttl=0, hard_ttl=60)
+    local_cache.clear()
+
+    entry = await get_cached_entry("weather:minsk:metric")
+    assert entry.value == WEATHER
+    assert entry.is_stale()
+    assert 0 < redis_client.pttl("weather:minsk:metric") <= 60000
+
+
+@pytest.mark.asyncio
+async def test_entry_without_envelope_still_readable():
+    redis_client.set("weather:minsk:metric", json.dumps(WEATHER.model_dump()), ex=60)
+
+    entry = await get_cached_entry("weather:minsk:metric")
+    assert entry.value == WEATHER
+    assert not entry.is_stale()
+
+
+def test_early_refresh_probability_follows_recompute_time():
+    now = 1000.0
+    far = CacheEntry(WEATHER, fresh_until=now + 300, delta=0.2)
+    near = CacheEntry(WEATHER, fresh_until=now + 0.1, delta=0.2)
+
+    with patch("app.cache.random.random", return_value=0.5):
+        assert not far.should_refresh_early(beta=1.0, now=now)
+        assert near.should_refresh_early(beta=1.0, now=now)
+        assert not near.should_refresh_early(beta=0, now=now)
+    assert not CacheEntry(WEATHER, fresh_until=now + 0.1).should_refresh_early(beta=1.0, now=now)
@@ -0,0 +1,32 @@
+from app.cities import CityIndex, normalize_name, parse_query
+
+CITIES = [
+    {"id": 2643743, "name": "London", "country": "GB", "aliases": ["Лондон"]},
+    {"id": 6058560, "name": "London", "country": "CA"},
+    {"id": 3448439, "name": "São Paulo", "country": "BR"},
+    {"id": 5368361, "name": "Los Angeles", "country": "US"},
+]
+
+
+def test_normalize_and_parse():
+    assert normalize_name("  São   Paulo ") == "sao paulo"
+    assert parse_query("London, gb") == ("london", "GB")
+    assert parse_query("Washington, D.C.") == ("washington, d.c.", None)
+
+
+def test_resolve_names_aliases_and_country():
+    index = CityIndex(CITIES)
+    assert index.resolve("london ").id == 2643743
+    assert index.resolve("Лондон").id == 2643743
+    assert index.resolve("London,CA").id == 6058560
+    assert index.resolve("sao paulo").id == 3448439
+    assert index.resolve("6058560").name == "London"
+    assert index.resolve("London,FR") is None
+    assert index.resolve("Atlantis") is None
+
+
+def test_prefix_search():
+    index = CityIndex(CITIES)
+    assert [c.id for c in index.search("lo")] == [2643743, 6058560, 5368361]
+    assert [c.id for c in index.search("lo", limit=1)] == [2643743]
+    assert index.search("x") == []
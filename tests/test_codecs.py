@@ -0,0 +1,32 @@
+import json
+import pytest
+from app.codecs import encode_entry, decode_entry
+from app.schemas import WeatherData
+
+WEATHER = WeatherData(temperature=-3.25, description="лёгкий снег", humidity=87, wind_speed=4.1)
+
+
+@pytest.mark.parametrize("codec", ["json", "struct"])
+def test_round_trip(codec):
+    data = encode_entry(WEATHER, 1700000000.5, delta=0.25, prefetched=True, codec=codec)
+    entry = decode_entry(data)
+
+    assert entry.value == WEATHER
+    assert entry.fresh_until == 1700000000.5
+    assert entry.delta == 0.25
+    assert entry.prefetched is True
+
+
+def test_struct_is_smaller_than_json():
+    assert len(encode_entry(WEATHER, 1.0, codec="struct")) < len(encode_entry(WEATHER, 1.0, codec="json"))
+
+
+def test_legacy_json_still_decodes():
+    entry = decode_entry(json.dumps(WEATHER.model_dump()).encode())
+    assert entry.value == WEATHER
+
+
+@pytest.mark.parametrize("data", [b"\x02" + b"\x00" * 40, b"\x01\x00", b"{\"value\": {}}"])
+def test_unreadable_entries_raise(data):
+    with pytest.raises((ValueError, KeyError)):
+        decode_entry(data)
@@ -0,0 +1,11 @@
+from app.database import make_async_url
+
+
+def test_async_url_translates_libpq_params():
+    url = make_async_url("postgresql://u:p@db:5432/app?sslmode=require&connect_timeout=5&application_name=x")
+
+    assert url.startswith("postgresql+asyncpg://u:p@db:5432/app?")
+    assert "ssl=require" in url
+    assert "timeout" not in url
+    assert "sslmode" not in url
+    assert "application_name" not in url
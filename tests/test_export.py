@@ -1,16 +1,21 @@
 import csv
-import tempfile
-from app.utils import export_history_to_csv
+import gzip
+import io
+import json
+import sys
+import pytest
+from app.exporters import get_encoder, stream_history
+from app.utils import iter_history_rows
 from app.models import WeatherQuery
 from datetime import datetime
-import os
 import uuid
 
 
-def test_export_to_csv(test_db):
-    unique_city = f"ExportTestCity-{uuid.uuid4().hex[:6]}"
+async def collect(stream):
+    return b"".join([chunk async for chunk in stream])
 
-    now = datetime.utcnow()
+
+async def add_rows(test_db, unique_city, now):
     query = WeatherQuery(
         city=unique_city,
         unit="metric",
@@ -23,27 +28,109 @@ def test_export_to_csv(test_db):
         timestamp=now
     )
     test_db.add(query)
-    test_db.commit()
+    await test_db.commit()
 
     test_db.add(WeatherQuery(
         city="OtherCity", unit="metric", temperature=0.0,
         description="rain", humidity=80, wind_speed=2.0,
         served_from_cache=False, ip_address="127.0.0.1", timestamp=now
     ))
-    test_db.commit()
+    await test_db.commit()
+
+
+@pytest.mark.asyncio
+async def test_export_to_csv(test_db):
+    unique_city = f"ExportTestCity-{uuid.uuid4().hex[:6]}"
+    now = datetime.utcnow()
+    await add_rows(test_db, unique_city, now)
+
+    data = await collect(stream_history(test_db, get_encoder("csv"), city=unique_city))
+
+    rows = list(csv.reader(io.StringIO(data.decode('utf-8'))))
+    assert len(rows) == 2
+    assert rows[0][1] == "City"
+    assert rows[1][1] == unique_city
+    assert rows[1][2] == "metric"
+    assert rows[1][7] == "No"
+    assert rows[1][9] == now.isoformat()
+
+
+@pytest.mark.asyncio
+async def test_export_to_gzipped_csv(test_db):
+    unique_city = f"ExportTestCity-{uuid.uuid4().hex[:6]}"
+    await add_rows(test_db, unique_city, datetime.utcnow())
+
+    data = await collect(stream_history(test_db, get_encoder("csv.gz"), city=unique_city))
+
+    rows = list(csv.reader(io.StringIO(gzip.decompress(data).decode('utf-8'))))
+    assert len(rows) == 2
+    assert rows[1][1] == unique_city
+
+
+@pytest.mark.asyncio
+async def test_export_reads_rows_in_batches(test_db):
+    unique_city = f"ExportTestCity-{uuid.uuid4().hex[:6]}"
+    now = datetime.utcnow()
+    for _ in range(5):
+        test_db.add(WeatherQuery(
+            city=unique_city, unit="metric", temperature=1.0,
+            description="fog", humidity=95, wind_speed=0.5,
+            served_from_cache=True, ip_address="127.0.0.1", timestamp=now
+        ))
+    await test_db.commit()
+
+    batches = [rows async for rows in iter_history_rows(test_db, city=unique_city, batch_size=2)]
+
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert all(isinstance(r[0], int) for b in batches for r in b)
+
+
+@pytest.mark.asyncio
+async def test_export_to_ndjson_and_zstd(test_db):
+    zstandard = pytest.importorskip("zstandard")
+    unique_city = f"ExportTestCity-{uuid.uuid4().hex[:6]}"
+    now = datetime.utcnow()
+    await add_rows(test_db, unique_city, now)
+
+    data = await collect(stream_history(test_db, get_encoder("ndjson.zst"), city=unique_city))
+
+    lines = zstandard.ZstdDecompressor().decompressobj().decompress(data).splitlines()
+    assert len(lines) == 1
+    row = json.loads(lines[0])
+    assert row["city"] == unique_city
+    assert row["served_from_cache"] is False
+    assert row["timestamp"] == now.isoformat()
+
+
+@pytest.mark.asyncio
+async def test_export_to_parquet(test_db):
+    pq = pytest.importorskip("pyarrow.parquet")
+    unique_city = f"ExportTestCity-{uuid.uuid4().hex[:6]}"
+    now = datetime.utcnow()
+    await add_rows(test_db, unique_city, now)
+
+    data = await collect(stream_history(test_db, get_encoder("parquet"), city=unique_city))
+
+    table = pq.read_table(io.BytesIO(data)).to_pylist()
+    assert len(table) == 1
+    assert table[0]["city"] == unique_city
+    assert table[0]["humidity"] == 90
+    assert table[0]["timestamp"] == now
+
+
+def test_export_format_parameter(test_client):
+    response = test_client.get("/export", params={"format": "ndjson", "city": "NoSuchExportCity"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'filename="weather_history.ndjson"' in response.headers["content-disposition"]
 
-    file_path = export_history_to_csv(test_db, city=unique_city)
+    assert test_client.get("/export", params={"format": "xml"}).status_code == 422
 
-    assert os.path.exists(file_path)
-    assert file_path.endswith(".csv")
 
-    with open(file_path, mode='r', newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
+def test_export_without_optional_package(test_client, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
 
-        assert len(rows) == 2
-        assert rows[0][1] == "City"
-        assert rows[1][1] == unique_city
-        assert rows[1][2] == "metric"
+    response = test_client.get("/export", params={"format": "arrow"})
 
-    os.remove(file_path)
\ No newline at end of file
+    assert response.status_code == 400
+    assert "pyarrow" in response.json()["detail"]
@@ -0,0 +1,124 @@
+import csv
+import io
+import json
+import time
+import uuid
+from datetime import datetime
+import pytest
+from sqlalchemy import delete, insert
+from app.cache import redis_client
+from app.export_jobs import JOB_KEY_PREFIX, export_jobs, parse_range
+from app.models import WeatherQuery
+from tests.conftest import engine
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=990-2000", 1000) == (990, 999)
+    # Ignored: the whole file is sent.
+    assert parse_range("bytes=0-1,5-9", 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+    assert parse_range("bytes=9-1", 1000) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=1000-", 1000)
+
+
+def wait_for(test_client, job_id):
+    for _ in range(100):
+        job = test_client.get(f"/export/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("export job did not finish")
+
+
+def test_export_job_reuses_file_and_serves_ranges(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_jobs, "directory", str(tmp_path))
+    city = f"JobCity-{uuid.uuid4().hex[:6]}"
+    with engine.begin() as conn:
+        conn.execute(insert(WeatherQuery), [
+            dict(city=city, city_normalized=city.lower(), unit="metric", temperature=float(i), description="clear",
+                 humidity=40, wind_speed=1.0, served_from_cache=False, ip_address="127.0.0.1",
+                 timestamp=datetime.utcnow())
+            for i in range(30)
+        ])
+    try:
+        created = test_client.post("/export/jobs", json={"city": city, "city_match": "exact"})
+        assert created.status_code == 202
+        job = wait_for(test_client, created.json()["id"])
+        assert job["status"] == "done"
+        assert job["rows_written"] == 30
+        assert job["progress"] == 1.0
+
+        full = test_client.get(job["download_url"])
+        assert full.status_code == 200
+        assert full.headers["accept-ranges"] == "bytes"
+        rows = list(csv.reader(io.StringIO(full.text)))
+        assert len(rows) == 31
+
+        part = test_client.get(job["download_url"], headers={"Range": "bytes=10-"})
+        assert part.status_code == 206
+        assert part.headers["content-range"] == f"bytes 10-{len(full.content) - 1}/{len(full.content)}"
+        assert part.content == full.content[10:]
+
+        stale = test_client.get(job["download_url"], headers={"Range": "bytes=10-", "If-Range": '"other"'})
+        assert stale.status_code == 200
+        assert test_client.get(job["download_url"], headers={"Range": "bytes=999999-"}).status_code == 416
+
+        # Same filters, spelled differently, and no new rows: the finished job is returned.
+        again = test_client.post("/export/jobs", json={"city": city.upper(), "city_match": "exact"})
+        assert again.status_code == 200
+        assert again.json()["id"] == job["id"]
+    finally:
+        with engine.begin() as conn:
+            conn.execute(delete(WeatherQuery).where(WeatherQuery.city == city))
+
+
+def test_export_job_errors(test_client):
+    assert test_client.post("/export/jobs", json={"format": "xml"}).status_code == 422
+    assert test_client.get("/export/jobs/missing").status_code == 404
+    assert test_client.get("/export/jobs/missing/download").status_code == 404
+
+
+def save_job(**fields):
+    job = {
+        "id": uuid.uuid4().hex, "key": "k", "status": "queued", "format": "csv", "filters": {},
+        "max_id": None, "media_type": "text/csv", "extension": "csv", "file": f"{uuid.uuid4().hex}.csv",
+        "node": "other-replica", "rows_written": 0, "rows_estimate": None, "bytes_written": 0, "error": None,
+        "created_at": "2024-01-01T00:00:00Z", "started_at": None, "finished_at": None,
+        "heartbeat_at": time.time(),
+    }
+    job.update(fields)
+    redis_client.set(JOB_KEY_PREFIX + job["id"], json.dumps(job), ex=60)
+    return job
+
+
+def test_orphaned_job_is_reported_failed(test_client):
+    # Its worker crashed: the record stopped being refreshed.
+    orphan = save_job(status="running", heartbeat_at=time.time() - export_jobs.stale_after - 1)
+    live = save_job(status="running")
+
+    job = test_client.get(f"/export/jobs/{orphan['id']}").json()
+    assert job["status"] == "failed"
+    assert "other-replica" in job["error"]
+    assert json.loads(redis_client.get(JOB_KEY_PREFIX + orphan["id"]))["status"] == "failed"
+    assert test_client.get(f"/export/jobs/{live['id']}").json()["status"] == "running"
+
+
+def test_download_from_replica_without_the_file(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_jobs, "directory", str(tmp_path))
+    elsewhere = save_job(status="done")
+    response = test_client.get(f"/export/jobs/{elsewhere['id']}/download")
+    assert response.status_code == 503
+    assert "other-replica" in response.json()["detail"]
+
+    expired = save_job(status="done", node=export_jobs.node)
+    assert test_client.get(f"/export/jobs/{expired['id']}/download").status_code == 410
+
+    # With a shared EXPORT_DIR the file is found whichever replica wrote it.
+    (tmp_path / elsewhere["file"]).write_bytes(b"a,b\n")
+    response = test_client.get(f"/export/jobs/{elsewhere['id']}/download")
+    assert response.status_code == 200
+    assert response.content == b"a,b\n"
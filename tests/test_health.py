@@ -0,0 +1,72 @@
+import pytest
+from app import health
+from app.health import HealthMonitor
+from app.resilience import CircuitBreaker, openweather
+
+
+def make_monitor(**probes):
+    monitor = HealthMonitor(upstream_interval=60, stale_after=30)
+    calls = {name: 0 for name in monitor.probes}
+
+    def probe(name):
+        async def run():
+            calls[name] += 1
+            if name in probes:
+                raise probes[name]
+        return run
+
+    monitor.probes = {name: probe(name) for name in monitor.probes}
+    return monitor, calls
+
+
+@pytest.mark.asyncio
+async def test_ready_when_critical_dependencies_are_up():
+    monitor, _ = make_monitor(upstream=ConnectionError("unreachable"))
+    await monitor.check_now()
+
+    state = monitor.ready()
+    assert state["ok"] is True
+    assert state["status"] == "degraded"
+    assert state["dependencies"]["upstream"]["error"] == "unreachable"
+    assert state["dependencies"]["redis"]["latency_ms"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_not_ready_without_redis_or_fresh_results():
+    monitor, _ = make_monitor(redis=ConnectionError("refused"))
+    assert monitor.ready()["ok"] is False
+
+    await monitor.check_now()
+    assert monitor.ready()["ok"] is False
+    assert monitor.live()["ok"] is True
+
+
+@pytest.mark.asyncio
+async def test_upstream_probed_on_its_own_schedule():
+    monitor, calls = make_monitor()
+    await monitor.check_now()
+    await monitor.check_now()
+
+    assert calls["postgres"] == 2
+    assert calls["upstream"] == 1
+
+
+@pytest.mark.asyncio
+async def test_upstream_probed_while_breaker_is_open(monkeypatch):
+    requests = []
+
+    class Client:
+        async def get(self, url, timeout):
+            requests.append(url)
+            return type("Resp", (), {"status_code": 401})()
+
+    monkeypatch.setattr(health, "get_http_client", lambda: Client())
+    monkeypatch.setattr(openweather.breaker, "state", CircuitBreaker.OPEN)
+    monitor = HealthMonitor()
+    monitor.probes = {"upstream": health.probe_upstream}
+    await monitor.check_now()
+
+    upstream = monitor.dependencies()["upstream"]
+    assert len(requests) == 1
+    assert upstream["status"] == "up"
+    assert upstream["breaker"] == CircuitBreaker.OPEN
@@ -1,11 +1,12 @@
 import pytest
 from datetime import datetime, timedelta
-from app.weather import get_query_history
+from app.weather import get_query_history, get_query_history_page, count_query_history
 from app.models import WeatherQuery
 import uuid
 
 
-def test_get_history_pagination(test_db):
+@pytest.mark.asyncio
+async def test_get_history_pagination(test_db):
     unique_prefix = f"PageTest-{uuid.uuid4().hex[:4]}"
     now = datetime.utcnow()
 
@@ -22,16 +23,17 @@ def test_get_history_pagination(test_db):
             timestamp=now - timedelta(minutes=i)
         )
         test_db.add(query)
-    test_db.commit()
+    await test_db.commit()
 
-    page1 = get_query_history(test_db, page=1, page_size=10, city=f"{unique_prefix}-City")
+    page1 = await get_query_history(test_db, page=1, page_size=10, city=f"{unique_prefix}-City")
     assert len(page1) == 10
 
-    page2 = get_query_history(test_db, page=2, page_size=10, city=f"{unique_prefix}-City")
+    page2 = await get_query_history(test_db, page=2, page_size=10, city=f"{unique_prefix}-City")
     assert len(page2) == 5
 
 
-def test_filter_by_city(test_db):
+@pytest.mark.asyncio
+async def test_filter_by_city(test_db):
     unique_city_base = f"FilterCity-{uuid.uuid4().hex[:4]}"
     now = datetime.utcnow()
 
@@ -50,13 +52,14 @@ def test_filter_by_city(test_db):
             timestamp=now
         )
         test_db.add(query)
-    test_db.commit()
+    await test_db.commit()
 
-    results = get_query_history(test_db, city=unique_city_base)
+    results = await get_query_history(test_db, city=unique_city_base)
     assert len(results) == 3
 
 
-def test_filter_by_date_range(test_db):
+@pytest.mark.asyncio
+async def test_filter_by_date_range(test_db):
     unique_prefix = f"DateTest-{uuid.uuid4().hex[:4]}"
     now = datetime.utcnow()
 
@@ -76,18 +79,109 @@ def test_filter_by_date_range(test_db):
             timestamp=ts
         )
         test_db.add(query)
-    test_db.commit()
+    await test_db.commit()
 
-    results = get_query_history(
+    results = await get_query_history(
         test_db,
         city=unique_prefix,
         date_from=now - timedelta(hours=2)
     )
     assert len(results) == 2
 
-    results_all = get_query_history(
+    results_all = await get_query_history(
         test_db,
         city=unique_prefix,
         date_from=now - timedelta(days=3)
     )
-    assert len(results_all) == 3
\ No newline at end of file
+    assert len(results_all) == 3
+
+
+@pytest.mark.asyncio
+async def test_keyset_pagination_walks_all_rows(test_db):
+    unique_city = f"KeysetTest-{uuid.uuid4().hex[:4]}"
+    now = datetime.utcnow()
+
+    for i in range(7):
+        test_db.add(WeatherQuery(
+            city=unique_city,
+            unit="metric",
+            temperature=20.0,
+            description="clear",
+            humidity=50,
+            wind_speed=3.0,
+            served_from_cache=False,
+            ip_address="127.0.0.1",
+            # Two rows per timestamp so the id tie-breaker is exercised.
+            timestamp=now - timedelta(minutes=i // 2)
+        ))
+    await test_db.commit()
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        items, cursor = await get_query_history_page(test_db, city=unique_city, cursor=cursor, page_size=3)
+        seen.extend(items)
+        pages += 1
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert len({q.id for q in seen}) == 7
+    keys = [(q.timestamp, q.id) for q in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_invalid_cursor_rejected(test_db):
+    with pytest.raises(ValueError):
+        await get_query_history_page(test_db, cursor="not-a-cursor")
+
+
+@pytest.mark.asyncio
+async def test_count_only_when_requested(test_db):
+    unique_city = f"CountTest-{uuid.uuid4().hex[:4]}"
+    for _ in range(4):
+        test_db.add(WeatherQuery(
+            city=unique_city, unit="metric", temperature=20.0, description="clear",
+            humidity=50, wind_speed=3.0, served_from_cache=False,
+            ip_address="127.0.0.1", timestamp=datetime.utcnow()
+        ))
+    await test_db.commit()
+
+    assert await count_query_history(test_db, city=unique_city) == 4
+    assert await count_query_history(test_db, city=unique_city, estimated=True) >= 0
+
+
+@pytest.mark.asyncio
+async def test_city_normalized_on_insert_and_exact_match(test_db):
+    unique_city = f"ExactCity-{uuid.uuid4().hex[:4]}"
+    now = datetime.utcnow()
+
+    for city in [f"  {unique_city.upper()} ", f"{unique_city}-Suburb"]:
+        test_db.add(WeatherQuery(
+            city=city, unit="metric", temperature=20.0, description="clear",
+            humidity=50, wind_speed=3.0, served_from_cache=False,
+            ip_address="127.0.0.1", timestamp=now
+        ))
+    await test_db.commit()
+
+    exact = await get_query_history(test_db, city=unique_city, city_match="exact")
+    assert len(exact) == 1
+    assert exact[0].city_normalized == unique_city.lower()
+
+    substring = await get_query_history(test_db, city=unique_city)
+    assert len(substring) == 2
+
+
+@pytest.mark.asyncio
+async def test_substring_filter_escapes_wildcards(test_db):
+    unique_city = f"Wild_{uuid.uuid4().hex[:4]}"
+    test_db.add(WeatherQuery(
+        city=unique_city.replace("_", "x"), unit="metric", temperature=20.0, description="clear",
+        humidity=50, wind_speed=3.0, served_from_cache=False,
+        ip_address="127.0.0.1", timestamp=datetime.utcnow()
+    ))
+    await test_db.commit()
+
+    assert await get_query_history(test_db, city=unique_city) == []
@@ -0,0 +1,118 @@
+import json
+import math
+import time
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+import pytest
+from app.cache import CACHE_HARD_TTL, CACHE_SOFT_TTL, redis_client, local_cache
+from app.http_cache import choose_encoding, etag_matches, weak_etag, weather_cache_control
+from app.models import WeatherQuery
+from app.schemas import WeatherData
+from app.weather import resolve_city, weather_cache_key
+from sqlalchemy import delete, insert
+from tests.conftest import engine
+
+
+@pytest.fixture(autouse=True)
+def clear_redis():
+    redis_client.flushall()
+    local_cache.clear()
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate, br", brotli=True) == "br"
+    assert choose_encoding("gzip, deflate, br", brotli=False) == "gzip"
+    assert choose_encoding("br;q=0.5, gzip", brotli=True) == "gzip"
+    assert choose_encoding("*", brotli=True) == "br"
+    assert choose_encoding("identity", brotli=True) is None
+    assert choose_encoding("gzip;q=0", brotli=False) is None
+    assert choose_encoding("", brotli=True) is None
+
+
+def test_etag_matches_with_weak_comparison():
+    etag = weak_etag("Minsk", "metric", 5.0)
+    assert etag.startswith('W/"')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag.removeprefix("W/")}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('W/"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_weather_cache_control_follows_entry_ttl():
+    now = time.time()
+    assert weather_cache_control(now + 120, now) == \
+        f"public, max-age=120, stale-while-revalidate={int(CACHE_HARD_TTL - CACHE_SOFT_TTL)}"
+    stale = weather_cache_control(now - 60, now)
+    assert stale == f"public, max-age=0, stale-while-revalidate={int(CACHE_HARD_TTL - CACHE_SOFT_TTL) - 60}"
+    assert weather_cache_control(None) == "no-cache"
+    assert weather_cache_control(math.inf, now).startswith(f"public, max-age={int(CACHE_SOFT_TTL)},")
+
+
+def test_weather_conditional_get(test_client):
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.return_value = WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+
+        first = test_client.get("/weather", params={"city": "Minsk"})
+        assert first.status_code == 200
+        assert first.headers["cache-control"].startswith("public, max-age=")
+
+        again = test_client.get("/weather", params={"city": "Minsk"}, headers={"If-None-Match": first.headers["etag"]})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["etag"] == first.headers["etag"]
+
+        other_unit = test_client.get("/weather", params={"city": "Minsk", "unit": "imperial"},
+                                     headers={"If-None-Match": first.headers["etag"]})
+        assert other_unit.status_code == 200
+        assert mock_fetch.call_count == 1
+
+
+def test_weather_from_legacy_cache_entry(test_client):
+    query, _ = resolve_city("Minsk")
+    # Written before soft TTLs existed: decodes with fresh_until = inf.
+    redis_client.set(weather_cache_key(query), json.dumps(
+        {"temperature": 5.0, "description": "sunny", "humidity": 60, "wind_speed": 2.5}
+    ))
+
+    response = test_client.get("/weather", params={"city": "Minsk"})
+
+    assert response.status_code == 200
+    assert response.json()["served_from_cache"] is True
+    assert response.headers["cache-control"].startswith(f"public, max-age={int(CACHE_SOFT_TTL)},")
+
+
+def test_history_conditional_get(test_client):
+    with engine.begin() as conn:
+        conn.execute(insert(WeatherQuery), [
+            dict(city="EtagCity", city_normalized="etagcity", unit="metric", temperature=1.0, description="x",
+                 humidity=1, wind_speed=1.0, served_from_cache=False, ip_address="127.0.0.1",
+                 timestamp=datetime.utcnow())
+            for _ in range(3)
+        ])
+    try:
+        params = {"city": "EtagCity", "page_size": 2, "pagination": "keyset", "count": "exact"}
+        first = test_client.get("/history", params=params)
+        assert first.headers["cache-control"] == "private, no-cache"
+
+        again = test_client.get("/history", params=params, headers={"If-None-Match": first.headers["etag"]})
+
+        assert again.status_code == 304
+        assert again.headers["x-next-cursor"] == first.headers["x-next-cursor"]
+        assert again.headers["x-total-count"] == "3"
+    finally:
+        with engine.begin() as conn:
+            conn.execute(delete(WeatherQuery).where(WeatherQuery.city == "EtagCity"))
+
+
+def test_large_responses_are_compressed(test_client):
+    gzipped = test_client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in gzipped.headers["vary"]
+    assert "http_request_duration_seconds" in gzipped.text
+
+    plain = test_client.get("/metrics", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    small = test_client.get("/health/live", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
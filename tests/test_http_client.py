@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from app.http_client import get_http_client, init_http_client, close_http_client
+
+
+@pytest.mark.asyncio
+async def test_http_client_is_shared():
+    client = await init_http_client()
+    assert get_http_client() is client
+    assert get_http_client() is client
+
+    await close_http_client()
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_http_client_recreated_after_close():
+    client = await init_http_client()
+    await close_http_client()
+
+    new_client = get_http_client()
+    assert new_client is not client
+    assert not new_client.is_closed
+
+    await close_http_client()
+
+
+def test_http_client_from_previous_loop_is_closed():
+    async def first():
+        return get_http_client()
+
+    async def second():
+        client = get_http_client()
+        await asyncio.sleep(0)
+        return client
+
+    old = asyncio.run(first())
+    new = asyncio.run(second())
+
+    assert new is not old
+    assert old.is_closed
+    asyncio.run(close_http_client())
@@ -0,0 +1,62 @@
+import json
+import os
+import pytest
+from app import metrics
+from app.metrics import Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, route="/weather")
+
+    text = registry.render()
+
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{route="/weather",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/weather",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/weather",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/weather"} 4' in text
+    assert 'latency_seconds_sum{route="/weather"} 4.05' in text
+
+
+def test_collectors_run_before_export():
+    registry = Registry()
+    hits = registry.counter("hits_total", "Hits")
+    stats = {"hits": 7}
+    registry.add_collector(lambda: hits.set_total(stats["hits"]))
+
+    assert "hits_total 7" in registry.render()
+
+
+def test_worker_files_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    registry = Registry()
+    rejected = registry.counter("rejected_total", "Rejected", ("route",))
+    depth = registry.gauge("depth", "Depth")
+    rejected.inc(2, route="/weather")
+    depth.set(3)
+
+    # A worker that has exited: its counters still count, its gauges do not.
+    dead_pid = 2 ** 22 + 1
+    other = registry.snapshot()
+    other["rejected_total"]["values"] = [[["/weather"], 5.0]]
+    other["depth"]["values"] = [[[], 10.0]]
+    with open(os.path.join(tmp_path, f"metrics_{dead_pid}.json"), "w") as f:
+        json.dump(other, f)
+
+    text = registry.render()
+
+    assert 'rejected_total{route="/weather"} 7' in text
+    assert "depth 3" in text
+
+
+def test_cache_hit_ratio_is_derived():
+    registry = Registry()
+    lookups = registry.counter("cache_requests_total", "Lookups", ("tier", "result"))
+    registry.add_derived(metrics._derive_cache_hit_ratio)
+    lookups.inc(3, tier="l1", result="hit")
+    lookups.inc(1, tier="l1", result="miss")
+
+    assert 'cache_hit_ratio{tier="l1"} 0.75' in registry.render()
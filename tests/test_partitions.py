@@ -0,0 +1,49 @@
+from datetime import datetime
+from sqlalchemy import text
+from app.database import engine
+from app.partitions import (
+    interval_start, shift_interval, partition_name, parse_partition_name,
+    ensure_partitions, apply_retention, list_partitions, list_detached_partitions, archive_and_drop,
+    DEFAULT_PARTITION,
+)
+
+
+def test_partition_bounds_and_names():
+    ts = datetime(2026, 12, 31, 23, 59)
+    assert interval_start(ts, "month") == datetime(2026, 12, 1)
+    assert shift_interval(datetime(2026, 12, 1), 1, "month") == datetime(2027, 1, 1)
+    assert shift_interval(datetime(2026, 1, 1), -1, "month") == datetime(2025, 12, 1)
+    assert interval_start(ts, "day") == datetime(2026, 12, 31)
+    assert shift_interval(datetime(2026, 12, 31), 1, "day") == datetime(2027, 1, 1)
+
+    assert partition_name(datetime(2026, 3, 1), "month") == "weather_queries_p2026_03"
+    assert partition_name(datetime(2026, 3, 7), "day") == "weather_queries_p2026_03_07"
+    assert parse_partition_name("weather_queries_p2026_03") == (datetime(2026, 3, 1), "month")
+    assert parse_partition_name("weather_queries_p2026_03_07") == (datetime(2026, 3, 7), "day")
+    assert parse_partition_name(DEFAULT_PARTITION) is None
+
+
+def test_partitions_created_ahead_and_retained(tmp_path):
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            # A row that arrived before its partition existed sits in the default partition.
+            conn.execute(text("INSERT INTO weather_queries (city, timestamp) VALUES ('Far', '2031-02-10')"))
+
+            created = ensure_partitions(conn, now=datetime(2031, 1, 15), ahead=2, interval="month")
+            assert {"weather_queries_p2031_02", "weather_queries_p2031_03"} <= set(created)
+            assert conn.execute(text(
+                "SELECT tableoid::regclass::text FROM weather_queries WHERE city = 'Far'"
+            )).scalar() == "weather_queries_p2031_02"
+
+            detached = apply_retention(conn, now=datetime(2031, 3, 1), keep=2)
+            assert "weather_queries_p2031_01" in detached
+            assert "weather_queries_p2031_02" not in detached
+            assert "weather_queries_p2031_01" not in list_partitions(conn)
+            assert "weather_queries_p2031_01" in list_detached_partitions(conn)
+
+            archive_and_drop(conn, "weather_queries_p2031_01", str(tmp_path))
+            assert (tmp_path / "weather_queries_p2031_01.csv.gz").exists()
+            assert "weather_queries_p2031_01" not in list_detached_partitions(conn)
+        finally:
+            trans.rollback()
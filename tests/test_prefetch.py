@@ -0,0 +1,53 @@
+import pytest
+from app.cache import redis_client, local_cache, set_cached_weather, get_cached_entry
+from app.prefetch import Prefetcher, parse_cache_key
+from app.schemas import WeatherData
+
+WEATHER = WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    redis_client.flushall()
+    local_cache.clear()
+
+
+def test_parse_cache_key():
+    assert parse_cache_key("weather:new york") == "new york"
+
+
+@pytest.mark.asyncio
+async def test_cycle_refreshes_most_popular_keys_within_budget():
+    prefetcher = Prefetcher(top_n=3, interval=60, budget=1, concurrency=2)
+    for key, n in (("weather:minsk", 5), ("weather:oslo", 3),
+                   ("weather:rome", 2), ("weather:lima", 1)):
+        for _ in range(n):
+            prefetcher.record(key)
+    # Fresh well past the next cycle: nothing to do for it.
+    await set_cached_weather("weather:oslo", WEATHER, soft_ttl=600)
+
+    refreshed = []
+
+    async def refresh(city, key):
+        refreshed.append(key)
+
+    assert await prefetcher.run_cycle(refresh) == 1
+    assert refreshed == ["weather:minsk"]
+    assert prefetcher.stats["over_budget"] == 1
+
+    # Only one worker runs per interval.
+    assert await Prefetcher(interval=60).run_cycle(refresh) == 0
+
+
+@pytest.mark.asyncio
+async def test_avoided_miss_counted_once_per_prefetched_entry():
+    prefetcher = Prefetcher()
+    await set_cached_weather("weather:minsk", WEATHER, prefetched=True)
+    entry = await get_cached_entry("weather:minsk")
+
+    await prefetcher.note_hit("weather:minsk", entry)
+    await prefetcher.note_hit("weather:minsk", entry)
+    await Prefetcher().note_hit("weather:minsk", entry)
+
+    stats = await prefetcher.snapshot()
+    assert stats["avoided_misses_total"] == 1
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from app.rate_limiter import is_rate_limited
 from app.cache import redis_client
@@ -11,16 +12,16 @@ async def test_rate_limit_allows_30_requests():
     ip = "192.168.1.1"
 
     for _ in range(30):
-        assert is_rate_limited(ip) is False
+        assert await is_rate_limited(ip) is False
 
-    assert is_rate_limited(ip) is True
+    assert await is_rate_limited(ip) is True
 
 @pytest.mark.asyncio
 async def test_rate_limit_resets_after_60_seconds():
     ip = "192.168.1.1"
 
     for _ in range(30):
-        assert is_rate_limited(ip) is False
+        assert await is_rate_limited(ip) is False
 
     from app.rate_limiter import redis_client
     redis_client.expire(f"rate_limit:{ip}", 1)
@@ -28,4 +29,69 @@ async def test_rate_limit_resets_after_60_seconds():
     import time
     time.sleep(2)
 
-    assert is_rate_limited(ip) is False
\ No newline at end of file
+    assert await is_rate_limited(ip) is False
+
+@pytest.mark.asyncio
+async def test_rejection_reports_retry_after():
+    from app.rate_limiter import check_rate_limit
+
+    for _ in range(3):
+        assert (await check_rate_limit("10.0.0.1", limit=3, window=60)).allowed
+
+    result = await check_rate_limit("10.0.0.1", limit=3, window=60)
+    assert result.allowed is False
+    headers = result.headers()
+    assert headers["RateLimit-Limit"] == "3"
+    assert headers["RateLimit-Remaining"] == "0"
+    assert 0 < int(headers["Retry-After"]) <= 60
+
+
+@pytest.mark.asyncio
+async def test_route_limits_use_their_own_counter(monkeypatch):
+    from app import rate_limiter
+
+    monkeypatch.setattr(rate_limiter, "ROUTE_LIMITS", {"/weather/batch": (2, 60.0)})
+    ip = "10.0.0.2"
+
+    assert (await rate_limiter.check_rate_limit(ip, "/weather/batch")).allowed
+    assert (await rate_limiter.check_rate_limit(ip, "/weather/batch")).allowed
+    assert not (await rate_limiter.check_rate_limit(ip, "/weather/batch")).allowed
+    assert (await rate_limiter.check_rate_limit(ip, "/weather")).remaining == 29
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_refills(monkeypatch):
+    from app import rate_limiter
+
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_ALGORITHM", "token_bucket")
+    ip = "10.0.0.3"
+
+    for _ in range(5):
+        assert (await rate_limiter.check_rate_limit(ip, limit=5, window=1)).allowed
+    assert not (await rate_limiter.check_rate_limit(ip, limit=5, window=1)).allowed
+
+    await asyncio.sleep(0.3)
+    assert (await rate_limiter.check_rate_limit(ip, limit=5, window=1)).allowed
+
+
+@pytest.mark.asyncio
+async def test_local_batch_never_exceeds_limit(monkeypatch):
+    from app import rate_limiter
+
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_LOCAL_BATCH", 4)
+    monkeypatch.setattr(rate_limiter, "_local_leases", {})
+    calls = []
+    run_script = rate_limiter._run_script
+
+    async def counting(*args):
+        calls.append(args)
+        return await run_script(*args)
+
+    monkeypatch.setattr(rate_limiter, "_run_script", counting)
+
+    results = [await rate_limiter.check_rate_limit("10.0.0.4", limit=10, window=60) for _ in range(12)]
+
+    assert sum(r.allowed for r in results) == 10
+    assert [r.remaining for r in results[:10]] == list(range(9, -1, -1))
+    # 4 + 4 + 2 tokens reserved, then one rejection cached locally.
+    assert len(calls) == 4
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.resilience import Upstream, CircuitBreaker, CircuitOpenError, UpstreamError
+from app.cache import redis_client, local_cache, set_cached_weather
+from app.schemas import WeatherData
+from app.weather import get_weather_for_city
+
+
+@pytest.fixture(autouse=True)
+def clear_redis():
+    redis_client.flushall()
+    local_cache.clear()
+
+
+def make_upstream(**kwargs):
+    defaults = dict(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2), retries=0,
+                    retry_base_delay=0.01, attempt_timeout=1.0)
+    return Upstream("test", **{**defaults, **kwargs})
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_recovers_through_one_probe():
+    upstream = make_upstream()
+    failing = AsyncMock(side_effect=UpstreamError(502, "bad gateway"))
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            await upstream.call(failing)
+    with pytest.raises(CircuitOpenError):
+        await upstream.call(failing)
+    assert failing.call_count == 2
+
+    await asyncio.sleep(0.25)
+    assert await upstream.call(AsyncMock(return_value="ok")) == "ok"
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_only_retryable_errors_are_retried():
+    upstream = make_upstream(retries=2)
+    not_found = AsyncMock(side_effect=UpstreamError(404, "city not found"))
+    flaky = AsyncMock(side_effect=[TimeoutError(), "ok"])
+
+    with pytest.raises(UpstreamError):
+        await upstream.call(not_found)
+    assert await upstream.call(flaky) == "ok"
+
+    assert not_found.call_count == 1
+    assert flaky.call_count == 2
+    assert upstream.breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_takes_the_first_answer():
+    upstream = make_upstream(hedge_delay=0.05)
+    delays = [1.0, 0.0]
+
+    async def call():
+        await asyncio.sleep(delays.pop(0))
+        return "answer"
+
+    start = asyncio.get_running_loop().time()
+    assert await upstream.call(call) == "answer"
+    assert asyncio.get_running_loop().time() - start < 0.5
+    assert upstream.stats["hedged"] == 1
+
+
+@pytest.mark.asyncio
+async def test_last_known_value_served_when_upstream_unavailable(test_db):
+    weather = WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+    await set_cached_weather("weather:625144", weather)
+    redis_client.delete("weather:625144")
+    local_cache.clear()
+
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.side_effect = CircuitOpenError("Upstream circuit is open", 10)
+
+        result = await get_weather_for_city(test_db, "Minsk", "metric", "127.0.0.1")
+
+    assert result["temperature"] == 5.0
+    assert result["stale"] is True
+    assert result["served_from_cache"] is True
@@ -0,0 +1,60 @@
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select
+from app.models import WeatherQuery, WeatherStatsHourly
+from app.rollups import run_rollup
+from tests.conftest import engine
+
+CITY = "Rollupville"
+
+
+def add_rows(*rows):
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+    with engine.begin() as conn:
+        conn.execute(insert(WeatherQuery), [
+            dict(city=CITY, city_normalized=CITY.lower(), unit=unit, temperature=temperature, description="clear",
+                 humidity=humidity, wind_speed=wind_speed, served_from_cache=cached, ip_address="127.0.0.1",
+                 timestamp=hour + timedelta(minutes=10 * i))
+            for i, (unit, temperature, humidity, wind_speed, cached) in enumerate(rows)
+        ])
+    return hour
+
+
+def fold():
+    # The app's own rollup worker may hold the lock for a moment.
+    while run_rollup(settle_seconds=0)["skipped"]:
+        time.sleep(0.05)
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(delete(WeatherQuery).where(WeatherQuery.city == CITY))
+        conn.execute(delete(WeatherStatsHourly).where(WeatherStatsHourly.city_key == CITY.lower()))
+
+
+def test_rollup_folds_new_rows_once_in_metric_units(test_client):
+    try:
+        hour = add_rows(("metric", 10.0, 50, 2.0, False), ("imperial", 68.0, 70, 4.47388, True))
+        fold()
+        add_rows(("metric", 0.0, 90, 6.0, True))
+        fold()
+        fold()
+
+        with engine.connect() as conn:
+            row = conn.execute(select(WeatherStatsHourly).where(WeatherStatsHourly.city_key == CITY.lower())).one()
+        assert row.hour == hour
+        assert row.requests == 3
+        assert row.cache_hits == 2
+        assert row.temperature_min == 0.0
+        assert round(row.temperature_max, 6) == 20.0
+        assert round(row.wind_speed_max, 6) == 6.0
+
+        response = test_client.get("/stats", params={"city": CITY, "unit": "imperial"})
+        assert response.status_code == 200
+        [stats] = response.json()
+        assert stats["requests"] == 3
+        assert stats["cache_hit_ratio"] == round(2 / 3, 4)
+        assert stats["temperature_max"] == 68.0
+        assert stats["humidity_avg"] == 70.0
+    finally:
+        cleanup()
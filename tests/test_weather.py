@@ -1,17 +1,21 @@
 import pytest
 from unittest.mock import AsyncMock, patch
-from app.weather import get_weather_for_city
+from app.weather import get_weather_for_city, get_weather_for_cities
 from app.models import WeatherQuery
 from app.schemas import WeatherData
 from datetime import datetime, timedelta
 from app.rate_limiter import is_rate_limited
-from app.cache import redis_client
+from app.cache import redis_client, local_cache, set_cached_weather, get_cached_entry
+import asyncio
 import time
+import uuid
+from sqlalchemy import select, func, delete
 
 
 @pytest.fixture(autouse=True)
 def clear_redis():
     redis_client.flushall()
+    local_cache.clear()
 
 
 @pytest.mark.asyncio
@@ -19,9 +23,9 @@ async def test_rate_limit_allows_30_requests():
     ip = "192.168.1.1"
 
     for _ in range(30):
-        assert is_rate_limited(ip) is False
+        assert await is_rate_limited(ip) is False
 
-    assert is_rate_limited(ip) is True
+    assert await is_rate_limited(ip) is True
 
 
 @pytest.mark.asyncio
@@ -29,13 +33,13 @@ async def test_rate_limit_resets_after_60_seconds():
     ip = "192.168.1.1"
 
     for _ in range(30):
-        assert is_rate_limited(ip) is False
+        assert await is_rate_limited(ip) is False
 
     redis_client.expire(f"rate_limit:{ip}", 1)
 
     time.sleep(1.5)
 
-    assert is_rate_limited(ip) is False
+    assert await is_rate_limited(ip) is False
 
 
 @pytest.mark.asyncio
@@ -69,13 +73,109 @@ async def test_cache_miss_after_expiration(test_db):
 
         await get_weather_for_city(test_db, city, unit, "127.0.0.1")
 
-        redis_client.delete(f"weather:{city.lower()}:{unit}")
+        # Minsk resolves to its OpenWeatherMap ID through the city index.
+        redis_client.delete("weather:625144")
+        local_cache.delete("weather:625144")
 
         result = await get_weather_for_city(test_db, city, unit, "127.0.0.1")
         assert result["served_from_cache"] is False
         assert mock_fetch.call_count == 2
 
 
+@pytest.mark.asyncio
+async def test_stale_entry_served_while_refreshed_once(session_factory):
+    from app.weather import wait_for_refreshes
+
+    old = WeatherData(temperature=1.0, description="old", humidity=50, wind_speed=1.0)
+    new = WeatherData(temperature=9.0, description="new", humidity=50, wind_speed=1.0)
+    city = f"Minsk-{uuid.uuid4().hex[:6]}"
+    cache_key = f"weather:{city.lower()}"
+    await set_cached_weather(cache_key, old, soft_ttl=0, hard_ttl=60)
+
+    async def slow_fetch(city, unit):
+        await asyncio.sleep(0.1)
+        return new
+
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.side_effect = slow_fetch
+
+        async def request():
+            async with session_factory() as db:
+                return await get_weather_for_city(db, city, "metric", "127.0.0.1")
+
+        results = await asyncio.gather(*[request() for _ in range(5)])
+        assert all(r["temperature"] == 1.0 and r["served_from_cache"] for r in results)
+
+        await wait_for_refreshes()
+        assert mock_fetch.call_count == 1
+        entry = await get_cached_entry(cache_key)
+        assert entry.value == new
+        assert not entry.is_stale()
+
+    async with session_factory() as db:
+        await db.execute(delete(WeatherQuery).where(WeatherQuery.city == city))
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_batch_fetches_only_misses(test_db):
+    weather = WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+    await set_cached_weather("weather:625144", weather)
+
+    async def fetch(city, unit):
+        if city == "Atlantis":
+            raise Exception("API error: city not found")
+        return weather
+
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch, \
+            patch("app.weather.fetch_weather_group", new_callable=AsyncMock) as mock_group:
+        mock_fetch.side_effect = fetch
+        mock_group.return_value = {"3143244": weather, "2643743": weather}
+
+        results = await get_weather_for_cities(
+            test_db, ["Minsk", "Oslo", "oslo", "Atlantis", "2643743", "999"], "metric", "127.0.0.1"
+        )
+
+        assert [r["city"] for r in results] == ["Minsk", "Oslo", "oslo", "Atlantis", "2643743", "999"]
+        assert results[0]["served_from_cache"] is True
+        assert results[1]["served_from_cache"] is False
+        assert results[3]["error"] == "Failed to fetch weather data"
+        assert results[4]["temperature"] == 5.0
+        assert results[5]["error"] == "City not found"
+
+        # Only the unknown name goes to the per-city endpoint; known cities are fetched by ID.
+        assert mock_fetch.call_count == 1
+        mock_group.assert_called_once_with(["3143244", "2643743", "999"], "metric")
+        assert redis_client.exists("weather:3143244", "weather:2643743") == 2
+
+    rows = await test_db.scalars(select(WeatherQuery.city_id).where(WeatherQuery.ip_address == "127.0.0.1"))
+    assert sorted(rows.all()) == [625144, 2643743, 3143244, 3143244]
+
+
+@pytest.mark.asyncio
+async def test_units_share_one_cache_entry(test_db):
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.return_value = WeatherData(
+            temperature=5.0, description="sunny", humidity=60, wind_speed=2.5
+        )
+
+        metric = await get_weather_for_city(test_db, "Minsk", "metric", "127.0.0.1")
+        imperial = await get_weather_for_city(test_db, "Minsk", "imperial", "127.0.0.1")
+
+        assert mock_fetch.call_count == 1
+        mock_fetch.assert_called_once_with("625144", "metric")
+        assert metric["served_from_cache"] is False
+        assert imperial["served_from_cache"] is True
+        assert metric["temperature"] == 5.0
+        assert imperial["temperature"] == 41.0
+        assert imperial["unit"] == "imperial"
+
+    row = await test_db.scalar(
+        select(WeatherQuery).where(WeatherQuery.unit == "imperial", WeatherQuery.city == "Minsk")
+    )
+    assert row.wind_speed == 5.59
+
+
 @pytest.mark.asyncio
 async def test_api_failure_returns_500(test_db):
     with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
@@ -84,4 +184,74 @@ async def test_api_failure_returns_500(test_db):
         with pytest.raises(Exception) as exc_info:
             await get_weather_for_city(test_db, "Minsk", "metric", "127.0.0.1")
 
-        assert "API unreachable" in str(exc_info.value)
\ No newline at end of file
+        assert "API unreachable" in str(exc_info.value)
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch(session_factory):
+    async def slow_fetch(city, unit):
+        await asyncio.sleep(0.1)
+        return WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.side_effect = slow_fetch
+
+        city = f"Minsk-{uuid.uuid4().hex[:6]}"
+
+        async def request():
+            async with session_factory() as db:
+                return await get_weather_for_city(db, city, "metric", "127.0.0.1")
+
+        results = await asyncio.gather(*[request() for _ in range(5)])
+
+        assert mock_fetch.call_count == 1
+        assert all(r["served_from_cache"] is False for r in results)
+
+        async with session_factory() as db:
+            rows = await db.scalar(select(func.count()).where(WeatherQuery.city == city))
+            assert rows == 5
+            await db.execute(delete(WeatherQuery).where(WeatherQuery.city == city))
+            await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_redis_lock_coalesces_across_workers():
+    from app.weather import _fetch_with_redis_lock
+
+    async def slow_fetch(city, unit):
+        await asyncio.sleep(0.2)
+        return WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.side_effect = slow_fetch
+
+        results = await asyncio.gather(*[
+            _fetch_with_redis_lock("Minsk", "weather:minsk") for _ in range(3)
+        ])
+
+        assert mock_fetch.call_count == 1
+        assert all(r.temperature == 5.0 for r in results)
+        assert not redis_client.exists("lock:weather:minsk")
+
+
+@pytest.mark.asyncio
+async def test_redis_lock_waiters_retry_lock_when_holder_fails():
+    from app.weather import _fetch_with_redis_lock
+    calls = {"n": 0}
+
+    async def flaky_fetch(city, unit):
+        calls["n"] += 1
+        await asyncio.sleep(0.1)
+        if calls["n"] == 1:
+            raise Exception("API unreachable")
+        return WeatherData(temperature=5.0, description="sunny", humidity=60, wind_speed=2.5)
+
+    with patch("app.weather.fetch_weather_from_api", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.side_effect = flaky_fetch
+
+        results = await asyncio.gather(*[
+            _fetch_with_redis_lock("Minsk", "weather:minsk") for _ in range(4)
+        ], return_exceptions=True)
+
+        assert mock_fetch.call_count == 2
+        assert sum(isinstance(r, Exception) for r in results) == 1
+        assert sum(isinstance(r, WeatherData) for r in results) == 3